@@ -0,0 +1,685 @@
+"""Offline event-replay benchmark for the bot's hot handlers.
+
+Drives on_message, on_voice_state_update, check_requirements, the bulk
+eligibility pass, end_giveaway_instant, the channel picker and the profiler
+directly with synthetic stand-ins for discord objects. No token or network is needed. Results are printed (or written with --out)
+as JSON so runs can be compared between versions.
+
+The rest_burst scenarios end many giveaways at once through discord.py's real
+HTTP client, pointed at a local fake API that enforces per-channel rate limits.
+
+Usage:
+    python bench.py --users 5000 --messages 50000 --entrants 20000
+    python bench.py --rate 2000 --out bench_output.txt
+    python bench.py --only rest_burst rest_burst_unqueued --burst-giveaways 100
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+from tests.fakes import FakeChannel, FakeGuild, FakeMessage, FakeUser, FakeVoiceState, load_bot_module, make_giveaway
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+# -------------------- FAKE DISCORD API --------------------
+class FakeDiscordAPI:
+    """Just enough of Discord's REST API for messages, with rate limits.
+
+    Every (route, channel) pair is a bucket allowing `limit` requests per
+    `window` seconds, and all routes together get `global_limit` per
+    second. Responses carry the X-RateLimit headers discord.py reads, and
+    an over-limit request gets a 429 with retry_after.
+    """
+    def __init__(self, limit, window, global_limit):
+        self.limit = limit
+        self.window = window
+        self.global_limit = global_limit
+        self.global_window = (0.0, 0)
+        self.buckets = {}
+        self.requests = 0
+        self.limited = 0
+        self.next_id = 1100000000000000000
+        self.runner = None
+
+    def build_app(self):
+        app = web.Application()
+        app.router.add_get('/api/v10/users/@me', self.me)
+        app.router.add_post('/api/v10/channels/{channel}/messages', self.message)
+        app.router.add_get('/api/v10/channels/{channel}/messages/{message}', self.message)
+        app.router.add_patch('/api/v10/channels/{channel}/messages/{message}', self.message)
+        return app
+
+    async def start(self):
+        self.runner = web.AppRunner(self.build_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f'http://127.0.0.1:{port}/api/v10'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    @staticmethod
+    def json(body, status=200, headers=None):
+        # discord.py only parses bodies whose content-type is exactly application/json
+        return web.Response(body=json.dumps(body).encode(), status=status, headers={**(headers or {}), 'Content-Type': 'application/json'})
+
+    def user(self, uid):
+        return {'id': str(uid), 'username': f'user{uid}', 'discriminator': '0', 'avatar': None, 'global_name': None}
+
+    async def me(self, request):
+        return self.json(self.user(1))
+
+    async def message(self, request):
+        self.requests += 1
+        channel = request.match_info['channel']
+        key = (request.method, channel)
+        now = time.monotonic()
+        start, used = self.global_window
+        if now - start >= 1:
+            start, used = now, 0
+        if used >= self.global_limit:
+            self.limited += 1
+            retry_after = round(start + 1 - now, 3)
+            return self.json({'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': True},
+                             status=429, headers={'Via': '1.1 google', 'X-RateLimit-Global': 'true',
+                                                  'X-RateLimit-Scope': 'global', 'Retry-After': str(retry_after)})
+        self.global_window = (start, used + 1)
+        start, used = self.buckets.get(key, (now, 0))
+        if now - start >= self.window:
+            start, used = now, 0
+        reset_after = start + self.window - now
+        headers = {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(max(0, self.limit - used - 1)),
+            'X-RateLimit-Reset': str(time.time() + reset_after),
+            'X-RateLimit-Reset-After': f'{reset_after:.3f}',
+            'X-RateLimit-Bucket': f'{request.method}-messages',
+        }
+        if used >= self.limit:
+            self.limited += 1
+            headers['Via'] = '1.1 google'
+            headers['X-RateLimit-Remaining'] = '0'
+            return self.json({'message': 'You are being rate limited.', 'retry_after': round(reset_after, 3),
+                                      'global': False}, status=429, headers=headers)
+        self.buckets[key] = (start, used + 1)
+        mid = request.match_info.get('message')
+        if mid is None:
+            self.next_id += 1
+            mid = self.next_id
+        return self.json({
+            'id': str(mid), 'channel_id': channel, 'author': self.user(1), 'content': '',
+            'timestamp': datetime.now(timezone.utc).isoformat(), 'edited_timestamp': None, 'tts': False,
+            'mention_everyone': False, 'mentions': [], 'mention_roles': [], 'attachments': [], 'embeds': [],
+            'pinned': False, 'type': 0,
+        }, headers=headers)
+
+
+# -------------------- MEASUREMENT --------------------
+class LoopLagMonitor:
+    """Samples how late a short sleep wakes up, i.e. how long the loop was blocked."""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval))
+
+    def __enter__(self):
+        self.samples = []
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def summarize(latencies, elapsed, lag, peak_bytes):
+    return {
+        'events': len(latencies),
+        'seconds': round(elapsed, 4),
+        'events_per_sec': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 4),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 4),
+        'max_ms': round(max(latencies, default=0) * 1000, 4),
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 4) if latencies else 0.0,
+        'loop_lag_p50_ms': round(percentile(lag, 50) * 1000, 4),
+        'loop_lag_p99_ms': round(percentile(lag, 99) * 1000, 4),
+        'loop_lag_max_ms': round(max(lag, default=0) * 1000, 4),
+        'peak_mem_kib': round(peak_bytes / 1024, 1) if peak_bytes is not None else None,
+    }
+
+
+async def drive(events, handler, rate, trace_memory):
+    """Await handler(event) for each event, paced to `rate` events/sec (0 = flat out)."""
+    latencies = []
+    if trace_memory:
+        tracemalloc.reset_peak()
+    gap = 1 / rate if rate else 0
+    with LoopLagMonitor() as lag:
+        start = time.perf_counter()
+        for i, event in enumerate(events):
+            t0 = time.perf_counter()
+            await handler(event)
+            latencies.append(time.perf_counter() - t0)
+            if gap:
+                delay = start + (i + 1) * gap - time.perf_counter()
+                await asyncio.sleep(max(0, delay))
+            elif i % 64 == 0:
+                await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        await asyncio.sleep(0.01)
+    peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    return summarize(latencies, elapsed, lag.samples, peak)
+
+
+# -------------------- SCENARIOS --------------------
+def by_guild(items):
+    groups = {}
+    for item in items:
+        groups.setdefault(item.guild.id, []).append(item)
+    return groups
+
+
+async def bench_on_message(main, args, users, channels, rng):
+    # Members only talk in their own guild's channels
+    channels = by_guild(channels)
+    events = []
+    for _ in range(args.messages):
+        user = rng.choice(users)
+        events.append(FakeMessage(user, rng.choice(channels[user.guild.id])))
+    return await drive(events, main.on_message, args.rate, args.memory)
+
+
+async def bench_on_message_idle(main, args, users, channels, rng):
+    # Same traffic while no running giveaway needs message counts
+    rules = {gid: (state.message_rule, state.scoped_messages) for gid, state in main.guild_states.items()}
+    for state in main.guild_states.values():
+        state.message_rule, state.scoped_messages = None, []
+    try:
+        return await bench_on_message(main, args, users, channels, rng)
+    finally:
+        for gid, (rule, scoped) in rules.items():
+            main.guild_states[gid].message_rule, main.guild_states[gid].scoped_messages = rule, scoped
+
+
+async def bench_voice(main, args, users, channels, rng):
+    # Each user joins, moves, toggles deafen and leaves, in random order.
+    voice_channels = {}
+    for gid, chans in by_guild(channels).items():
+        voice_channels[gid] = chans[:max(2, len(chans) // 2)]
+        voice_channels[gid][-1].afk = True
+    events = []
+    state = {}
+    for _ in range(args.voice_events):
+        user = rng.choice(users)
+        before = state.get(user.id, FakeVoiceState())
+        roll = rng.random()
+        if before.channel is None:
+            after = FakeVoiceState(rng.choice(voice_channels[user.guild.id]))
+        elif roll < 0.3:
+            after = FakeVoiceState()
+        elif roll < 0.7:
+            after = FakeVoiceState(rng.choice(voice_channels[user.guild.id]))
+        else:
+            after = FakeVoiceState(before.channel, self_deaf=not before.self_deaf)
+        state[user.id] = after
+        events.append((user, before, after))
+
+    async def handler(event):
+        await main.on_voice_state_update(*event)
+    return await drive(events, handler, args.rate, args.memory)
+
+
+async def bench_check_requirements(main, args, users, channels, rng):
+    reqs = {'min_messages': 3, 'min_vc_minutes': 1}
+    since = time.time() - 3600
+    events = [rng.choice(users) for _ in range(args.entrants)]
+
+    async def handler(user):
+        main.check_requirements(main.state_for(user.guild.id), user.id, reqs, since)
+    return await drive(events, handler, 0, args.memory)
+
+
+async def bench_bulk_eligibility(main, args, users, channels, rng):
+    # One batch per giveaway, the way endings and rerolls check their entrants
+    reqs = {'min_messages': 3, 'min_vc_minutes': 1}
+    since = time.time() - 3600
+    batches = []
+    for group in by_guild(users).values():
+        ids = [u.id for u in group]
+        for _ in range(args.giveaways):
+            batches.append((main.state_for(group[0].guild.id), rng.sample(ids, min(len(ids), args.entrants))))
+
+    async def handler(batch):
+        main.eligibility(batch[0], batch[1], reqs, since)
+    result = await drive(batches, handler, 0, args.memory)
+    result['entrants_per_batch'] = args.entrants
+    return result
+
+
+async def bench_weighted_draw(main, args, users, channels, rng):
+    # Alias table build plus k distinct weighted winners, once per giveaway
+    ids = [u.id for u in users][:args.entrants]
+    weights = [rng.randint(1, 5) for _ in ids]
+
+    async def handler(seed):
+        main.AliasSampler(ids, weights, main.random.Random(seed)).sample(args.winners)
+    result = await drive(range(args.giveaways), handler, 0, args.memory)
+    result['entrants_per_draw'] = len(ids)
+    return result
+
+
+async def bench_end_giveaway(main, args, users, channels, rng):
+    reqs = {'min_messages': 3}
+    members = {gid: [u.id for u in group] for gid, group in by_guild(users).items()}
+    mids = []
+    for i in range(args.giveaways):
+        channel = rng.choice(channels)
+        ids = members[channel.guild.id]
+        entrants = rng.sample(ids, min(len(ids), args.entrants))
+        mids.append(make_giveaway(main, 900000000000000000 + i, channel, reqs, entrants, args.winners))
+    for state in main.guild_states.values():
+        main.refresh_activity_epochs(state)
+
+    async def handler(mid):
+        await main.end_giveaway_instant(mid, '🎉', reqs)
+    result = await drive(mids, handler, 0, args.memory)
+    result['entrants_per_giveaway'] = args.entrants
+    return result
+
+
+async def bench_edit_giveaway(main, args, users, channels, rng):
+    # Prize and end-time edits of running giveaways. FakeChannel has no
+    # fetch_message, so any edit that still fetched the post would fail here.
+    mids = [make_giveaway(main, 940000000000000000 + i, rng.choice(channels), {'min_messages': 3}, [])
+            for i in range(args.giveaways)]
+    edits = [(rng.choice(mids), i) for i in range(args.messages // 10)]
+    # Measure rendering, not the REST queue's global pacing
+    rate = main.rest.rate
+    main.rest.rate = main.rest.tokens = 10**6
+
+    async def handler(edit):
+        mid, i = edit
+        data = main.giveaways[mid]
+        if i % 2:
+            data['prize'] = f'Prize {i}'
+            await main.rerender_giveaway(mid, data, prize=data['prize'])
+        else:
+            data['end_time'] += 60
+            await main.rerender_giveaway(mid, data, end_time=data['end_time'])
+    try:
+        result = await drive(edits, handler, 0, args.memory)
+    finally:
+        main.rest.rate = main.rest.tokens = rate
+    for mid in mids:
+        main.remove_giveaway(mid)
+    result['cache_hits'] = main.giveaway_messages.hits
+    result['cache_misses'] = main.giveaway_messages.misses
+    return result
+
+
+async def bench_reroll(main, args, users, channels, rng):
+    # Rerolls of ended giveaways, drawn from the archived snapshots
+    members = {gid: [u.id for u in group] for gid, group in by_guild(users).items()}
+    ended = []
+    for i in range(args.giveaways):
+        channel = rng.choice(channels)
+        ids = members[channel.guild.id]
+        mid = make_giveaway(main, 910000000000000000 + i, channel, {}, rng.sample(ids, min(len(ids), args.entrants)))
+        await main.end_giveaway_instant(mid, '🎉', {})
+        ended.append((main.state_for(channel.guild.id), mid))
+
+    async def handler(item):
+        main.reroll_archived(*item)
+    result = await drive(ended * 5, handler, 0, args.memory)
+    result['entrants_per_giveaway'] = args.entrants
+    return result
+
+
+async def bench_rest_burst(main, args, users, channels, rng, queued=True):
+    # --burst-giveaways endings and as many cosmetic edits, all at once,
+    # spread over --burst-channels channels of the fake API
+    api = FakeDiscordAPI(args.fake_limit, args.fake_window, args.fake_global)
+    route_base = main.discord.http.Route.BASE
+    main.discord.http.Route.BASE = await api.start()
+    limits = (main.rest.concurrency, main.rest.per_channel, main.rest.rate)
+    # Pace a little under the fake global limit, as REST_GLOBAL_RATE does for Discord's
+    main.rest.rate = main.rest.tokens = args.fake_global * 0.9
+    if not queued:
+        main.rest.concurrency = main.rest.per_channel = main.rest.rate = main.rest.tokens = 10**6
+    http_log = main.logging.getLogger('discord.http')
+    http_log.propagate = False
+    get_channel = main.bot.get_channel
+    guild = channels[0].guild
+    try:
+        # Fresh session and no learned buckets, so every run starts cold
+        main.bot.http.connector = main.discord.utils.MISSING
+        main.bot.http._buckets.clear()
+        main.bot.http._bucket_hashes.clear()
+        await main.bot.http.static_login('bench-token')
+        partials = {}
+        mids = []
+        for i in range(args.burst_giveaways):
+            cid = 9000 + i % args.burst_channels
+            partials[cid] = main.bot.get_partial_messageable(cid, guild_id=guild.id)
+            mids.append(make_giveaway(main, 920000000000000000 + i + (0 if queued else 10**6),
+                                      FakeChannel(cid, guild), {}, [u.id for u in users[:50]]))
+        main.bot.get_channel = lambda cid: partials.get(cid) or get_channel(cid)
+        done = {'announce': [], 'edit': []}
+        start = time.perf_counter()
+
+        async def announce(mid):
+            await main.end_giveaway_instant(mid, '🎉', {})
+            done['announce'].append(time.perf_counter() - start)
+
+        async def edit(i, mid):
+            channel = partials[9000 + i % args.burst_channels]
+            await main.rest.call(main.rest.EDIT, channel.id, channel.get_partial_message(int(mid)).edit, content='edited')
+            done['edit'].append(time.perf_counter() - start)
+
+        # Edits are submitted first, so anything that sends them first is FIFO
+        await asyncio.gather(*(edit(i, mid) for i, mid in enumerate(mids)), *(announce(mid) for mid in mids))
+        elapsed = time.perf_counter() - start
+    finally:
+        main.bot.get_channel = get_channel
+        main.rest.concurrency, main.rest.per_channel, main.rest.rate = limits
+        main.rest.tokens = main.rest.rate
+        main.discord.http.Route.BASE = route_base
+        http_log.propagate = True
+        await main.bot.http.close()
+        await api.stop()
+
+    def ms(values, pct):
+        return round(percentile(values, pct) * 1000, 1)
+    return {
+        'seconds': round(elapsed, 3),
+        'requests': api.requests,
+        'rate_limited': api.limited,
+        'announce_p50_ms': ms(done['announce'], 50),
+        'announce_max_ms': ms(done['announce'], 100),
+        'edit_p50_ms': ms(done['edit'], 50),
+        'edit_max_ms': ms(done['edit'], 100),
+    }
+
+
+async def bench_rest_burst_unqueued(main, args, users, channels, rng):
+    return await bench_rest_burst(main, args, users, channels, rng, queued=False)
+
+
+async def bench_channel_picker(main, args, users, channels, rng):
+    # Opening the setup channel picker in a guild with --picker-channels text
+    # channels; a role change drops the index every 100 opens
+    guild = FakeGuild(710000000000000000)
+    guild.text_channels = [FakeChannel(200000 + i, guild) for i in range(args.picker_channels)]
+
+    async def handler(i):
+        if i % 100 == 0:
+            main.invalidate_channels(guild)
+        main.ChannelSelectView(main.postable_channels(guild))
+    result = await drive(range(args.picker_opens), handler, 0, args.memory)
+    result['channels'] = args.picker_channels
+    result['postable'] = len(main.postable_channels(guild))
+    return result
+
+
+async def bench_autocomplete(main, args, users, channels, rng):
+    # Slash-command autocomplete over --lookup-giveaways giveaways, typed one
+    # character at a time from a short ID or a prize
+    words = ['nitro', 'classic', 'steam', 'gift', 'card', 'skin', 'pack', 'role', 'key', 'merch']
+    index = main.GiveawayIndex()
+    for i in range(args.lookup_giveaways):
+        index.add(str(930000000000000000 + i), {'giveaway_id': f'{rng.getrandbits(24):06x}',
+                                                  'prize': ' '.join(rng.sample(words, 2)).title()})
+    index.sort()
+    shorts = list(index.short)
+    queries = []
+    for _ in range(args.messages // 4):
+        term = rng.choice(shorts) if rng.random() < 0.5 else rng.choice(words)
+        queries.append(term[:rng.randint(0, len(term))])
+
+    async def handler(query):
+        index.search(query)
+    result = await drive(queries, handler, 0, args.memory)
+    result['giveaways'] = args.lookup_giveaways
+    result['index_keys'] = len(index.keys)
+    return result
+
+
+async def bench_startup(main, args, users, channels, rng):
+    # A guild with --startup-users saved stats: loading them all at once (what
+    # startup used to do for every guild before connecting) against the
+    # batched background warm-up, which keeps the loop responsive
+    gid = 720000000000000000
+    key = (main.STATS_FILE, gid)
+    rows = {str(10**17 + i): {'messages': rng.randint(0, 5000), 'vc_time': rng.random() * 600, 'name': f'user{i}'}
+            for i in range(args.startup_users)}
+    main.persistence.backend.write(key, rows, [], True)
+    del rows
+
+    start = time.perf_counter()
+    eager = main.StatsStore.from_rows(main.persistence.load(key))
+    eager_seconds = time.perf_counter() - start
+    del eager
+
+    start = time.perf_counter()
+    state = main.state_for(gid)
+    partition_seconds = time.perf_counter() - start
+
+    # Message and voice traffic for a running giveaway while the stats warm
+    # up: it is buffered instead of forcing the whole partition to load
+    guild = FakeGuild(gid)
+    text, voice = FakeChannel(600, guild), FakeChannel(601, guild)
+    mid = make_giveaway(main, 990000000000000000, text, {'min_messages': 1, 'min_vc_minutes': 1}, [])
+    main.refresh_activity_epochs(state)
+    members = [FakeUser(10**17 + rng.randrange(args.startup_users), guild) for _ in range(1000)]
+    latencies = []
+
+    async def traffic():
+        for i in range(args.messages // 10):
+            member = rng.choice(members)
+            start = time.perf_counter()
+            if i % 4:
+                await main.on_message(FakeMessage(member, text))
+            else:
+                main.state_for(gid).vc.transition(member.id, FakeVoiceState(voice if i % 8 else None))
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0)
+
+    with LoopLagMonitor() as lag:
+        start = time.perf_counter()
+        sender = asyncio.create_task(traffic())
+        await main.warm_stats()
+        warm_seconds = time.perf_counter() - start
+        buffered = len(state.pending_activity)
+        await sender
+    loaded = len(state.stats)
+    main.remove_giveaway(mid)
+    main.guild_states.pop(gid)
+    return {
+        'users': loaded,
+        'eager_load_seconds': round(eager_seconds, 3),
+        'partition_ms': round(partition_seconds * 1000, 3),
+        'warm_seconds': round(warm_seconds, 3),
+        'warm_loop_lag_p99_ms': round(percentile(lag.samples, 99) * 1000, 3),
+        'warm_loop_lag_max_ms': round(max(lag.samples, default=0) * 1000, 3),
+        'warmup_events': len(latencies),
+        'warmup_event_max_ms': round(max(latencies, default=0) * 1000, 3),
+        'buffered_after_warm': buffered,
+    }
+
+
+async def bench_profiling(main, args, users, channels, rng):
+    # on_message (timed where @bot.event registered it) called directly,
+    # through discord.py's event dispatch, and through the dispatch while
+    # $profile's stack sampler is running
+    channels = by_guild(channels)
+    events = []
+    for _ in range(args.messages):
+        user = rng.choice(users)
+        events.append(FakeMessage(user, rng.choice(channels[user.guild.id])))
+
+    async def dispatched(message):
+        await main.bot._run_event(main.on_message, 'on_message', message)
+    result = {'direct': await drive(events, main.on_message, args.rate, args.memory),
+              'dispatched': await drive(events, dispatched, args.rate, args.memory)}
+    sampler = main.StackSampler(threading.get_ident(), main.PROFILE_SAMPLE_INTERVAL)
+    sampler.start()
+    try:
+        result['sampled'] = await drive(events, dispatched, args.rate, args.memory)
+    finally:
+        sampler.stopped.set()
+        sampler.join()
+    result['samples'] = sum(sampler.stacks.values())
+    return result
+
+
+async def bench_flush(main, args, users, channels, rng):
+    async def handler(_):
+        for state in main.guild_states.values():
+            main.persistence.mark_dirty(state.stats_key)
+            main.persistence.mark_dirty(state.giveaways_key)
+        await main.persistence.flush()
+    return await drive(range(3), handler, 0, args.memory)
+
+
+SCENARIOS = {
+    'on_message': bench_on_message,
+    'on_message_idle': bench_on_message_idle,
+    'on_voice_state_update': bench_voice,
+    'check_requirements': bench_check_requirements,
+    'bulk_eligibility': bench_bulk_eligibility,
+    'weighted_draw': bench_weighted_draw,
+    'end_giveaway_instant': bench_end_giveaway,
+    'edit_giveaway': bench_edit_giveaway,
+    'reroll_archived': bench_reroll,
+    'rest_burst': bench_rest_burst,
+    'rest_burst_unqueued': bench_rest_burst_unqueued,
+    'channel_picker': bench_channel_picker,
+    'autocomplete': bench_autocomplete,
+    'startup': bench_startup,
+    'profiling': bench_profiling,
+    'persistence_flush': bench_flush,
+}
+
+
+# -------------------- RUNNER --------------------
+def git_version():
+    try:
+        out = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=HERE,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='giveaway-bench-')
+    main = load_bot_module(workdir)
+    # Users and channels are spread over --guilds guilds, each its own partition
+    guilds = [FakeGuild(700000000000000000 + i) for i in range(args.guilds)]
+    channels = [FakeChannel(100 + i, guilds[i % len(guilds)]) for i in range(args.channels)]
+    channel_map = {c.id: c for c in channels}
+    main.bot.get_channel = channel_map.get
+    users = [FakeUser(10**17 + i, guilds[i % len(guilds)]) for i in range(args.users)]
+
+    # A running giveaway per guild so baselines and snapshots are exercised
+    for i, chans in enumerate(by_guild(channels).values()):
+        make_giveaway(main, 800000000000000000 + i, chans[0], {'min_messages': 1, 'min_vc_minutes': 1}, [])
+    for state in main.guild_states.values():
+        main.refresh_activity_epochs(state)
+
+    if args.memory:
+        tracemalloc.start()
+    results = {}
+    selected = args.only or list(SCENARIOS)
+    # Silence the bot's own prints; their cost is still measured
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name in selected:
+            results[name] = await SCENARIOS[name](main, args, users, channels, rng)
+    if args.memory:
+        tracemalloc.stop()
+
+    return {
+        'meta': {
+            'version': git_version(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'storage_backend': main.STORAGE_BACKEND,
+            'numpy': main.np.__version__ if main.np is not None else None,
+            'timestamp': time.time(),
+            'config': {k: v for k, v in vars(args).items() if k != 'out'},
+            'stats_store': {str(gid): state.stats.memory_report()['total_bytes']
+                            for gid, state in main.guild_states.items()},
+            'persistence': main.persistence.stats(),
+        },
+        'scenarios': results,
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--guilds', type=int, default=1, help='users and channels are split evenly across guilds')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--voice-events', type=int, default=10000)
+    parser.add_argument('--entrants', type=int, default=5000)
+    parser.add_argument('--giveaways', type=int, default=5)
+    parser.add_argument('--winners', type=int, default=1)
+    parser.add_argument('--burst-giveaways', type=int, default=40, help='giveaways ending together in rest_burst')
+    parser.add_argument('--burst-channels', type=int, default=4)
+    parser.add_argument('--fake-limit', type=int, default=5, help='fake API requests per bucket per window')
+    parser.add_argument('--fake-window', type=float, default=1.0, help='fake API rate limit window, seconds')
+    parser.add_argument('--fake-global', type=int, default=20, help='fake API requests per second across all routes')
+    parser.add_argument('--picker-channels', type=int, default=2000, help='text channels in the channel_picker guild')
+    parser.add_argument('--picker-opens', type=int, default=1000)
+    parser.add_argument('--lookup-giveaways', type=int, default=20000, help='giveaways indexed in autocomplete')
+    parser.add_argument('--startup-users', type=int, default=200000, help='saved stats rows in the startup scenario')
+    parser.add_argument('--rate', type=float, default=0, help='events/sec for the event scenarios, 0 = flat out')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--only', nargs='+', choices=list(SCENARIOS))
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='skip tracemalloc (lower overhead)')
+    parser.add_argument('--out', help='write JSON here instead of stdout')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(os.path.join(HERE, args.out) if not os.path.isabs(args.out) else args.out, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
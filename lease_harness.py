@@ -0,0 +1,223 @@
+"""Multi-process harness for the giveaway-ending leases.
+
+Starts several bot processes against one shared LEASE_FILE and one shared
+sqlite store seeded with giveaways with staggered end times, and checks that
+every giveaway was announced exactly once, and on time. One worker can be
+made to crash in the middle of an ending (after claiming it, before
+announcing) to show that its lease expires and another worker finishes the
+job. The last worker can also create giveaways after the others started,
+and be killed right after, to show that the survivors pick those up from the
+store and end them. No token or network is needed; announcements go to a
+shared log file instead of Discord.
+
+Usage:
+    python lease_harness.py --workers 4 --giveaways 200 --spread 5
+    python lease_harness.py --workers 3 --crash-after 5 --ttl 2
+    python lease_harness.py --workers 3 --runtime 20 --kill-creator
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from tests.fakes import FakeChannel, FakeGuild, FakePartialMessage, load_bot_module, make_giveaway
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SEEDED = 900000000000000000
+CREATED = 910000000000000000
+# Announced later than this after the end time counts as late
+LATE_AFTER = 1.0
+
+
+def end_times(start, spread, count):
+    return [start + spread * (i + 0.5) / count for i in range(count)]
+
+
+# -------------------- WORKER --------------------
+class AnnouncementLog:
+    def __init__(self, path, worker, crash_after):
+        self.path = path
+        self.worker = worker
+        self.crash_after = crash_after
+        self.count = 0
+
+    def record(self, mid):
+        self.count += 1
+        if self.crash_after and self.count == self.crash_after:
+            # Die holding the lease, before the announcement goes out
+            os._exit(3)
+        # O_APPEND writes this small are atomic across processes
+        with open(self.path, 'a') as f:
+            f.write(f"{mid} {self.worker} {time.time():.3f}\n")
+
+
+class LoggedMessage(FakePartialMessage):
+    async def reply(self, *args, **kwargs):
+        self.channel.log.record(self.id)
+
+
+class LoggedChannel(FakeChannel):
+    def __init__(self, cid, guild, log):
+        super().__init__(cid, guild)
+        self.log = log
+
+    def get_partial_message(self, mid):
+        return LoggedMessage(self, mid)
+
+    async def fetch_message(self, mid):
+        # Giveaways picked up from another process are not in the live
+        # entrant index; nobody reacted to these
+        return SimpleNamespace(id=mid, reactions=[])
+
+
+def run_seed(args):
+    # Writes the giveaways every worker loads at startup to the shared store
+    main = load_bot_module(tempfile.mkdtemp(prefix='lease-seed-'))
+    channel = FakeChannel(100, FakeGuild(1))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i, end_time in enumerate(end_times(args.start, args.spread, args.giveaways)):
+            mid = make_giveaway(main, SEEDED + i, channel, {}, [1, 2, 3])
+            main.giveaways[mid]['end_time'] = end_time
+        main.persistence.flush_sync()
+    return {'seeded': args.giveaways}
+
+
+async def run_worker(args):
+    workdir = tempfile.mkdtemp(prefix=f'lease-worker-{args.worker}-')
+    main = load_bot_module(workdir)
+    log = AnnouncementLog(args.log, args.worker, args.crash_after)
+    channel = LoggedChannel(100, FakeGuild(1), log)
+    main.bot.get_channel = {channel.id: channel}.get
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        main.load_partitions()
+        # What reconcile_all_entrants does once connected
+        main.entrants_synced.update(main.giveaways)
+
+        await main.leases.heartbeat()
+        main.lease_heartbeat.start()
+        # Give the other workers time to register before endings are split
+        await asyncio.sleep(min(1.0, main.LEASE_TTL / 2))
+        main.rehydrate_giveaways()
+        # Publishes what this worker holds before anything is due
+        await main.leases.heartbeat()
+        main.scheduler.start()
+
+        if args.create:
+            # As /giveaway does: the new giveaway is stored, scheduled here and
+            # announced to the other workers with the next heartbeat
+            for i, end_time in enumerate(end_times(args.start, args.spread, args.create)):
+                mid = make_giveaway(main, CREATED + i, channel, {}, [1, 2, 3])
+                main.giveaways[mid]['end_time'] = end_time
+                main.hold_giveaway(mid, main.giveaways[mid])
+            await main.persistence.flush()
+            await main.leases.heartbeat()
+            if args.kill_creator:
+                os._exit(3)
+
+        deadline = time.monotonic() + args.timeout
+        while main.giveaways and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        await main.leases.leave()
+    return {'worker': args.worker, 'announced': log.count, 'left': len(main.giveaways)}
+
+
+# -------------------- COORDINATOR --------------------
+def run_coordinator(args):
+    shared = tempfile.mkdtemp(prefix='lease-harness-')
+    log_path = os.path.join(shared, 'announcements.log')
+    open(log_path, 'w').close()
+    env = dict(os.environ, LEASE_FILE=os.path.join(shared, 'leases.db'), LEASE_TTL=str(args.ttl),
+               STORAGE_BACKEND='sqlite', DB_FILE=os.path.join(shared, 'giveaway_bot.db'))
+    script = [sys.executable, os.path.abspath(__file__)]
+    # Seeding and worker startup take about 3s. A killed creator still counts
+    # as live for one TTL after its last heartbeat; endings only start once
+    # the survivors have seen it go.
+    start = time.time() + 4 + (args.ttl + max(1.0, args.ttl / 3) + 1 if args.kill_creator else 0)
+    timeout = start - time.time() + args.spread + 6 * args.ttl + 10
+    common = ['--giveaways', str(args.giveaways), '--spread', str(args.spread), '--start', str(start)]
+    subprocess.run(script + ['--seed'] + common, env=env, cwd=HERE, stdout=subprocess.DEVNULL, check=True)
+
+    procs = []
+    for i in range(args.workers):
+        cmd = script + ['--worker', str(i), '--log', log_path, '--timeout', str(timeout)] + common
+        if i == 0 and args.crash_after:
+            cmd += ['--crash-after', str(args.crash_after)]
+        if i == args.workers - 1 and args.runtime:
+            cmd += ['--create', str(args.runtime)] + (['--kill-creator'] if args.kill_creator else [])
+        procs.append(subprocess.Popen(cmd, env=dict(env, WORKER_ID=f'worker-{i}'), cwd=HERE,
+                                      stdout=subprocess.PIPE, text=True))
+
+    workers = []
+    for i, proc in enumerate(procs):
+        out, _ = proc.communicate(timeout=timeout + 30)
+        lines = out.strip().splitlines()
+        result = json.loads(lines[-1]) if proc.returncode == 0 and lines else {'worker': i}
+        result['exit_code'] = proc.returncode
+        workers.append(result)
+
+    due = {str(SEEDED + i): t for i, t in enumerate(end_times(start, args.spread, args.giveaways))}
+    due.update({str(CREATED + i): t for i, t in enumerate(end_times(start, args.spread, args.runtime))})
+    announced, late = Counter(), {}
+    with open(log_path) as f:
+        for line in f:
+            mid, _, at = line.split()
+            announced[mid] += 1
+            late[mid] = max(late.get(mid, 0.0), float(at) - due[mid])
+    duplicates = {mid: n for mid, n in announced.items() if n > 1}
+    missing = sorted(set(due) - set(announced))
+    exactly_once = not duplicates and not missing
+    late_count = sum(1 for seconds in late.values() if seconds > LATE_AFTER)
+    return {
+        'config': {k: v for k, v in vars(args).items()
+                   if k in ('workers', 'giveaways', 'spread', 'ttl', 'crash_after', 'runtime', 'kill_creator')},
+        'workers': workers,
+        'announced': sum(announced.values()),
+        'duplicates': duplicates,
+        'missing': missing,
+        'exactly_once': exactly_once,
+        'max_late_seconds': round(max(late.values(), default=0.0), 3),
+        'late': late_count,
+        # A crash mid-ending holds its giveaway up for a LEASE_TTL by design
+        'ok': exactly_once and (late_count == 0 or bool(args.crash_after)),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--giveaways', type=int, default=100)
+    parser.add_argument('--spread', type=float, default=5, help='seconds over which the giveaways end')
+    parser.add_argument('--ttl', type=float, default=2, help='LEASE_TTL for every worker')
+    parser.add_argument('--crash-after', type=int, default=0, help='worker 0 dies on its Nth ending (0 = never)')
+    parser.add_argument('--runtime', type=int, default=0,
+                        help='giveaways the last worker creates after startup, ending over the same spread')
+    parser.add_argument('--kill-creator', action='store_true', help='the last worker dies right after creating them')
+    # Internal: set by the coordinator for each child process
+    parser.add_argument('--seed', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--create', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--worker', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--log', help=argparse.SUPPRESS)
+    parser.add_argument('--start', type=float, help=argparse.SUPPRESS)
+    parser.add_argument('--timeout', type=float, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.seed:
+        print(json.dumps(run_seed(args)))
+    elif args.worker is not None:
+        print(json.dumps(asyncio.run(run_worker(args))))
+    else:
+        report = run_coordinator(args)
+        print(json.dumps(report, indent=2))
+        sys.exit(0 if report['ok'] else 1)
@@ -1,14 +1,45 @@
 import discord
+from discord import app_commands
 from discord.ext import commands, tasks
 from discord.ui import View, Button, Select, Modal, TextInput
 import os
 import random
 import json
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import asyncio
-from flask import Flask
-from threading import Thread
+import atexit
+import contextlib
+import bisect
+import heapq
+import itertools
+import time
+import aiohttp
+from aiohttp import web
 import re
+import functools
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import cProfile
+import pstats
+import io
+from collections import deque
+import base64
+from array import array
+import sqlite3
+try:
+    # Optional: speeds up eligibility checks for very large giveaways
+    import numpy as np
+except ImportError:
+    np = None
+import socket
+import secrets
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+IMPORT_STARTED = time.monotonic()
 
 # -------------------- BOT SETUP --------------------
 intents = discord.Intents.default()
@@ -16,11 +47,646 @@ intents.message_content = True
 intents.reactions = True
 intents.members = True
 intents.voice_states = True
-bot = commands.Bot(command_prefix=['!', '$'], intents=intents)
+
+# Sharding: leave both unset for a single process with discord's recommended
+# shard count. To split the bot over processes, give every process the same
+# SHARD_COUNT and its own comma-separated SHARD_IDS.
+SHARD_COUNT = int(os.environ['SHARD_COUNT']) if os.environ.get('SHARD_COUNT') else None
+SHARD_IDS = [int(s) for s in os.environ['SHARD_IDS'].split(',')] if os.environ.get('SHARD_IDS') else None
+# Set to 0 to skip registering slash commands at startup (e.g. while unchanged)
+SYNC_COMMANDS = os.environ.get('SYNC_COMMANDS', '1') == '1'
+
+class GiveawayBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        # Runs after the token is checked and before the gateway connects;
+        # the rest of startup happens in on_ready, see STARTUP
+        startup.mark('import_login', IMPORT_STARTED)
+        with startup.phase('partitions'):
+            load_partitions()
+        # Panels posted before a restart keep working
+        self.add_view(GiveawayMainView())
+        with startup.phase('web_server'):
+            # Serve HTTP from the bot's own loop before connecting
+            await start_web_server()
+        startup.gateway_started = time.monotonic()
+
+    def event(self, coro):
+        # Every handler registered with @bot.event is timed; see SLOW CALLBACKS
+        return super().event(slow_timed('event')(coro))
+
+    async def close(self):
+        # Persist anything still pending before the connection goes away, and
+        # let the other processes take over this one's endings right away
+        await persistence.flush()
+        await leases.leave()
+        await stop_web_server()
+        await super().close()
+
+COMMAND_PREFIXES = ('!', '$')
+# Hooks into discord.py's REST responses; observe_rate_limits is added in OUTBOUND REST QUEUE
+rest_trace = aiohttp.TraceConfig()
+bot = GiveawayBot(command_prefix=list(COMMAND_PREFIXES), intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS,
+                  http_trace=rest_trace)
+
+# -------------------- METRICS --------------------
+HEALTH_MAX_LOOP_LAG = float(os.environ.get('HEALTH_MAX_LOOP_LAG', 1.0))
+# Unhealthy once this many flushes in a row have failed; a success resets it
+HEALTH_MAX_FLUSH_FAILURES = int(os.environ.get('HEALTH_MAX_FLUSH_FAILURES', 3))
+
+class Histogram:
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    """In-process counters and histograms, rendered in Prometheus text format.
+
+    Recording is a dict lookup and a couple of additions, so it is cheap
+    enough to run on every event. Gauges are read from live state at scrape
+    time instead of being maintained.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.loop_lag = 0.0
+        self.started = time.time()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value)
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = [*labels, *extra]
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+    def render(self, gauges, counters=None):
+        lines = []
+        for kind, values in (('gauge', gauges), ('counter', counters or {})):
+            for name, value in values.items():
+                lines.append(f'# TYPE {name} {kind}')
+                lines.append(f'{name} {value}')
+        seen = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# TYPE {name} counter')
+            lines.append(f'{name}{self._labels(labels)} {value}')
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in zip((*Histogram.BUCKETS, '+Inf'), hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{self._labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{self._labels(labels)} {hist.sum}')
+            lines.append(f'{name}_count{self._labels(labels)} {hist.count}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def timed(name):
+    # Records the wrapped coroutine's duration in giveaway_bot_handler_seconds
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                metrics.observe('giveaway_bot_handler_seconds', time.perf_counter() - start, handler=name)
+        return wrapper
+    return decorator
+
+_http_request = bot.http.request
+
+async def counted_request(route, **kwargs):
+    metrics.inc('giveaway_bot_rest_requests_total', method=route.method)
+    try:
+        return await _http_request(route, **kwargs)
+    except discord.HTTPException as e:
+        metrics.inc('giveaway_bot_rest_errors_total', status=e.status)
+        raise
+
+bot.http.request = counted_request
+
+class RateLimitCounter(logging.Handler):
+    # discord.py retries 429s internally and only logs them, so count the logs
+    def emit(self, record):
+        if 'rate limit' in record.getMessage().lower():
+            metrics.inc('giveaway_bot_rest_rate_limited_total')
+
+logging.getLogger('discord.http').addHandler(RateLimitCounter(logging.WARNING))
+
+async def monitor_loop_lag(interval=0.5):
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        metrics.loop_lag = max(0.0, time.perf_counter() - start - interval)
+        metrics.observe('giveaway_bot_loop_lag_seconds', metrics.loop_lag)
+
+# -------------------- AUDIT LOG --------------------
+# Giveaway events are structured records, one JSON object per line in
+# AUDIT_LOG_FILE. Handlers only put records on a queue; a QueueListener
+# thread formats and writes them, and echoes warnings and errors to the
+# console. Per-entrant detail is DEBUG and sampled (AUDIT_ENTRANT_SAMPLE of
+# the entrants, at most AUDIT_ENTRANT_MAX per giveaway).
+AUDIT_LOG_FILE = os.environ.get('AUDIT_LOG_FILE', 'audit.jsonl')
+AUDIT_LEVEL = os.environ.get('AUDIT_LEVEL', 'INFO').upper()
+AUDIT_ENTRANT_SAMPLE = float(os.environ.get('AUDIT_ENTRANT_SAMPLE', 0.01))
+AUDIT_ENTRANT_MAX = int(os.environ.get('AUDIT_ENTRANT_MAX', 200))
+
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {'ts': round(record.created, 3), 'level': record.levelname, 'event': record.getMessage()}
+        entry.update(getattr(record, 'fields', {}))
+        return json.dumps(entry, separators=(',', ':'), default=str)
+
+class ConsoleFormatter(logging.Formatter):
+    def format(self, record):
+        fields = ' '.join(f"{k}={v}" for k, v in getattr(record, 'fields', {}).items())
+        return f"{'⚠️' if record.levelno < logging.ERROR else '❌'} {record.getMessage()} {fields}".rstrip()
+
+class Laps:
+    """Milliseconds between successive lap() calls, by phase name."""
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.ms = {}
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.ms[name] = round((now - self.last) * 1000, 3)
+        self.last = now
+
+audit_logger = logging.getLogger('giveaway.audit')
+audit_logger.setLevel(AUDIT_LEVEL)
+audit_logger.propagate = False
+audit_queue = queue.SimpleQueue()
+audit_logger.addHandler(logging.handlers.QueueHandler(audit_queue))
+audit_file = logging.FileHandler(AUDIT_LOG_FILE, encoding='utf-8', delay=True)
+audit_file.setFormatter(JsonLinesFormatter())
+audit_console = logging.StreamHandler(sys.stdout)
+audit_console.setLevel(logging.WARNING)
+audit_console.setFormatter(ConsoleFormatter())
+audit_listener = logging.handlers.QueueListener(audit_queue, audit_file, audit_console, respect_handler_level=True)
+audit_listener.start()
+# Drains whatever is still queued at exit
+atexit.register(audit_listener.stop)
+
+def audit(event, level=logging.INFO, **fields):
+    if audit_logger.isEnabledFor(level):
+        audit_logger.log(level, event, extra={'fields': fields})
+
+# -------------------- SLOW CALLBACKS --------------------
+# Always on: every event handler, view callback, modal submit, slash command
+# and autocomplete is timed through discord.py's public registration points
+# (@bot.event, an item's callback, on_submit, the command's function), and
+# the ones that take longer than SLOW_CALLBACK_SECONDS are counted in
+# giveaway_bot_slow_callbacks_total, written to the audit log as
+# slow_callback warnings and listed by `$profile`. Durations are wall time,
+# so waiting on Discord counts as well as blocking the loop; $profile shows
+# which of the two it was.
+SLOW_CALLBACK_SECONDS = float(os.environ.get('SLOW_CALLBACK_SECONDS', 0.5))
+SLOW_CALLBACK_RECENT = 20
+
+class SlowCallbacks:
+    def __init__(self, threshold, keep):
+        self.threshold = threshold
+        self.recent = deque(maxlen=keep)
+
+    def record(self, kind, name, seconds):
+        if seconds < self.threshold:
+            return
+        self.recent.append((time.time(), kind, name, seconds))
+        metrics.inc('giveaway_bot_slow_callbacks_total', kind=kind, callback=name)
+        audit('slow_callback', logging.WARNING, kind=kind, callback=name, ms=round(seconds * 1000, 1))
+
+slow_callbacks = SlowCallbacks(SLOW_CALLBACK_SECONDS, SLOW_CALLBACK_RECENT)
+
+def callback_name(func):
+    # Decorated view buttons hand out a wrapper holding the real method
+    func = getattr(func, 'callback', func)
+    return getattr(func, '__qualname__', type(func).__name__)
+
+def slow_timed(kind, name=None):
+    # Wraps a callback so slow runs are recorded under kind and name
+    def decorator(func):
+        label = name or callback_name(func)
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                slow_callbacks.record(kind, label, time.perf_counter() - start)
+        wrapper.slow_timed = True
+        return wrapper
+    return decorator
+
+class TimedView(View):
+    """A View whose item callbacks are timed, decorated or added later."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        for item in self.children:
+            self.time_item(item)
+
+    def add_item(self, item):
+        self.time_item(item)
+        return super().add_item(item)
+
+    @staticmethod
+    def time_item(item):
+        if not getattr(item.callback, 'slow_timed', False):
+            item.callback = slow_timed('view')(item.callback)
+
+class TimedModal(Modal):
+    """A Modal whose on_submit is timed."""
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'on_submit' in cls.__dict__:
+            cls.on_submit = slow_timed('modal', f'{cls.__qualname__}.on_submit')(cls.__dict__['on_submit'])
+
+# -------------------- PROFILER --------------------
+# `$profile SECONDS [cprofile]` profiles this process for a while and writes
+# two files to PROFILE_DIR: a .txt report of the top functions and a
+# .collapsed file of stacks, one "frame;frame;frame count" line each, which
+# flamegraph.pl and speedscope read as is. Sampling reads the loop thread's
+# stack from a side thread, so the loop itself pays almost nothing; cprofile
+# also traces every call on the loop for exact call counts and times, which
+# slows the bot noticeably while it runs.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP = 40
+
+class StackSampler(threading.Thread):
+    """Counts one thread's stacks every interval, in collapsed form."""
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})")
+                frame = frame.f_back
+            if frames:
+                stack = ';'.join(reversed(frames))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+class Profiler:
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self.running = False
+
+    async def run(self, seconds, deterministic=False):
+        self.running = True
+        started = time.time()
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        profile = cProfile.Profile() if deterministic else None
+        sampler.start()
+        if profile:
+            profile.enable()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            if profile:
+                profile.disable()
+            sampler.stopped.set()
+            self.running = False
+        await asyncio.to_thread(sampler.join)
+        return await asyncio.to_thread(self.write, started, seconds, sampler.stacks, profile)
+
+    def write(self, started, seconds, stacks, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started))
+        worker = re.sub(r'[^\w.-]', '_', WORKER_ID)
+        base = os.path.join(self.directory, f"profile-{stamp}-{worker}")
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        own, total = {}, {}
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] = own.get(frames[-1], 0) + count
+            for frame in set(frames):
+                total[frame] = total.get(frame, 0) + count
+        samples = sum(stacks.values())
+        top = sorted(own.items(), key=lambda kv: -kv[1])[:PROFILE_TOP]
+        lines = [f"{seconds:g}s on {WORKER_ID} from {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(started))}, "
+                 f"{samples} samples every {self.interval * 1000:g}ms", '',
+                 f"{'own %':>7} {'total %':>8}  function"]
+        for frame, count in top:
+            lines.append(f"{100 * count / max(1, samples):7.1f} {100 * total[frame] / max(1, samples):8.1f}  {frame}")
+        if profile:
+            out = io.StringIO()
+            stats = pstats.Stats(profile, stream=out)
+            stats.sort_stats('tottime').print_stats(PROFILE_TOP)
+            stats.sort_stats('cumulative').print_stats(PROFILE_TOP)
+            lines += ['', out.getvalue()]
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        return base, samples, top[:5]
+
+profiler = Profiler(PROFILE_DIR, PROFILE_SAMPLE_INTERVAL)
+
+# -------------------- OUTBOUND REST QUEUE --------------------
+REST_CONCURRENCY = int(os.environ.get('REST_CONCURRENCY', 8))
+REST_PER_CHANNEL = int(os.environ.get('REST_PER_CHANNEL', 1))
+REST_MAX_BACKOFF = float(os.environ.get('REST_MAX_BACKOFF', 30))
+# Discord allows 50 requests/sec per bot across all routes
+REST_GLOBAL_RATE = float(os.environ.get('REST_GLOBAL_RATE', 45))
+
+class RestQueue:
+    """Outbound REST calls, sent in priority order instead of all at once.
+
+    Calls wait in lanes, one per (channel, HTTP method) since that is how
+    Discord buckets message routes, each a heap ordered by (priority,
+    submission order); `ready` holds the head of every lane that may start.
+    Calls start at no more than `rate` per second overall, at most
+    `concurrency` are in flight at once and at most `per_channel` per
+    channel. A call stops counting once its response is in
+    (see observe), even though discord.py may then hold it until its bucket
+    resets. A lane whose bucket is known to be empty waits for the reset
+    instead of queueing inside discord.py, so it never holds a slot other
+    lanes could use. A 429 also cools the whole channel down (every channel,
+    for a global limit), doubling on repeats.
+    """
+    ANNOUNCE, FETCH, SYNC, EDIT = range(4)
+    NAMES = ('announce', 'fetch', 'sync', 'edit')
+    # ANNOUNCE sends messages, FETCH and SYNC read them, EDIT edits them
+    METHODS = ('POST', 'GET', 'GET', 'PATCH')
+
+    def __init__(self, concurrency, per_channel, rate, max_backoff=30.0):
+        self.concurrency = concurrency
+        self.per_channel = per_channel
+        self.rate = rate
+        self.tokens = rate
+        self.refilled = time.monotonic()
+        self.max_backoff = max_backoff
+        self.waiting = {}
+        self.ready = []
+        self.seq = itertools.count()
+        self.running = 0
+        self.active = {}
+        self.inflight = {}
+        self.released = {}
+        self.buckets = {}
+        self.cooldown = {}
+        self.strikes = {}
+        self.timers = {}
+        self.tasks = set()
+
+    def __len__(self):
+        return sum(len(jobs) for jobs in self.waiting.values())
+
+    async def call(self, priority, channel_id, func, *args, **kwargs):
+        # Runs func(*args, **kwargs) when its turn comes and returns its result
+        future = asyncio.get_running_loop().create_future()
+        lane = (channel_id, self.METHODS[priority])
+        job = (priority, next(self.seq), functools.partial(func, *args, **kwargs), future, time.monotonic(), 0)
+        heapq.heappush(self.waiting.setdefault(lane, []), job)
+        self._offer(lane)
+        self._pump()
+        return await future
+
+    def _blocked_until(self, lane):
+        # When the lane may start its next call; 0 if it can start now
+        now = time.monotonic()
+        until = max(self.cooldown.get(lane[0], 0), self.cooldown.get(None, 0))
+        # Global pacing: a token bucket holding up to one second of calls
+        self.tokens = min(self.rate, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens < 1:
+            until = max(until, now + (1 - self.tokens) / self.rate)
+        bucket = self.buckets.get(lane)
+        if bucket is not None and bucket[0] <= 0:
+            until = max(until, bucket[1])
+        return until if until > now else 0
+
+    def _offer(self, lane):
+        jobs = self.waiting.get(lane)
+        if not jobs or self.active.get(lane[0], 0) >= self.per_channel:
+            return
+        until = self._blocked_until(lane)
+        if until:
+            self._wake_at(lane, until)
+        else:
+            heapq.heappush(self.ready, (jobs[0][0], jobs[0][1], lane))
+
+    def _pump(self):
+        while self.ready and self.running < self.concurrency:
+            _, seq, lane = heapq.heappop(self.ready)
+            jobs = self.waiting.get(lane)
+            # Entries go stale when their job started or the lane got blocked
+            if not jobs or jobs[0][1] != seq or self.active.get(lane[0], 0) >= self.per_channel or self._blocked_until(lane):
+                continue
+            job = heapq.heappop(jobs)
+            if not jobs:
+                del self.waiting[lane]
+            if not job[3].done():
+                bucket = self.buckets.get(lane)
+                if bucket is not None:
+                    bucket[0] -= 1
+                self.tokens -= 1
+                # Counted now, not when the task first runs
+                self.running += 1
+                self.active[lane[0]] = self.active.get(lane[0], 0) + 1
+                self.inflight[lane] = self.inflight.get(lane, 0) + 1
+                task = asyncio.ensure_future(self._run(lane, job))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            self._offer(lane)
+
+    async def _run(self, lane, job):
+        priority, seq, call, future, queued_at, attempts = job
+        channel_id = lane[0]
+        started = time.monotonic()
+        metrics.observe('giveaway_bot_rest_queue_wait_seconds', started - queued_at, priority=self.NAMES[priority])
+        try:
+            result = await call()
+        except (discord.RateLimited, discord.HTTPException) as e:
+            limited = isinstance(e, discord.RateLimited) or e.status == 429
+            if limited:
+                self.backoff(channel_id, getattr(e, 'retry_after', None) or 1.0)
+            if limited and attempts < 3:
+                heapq.heappush(self.waiting.setdefault(lane, []), (priority, seq, call, future, queued_at, attempts + 1))
+            elif not future.done():
+                future.set_exception(e)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            # Only a call started after the last cooldown proves the limit is over
+            if started >= self.cooldown.get(channel_id, 0):
+                self.strikes.pop(channel_id, None)
+            if not future.done():
+                future.set_result(result)
+        finally:
+            if self.released.get(lane):
+                self.released[lane] -= 1
+                # The slot went back on the response, before a retry was queued
+                self._offer(lane)
+                self._pump()
+            else:
+                self._release(lane)
+
+    def _release(self, lane):
+        channel_id = lane[0]
+        self.running -= 1
+        self.inflight[lane] -= 1
+        if not self.inflight[lane]:
+            del self.inflight[lane]
+        self.active[channel_id] -= 1
+        if not self.active[channel_id]:
+            del self.active[channel_id]
+        # The slot is free for any lane of this channel
+        for other in [lane, *(l for l in self.waiting if l[0] == channel_id and l != lane)]:
+            self._offer(other)
+        self._pump()
+
+    def observe(self, lane, remaining, reset_after):
+        # Bucket state from a response's X-RateLimit headers
+        self.buckets[lane] = [remaining, time.monotonic() + reset_after]
+        if self.inflight.get(lane):
+            self.released[lane] = self.released.get(lane, 0) + 1
+            self._release(lane)
+        elif remaining > 0:
+            self._offer(lane)
+            self._pump()
+
+    def backoff(self, channel_id, retry_after):
+        # channel_id None is a global rate limit
+        strikes = self.strikes[channel_id] = self.strikes.get(channel_id, 0) + 1
+        delay = min(self.max_backoff, retry_after * 2 ** (strikes - 1))
+        metrics.inc('giveaway_bot_rest_backoffs_total')
+        self.cooldown[channel_id] = max(self.cooldown.get(channel_id, 0), time.monotonic() + delay)
+
+    def _wake_at(self, lane, until):
+        timer = self.timers.get(lane)
+        if timer is not None and timer.when() <= until:
+            return
+        if timer is not None:
+            timer.cancel()
+        loop = asyncio.get_running_loop()
+        self.timers[lane] = loop.call_at(loop.time() + until - time.monotonic(), self._wake, lane)
+
+    def _wake(self, lane):
+        self.timers.pop(lane, None)
+        self._offer(lane)
+        self._pump()
+
+async def observe_rate_limits(session, ctx, params):
+    # aiohttp trace hook on discord.py's session: feeds message-route bucket
+    # state and 429s to the REST queue
+    headers = params.response.headers
+    if params.response.status == 429 and headers.get('X-RateLimit-Global'):
+        rest.backoff(None, float(headers.get('Retry-After', 1)))
+        return
+    match = re.search(r'/channels/(\d+)/messages', params.url.path)
+    if match is None or 'X-RateLimit-Remaining' not in headers:
+        return
+    channel_id = int(match.group(1))
+    reset_after = float(headers.get('X-RateLimit-Reset-After', 0))
+    rest.observe((channel_id, params.method), int(headers['X-RateLimit-Remaining']), reset_after)
+    if params.response.status == 429:
+        rest.backoff(None if headers.get('X-RateLimit-Global') else channel_id, reset_after or 1.0)
+
+rest = RestQueue(REST_CONCURRENCY, REST_PER_CHANNEL, REST_GLOBAL_RATE, REST_MAX_BACKOFF)
+rest_trace.on_request_end.append(observe_rate_limits)
+
+def collect_gauges():
+    flush = persistence.stats()
+    gauges = {
+        'giveaway_bot_up': 1,
+        'giveaway_bot_ready': int(bot.is_ready()),
+        'giveaway_bot_uptime_seconds': round(time.time() - metrics.started, 1),
+        'giveaway_bot_gateway_latency_seconds': bot.latency if bot.latency == bot.latency else -1,
+        'giveaway_bot_loop_lag_seconds': metrics.loop_lag,
+        'giveaway_bot_guilds': len(bot.guilds),
+        'giveaway_bot_active_giveaways': len(giveaways),
+        'giveaway_bot_archived_giveaways': sum(len(st.archive) for st in guild_states.values()),
+        'giveaway_bot_archive_bytes': sum(st.archive_bytes for st in guild_states.values()),
+        'giveaway_bot_scheduled_giveaways': len(scheduler),
+        'giveaway_bot_entrants_tracked': sum(len(ids) for ids in entrant_index.values()),
+        'giveaway_bot_shards': len(bot.shards),
+        'giveaway_bot_guild_partitions': len(guild_states),
+        'giveaway_bot_live_workers': len(leases.live_workers),
+        'giveaway_bot_rest_queue_depth': len(rest),
+        'giveaway_bot_rest_in_flight': rest.running,
+        'giveaway_bot_tracked_users': sum(len(st.stats) for st in guild_states.values() if st.stats_loaded),
+        'giveaway_bot_stats_loaded_guilds': sum(st.stats_loaded for st in guild_states.values()),
+        'giveaway_bot_startup_ready_seconds': startup.ready_seconds or 0,
+        'giveaway_bot_vc_sessions': sum(len(st.vc) for st in guild_states.values()),
+        'giveaway_bot_setup_sessions': sum(len(st.setups) for st in guild_states.values()),
+        'giveaway_bot_message_cache_entries': len(giveaway_messages),
+        'giveaway_bot_persistence_flush_last_seconds': flush['last_ms'] / 1000,
+        'giveaway_bot_persistence_flush_max_seconds': flush['max_ms'] / 1000,
+        'giveaway_bot_persistence_pending': flush['pending'],
+        'giveaway_bot_persistence_failed_in_a_row': flush['failed_in_a_row'],
+    }
+    counters = {
+        'giveaway_bot_persistence_flushes_total': flush['flushes'],
+        'giveaway_bot_persistence_flush_seconds_total': flush['avg_ms'] * flush['flushes'] / 1000,
+        'giveaway_bot_persistence_rows_written_total': flush['rows_written'],
+        'giveaway_bot_persistence_failures_total': flush['failures'],
+        'giveaway_bot_message_cache_hits_total': giveaway_messages.hits,
+        'giveaway_bot_message_cache_misses_total': giveaway_messages.misses,
+        'giveaway_bot_setup_sessions_expired_total': sum(st.setups.expired for st in guild_states.values()),
+        'giveaway_bot_setup_sessions_evicted_total': sum(st.setups.evicted for st in guild_states.values()),
+    }
+    return gauges, counters
+
+def health_report():
+    checks = {
+        'gateway_ready': bot.is_ready() and not bot.is_closed(),
+        'loop_responsive': metrics.loop_lag < HEALTH_MAX_LOOP_LAG,
+        'scheduler_running': scheduler._task is not None and not scheduler._task.done(),
+        'persistence_ok': persistence.failed_in_a_row < HEALTH_MAX_FLUSH_FAILURES,
+    }
+    return all(checks.values()), checks
 
 # -------------------- FILE STORAGE --------------------
 STATS_FILE = 'user_stats.json'
 GIVEAWAY_FILE = 'giveaways.json'
+VC_SESSIONS_FILE = 'vc_sessions.json'
+ARCHIVE_FILE = 'archive.json'
+PARTITION_FILES = (STATS_FILE, GIVEAWAY_FILE, VC_SESSIONS_FILE, ARCHIVE_FILE)
+# Every guild is its own partition. Data written before partitioning existed
+# is loaded as guild 0 and adopted by the real guilds in on_ready.
+DATA_DIR = os.environ.get('DATA_DIR', 'guilds')
+LEGACY_GUILD = 0
+FLUSH_INTERVAL = float(os.environ.get('FLUSH_INTERVAL', 10))
+# "json" keeps each guild in its own copy of the files above (fine for small
+# servers), "sqlite" stores one row per user/giveaway in DB_FILE.
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json').lower()
+DB_FILE = os.environ.get('DB_FILE', 'giveaway_bot.db')
 
 def load_json(filename, default={}):
     if os.path.exists(filename):
@@ -28,15 +694,1215 @@ def load_json(filename, default={}):
             return json.load(f)
     return default
 
+def iter_json_object(filename):
+    # Yields the items of a file holding one JSON object, one at a time, so a
+    # big file can be consumed in slices between other work
+    if not os.path.exists(filename):
+        return
+    with open(filename, 'r') as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    skip = re.compile(r'[\s,]*').match
+    i = skip(text).end()
+    if text[i:i + 1] != '{':
+        raise ValueError(f"{filename} does not hold a JSON object")
+    i = skip(text, i + 1).end()
+    while text[i:i + 1] != '}':
+        key, i = decoder.raw_decode(text, i)
+        i = skip(text, i).end()
+        if text[i:i + 1] != ':':
+            raise ValueError(f"{filename}: expected ':' at offset {i}")
+        value, i = decoder.raw_decode(text, skip(text, i + 1).end())
+        yield key, value
+        i = skip(text, i).end()
+
 def save_json(filename, data):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
+    # Write to a temp file and rename it over the old one so a crash mid-write
+    # never leaves a truncated file behind.
+    tmp = f"{filename}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+def pack_array(packed):
+    # Little-endian, base64'd
+    if sys.byteorder == 'big':
+        packed = array(packed.typecode, packed)
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode('ascii')
+
+def unpack_array(typecode, blob):
+    packed = array(typecode)
+    if blob:
+        packed.frombytes(base64.b64decode(blob))
+        if sys.byteorder == 'big':
+            packed.byteswap()
+    return packed
+
+def pack_ids(ids):
+    # Sorted uint64s: ~11 chars per user instead of a JSON list
+    return pack_array(array('Q', sorted(ids)))
+
+def unpack_ids(blob):
+    return unpack_array('Q', blob)
+
+class EntrantWrite:
+    """A giveaway's entrants as handed to a storage backend.
+
+    Either the whole set (`full`, a copy) or only the ids `added` and
+    `removed` since the last successful flush. Sorting and packing happen
+    on the writer thread.
+    """
+    __slots__ = ('full', 'added', 'removed')
+
+    def __init__(self, full=None, added=(), removed=()):
+        self.full = full
+        self.added = added
+        self.removed = removed
+
+class JsonBackend:
+    """One set of JSON files per guild, under DATA_DIR/<guild_id>/.
+
+    Partition names are (file, guild_id) pairs. The unpartitioned files from
+    older versions are read as LEGACY_GUILD until on_ready hands their
+    contents to the right guilds.
+    """
+    per_row = False
+
+    @staticmethod
+    def path(name):
+        kind, guild_id = name
+        if guild_id == LEGACY_GUILD:
+            return kind
+        return os.path.join(DATA_DIR, str(guild_id), kind)
+
+    def partitions(self):
+        found = set()
+        if os.path.isdir(DATA_DIR):
+            found.update(int(d) for d in os.listdir(DATA_DIR) if d.isdigit())
+        # An adopted legacy file is left behind as an empty {}
+        if any(os.path.exists(kind) and os.path.getsize(kind) > 2 for kind in PARTITION_FILES):
+            found.add(LEGACY_GUILD)
+        return found
+
+    def files(self):
+        for guild_id in self.partitions():
+            for kind in PARTITION_FILES:
+                if os.path.exists(self.path((kind, guild_id))):
+                    yield kind, guild_id
+
+    def load(self, name):
+        return load_json(self.path(name), {})
+
+    def iter_rows(self, name):
+        return iter_json_object(self.path(name))
+
+    def load_rows(self, name, keys):
+        rows = self.load(name)
+        return {key: rows[key] for key in keys if key in rows}
+
+    def write(self, name, rows, deleted, full):
+        path = self.path(name)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        if name[0] == GIVEAWAY_FILE:
+            rows = {mid: {**row, 'entrants': pack_ids(row['entrants'].full)} if isinstance(row.get('entrants'), EntrantWrite)
+                    else row for mid, row in rows.items()}
+        save_json(path, rows)
+
+class SqliteBackend:
+    per_row = True
+    TABLES = {STATS_FILE: 'user_stats', GIVEAWAY_FILE: 'giveaways', VC_SESSIONS_FILE: 'vc_sessions', ARCHIVE_FILE: 'archive'}
+    GIVEAWAY_COLUMNS = ('giveaway_id', 'channel_id', 'host_id', 'prize', 'end_time', 'emoji', 'image_url', 'ended')
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_stats (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            messages INTEGER NOT NULL DEFAULT 0,
+            vc_time REAL NOT NULL DEFAULT 0,
+            name TEXT,
+            extra TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS giveaways (
+            message_id INTEGER PRIMARY KEY,
+            giveaway_id TEXT,
+            channel_id INTEGER,
+            host_id INTEGER,
+            prize TEXT,
+            end_time REAL,
+            emoji TEXT,
+            image_url TEXT,
+            ended INTEGER NOT NULL DEFAULT 0,
+            extra TEXT,
+            guild_id INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS requirements (
+            message_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (message_id, kind)
+        );
+        CREATE TABLE IF NOT EXISTS entrants (
+            message_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (message_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS vc_sessions (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            started REAL NOT NULL,
+            counted INTEGER NOT NULL,
+            channel_id INTEGER,
+            checkpointed REAL,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS archive (
+            message_id INTEGER PRIMARY KEY,
+            guild_id INTEGER NOT NULL,
+            ended_at REAL NOT NULL,
+            record TEXT NOT NULL,
+            eligible BLOB,
+            weights BLOB
+        );
+        CREATE INDEX IF NOT EXISTS idx_giveaways_giveaway_id ON giveaways (giveaway_id);
+        CREATE INDEX IF NOT EXISTS idx_giveaways_end_time ON giveaways (end_time);
+        CREATE INDEX IF NOT EXISTS idx_giveaways_guild_id ON giveaways (guild_id);
+        CREATE INDEX IF NOT EXISTS idx_requirements_message_id ON requirements (message_id);
+        CREATE INDEX IF NOT EXISTS idx_entrants_user_id ON entrants (user_id);
+        CREATE INDEX IF NOT EXISTS idx_archive_guild_id ON archive (guild_id, ended_at);
+    """
+
+    def __init__(self, path):
+        # Writes happen on the persistence executor thread, loads on the main one
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.upgrade_schema()
+        self.conn.executescript(self.SCHEMA)
+        self.migrate_from_json()
+
+    def upgrade_schema(self):
+        # Databases from before guild partitioning: everything goes to LEGACY_GUILD
+        cols = {row[1] for row in self.conn.execute('PRAGMA table_info(user_stats)')}
+        if not cols or 'guild_id' in cols:
+            return
+        has_vc = self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'vc_sessions'").fetchone()
+        with self.conn:
+            self.conn.execute('ALTER TABLE user_stats RENAME TO user_stats_old')
+            if has_vc:
+                self.conn.execute('ALTER TABLE vc_sessions RENAME TO vc_sessions_old')
+            self.conn.execute(f'ALTER TABLE giveaways ADD COLUMN guild_id INTEGER NOT NULL DEFAULT {LEGACY_GUILD}')
+        self.conn.executescript(self.SCHEMA)
+        with self.conn:
+            self.conn.execute(f'INSERT INTO user_stats SELECT {LEGACY_GUILD}, user_id, messages, vc_time, name, extra FROM user_stats_old')
+            self.conn.execute('DROP TABLE user_stats_old')
+            if has_vc:
+                self.conn.execute(f'INSERT INTO vc_sessions SELECT {LEGACY_GUILD}, user_id, started, counted, channel_id, checkpointed FROM vc_sessions_old')
+                self.conn.execute('DROP TABLE vc_sessions_old')
+        audit('database_upgraded', schema='per_guild')
+
+    def migrate_from_json(self):
+        # One-shot import of JSON files (legacy or per-guild) into empty partitions
+        for name in list(JsonBackend().files()):
+            kind, guild_id = name
+            table = self.TABLES[kind]
+            if self.conn.execute(f'SELECT 1 FROM {table} WHERE guild_id = ? LIMIT 1', (guild_id,)).fetchone():
+                continue
+            path = JsonBackend.path(name)
+            data = load_json(path, {})
+            self.write(name, data, [], True)
+            os.replace(path, f'{path}.migrated')
+            audit('json_migrated', rows=len(data), path=path, table=table)
+
+    def partitions(self):
+        return {gid for gid, in self.conn.execute(
+            'SELECT guild_id FROM user_stats UNION SELECT guild_id FROM giveaways UNION SELECT guild_id FROM vc_sessions '
+            'UNION SELECT guild_id FROM archive')}
+
+    def iter_rows(self, name):
+        kind, guild_id = name
+        if kind == STATS_FILE:
+            return self._iter_stats(guild_id)
+        return iter(self.load(name).items())
+
+    def load_rows(self, name, keys):
+        kind, guild_id = name
+        if kind == GIVEAWAY_FILE:
+            return self._load_giveaways(guild_id, keys)
+        rows = self.load(name)
+        return {key: rows[key] for key in keys if key in rows}
+
+    def load(self, name):
+        kind, guild_id = name
+        if kind == STATS_FILE:
+            return self._load_stats(guild_id)
+        if kind == VC_SESSIONS_FILE:
+            return self._load_vc_sessions(guild_id)
+        if kind == ARCHIVE_FILE:
+            return self._load_archive(guild_id)
+        return self._load_giveaways(guild_id)
+
+    def write(self, name, rows, deleted, full):
+        kind, guild_id = name
+        with self.conn:
+            if kind == STATS_FILE:
+                self._write_stats(guild_id, rows, deleted, full)
+            elif kind == VC_SESSIONS_FILE:
+                self._write_vc_sessions(guild_id, rows, deleted, full)
+            elif kind == ARCHIVE_FILE:
+                self._write_archive(guild_id, rows, deleted, full)
+            else:
+                self._write_giveaways(guild_id, rows, deleted, full)
+
+    def _load_vc_sessions(self, guild_id):
+        return {str(uid): [started, bool(counted), channel_id, checkpointed] for uid, started, counted, channel_id, checkpointed
+                in self.conn.execute('SELECT user_id, started, counted, channel_id, checkpointed FROM vc_sessions '
+                                     'WHERE guild_id = ?', (guild_id,))}
+
+    def _write_vc_sessions(self, guild_id, rows, deleted, full):
+        if full:
+            self.conn.execute('DELETE FROM vc_sessions WHERE guild_id = ?', (guild_id,))
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO vc_sessions (guild_id, user_id, started, counted, channel_id, checkpointed) VALUES (?, ?, ?, ?, ?, ?)',
+            [(guild_id, int(uid), started, int(counted), channel_id, checkpointed)
+             for uid, (started, counted, channel_id, checkpointed) in rows.items()]
+        )
+        self.conn.executemany('DELETE FROM vc_sessions WHERE guild_id = ? AND user_id = ?', [(guild_id, int(uid)) for uid in deleted])
+
+    def _load_archive(self, guild_id):
+        # Snapshots are stored as raw little-endian blobs
+        archive = {}
+        for mid, record, eligible, weights in self.conn.execute(
+                'SELECT message_id, record, eligible, weights FROM archive WHERE guild_id = ?', (guild_id,)):
+            row = json.loads(record)
+            row['eligible'] = base64.b64encode(eligible or b'').decode('ascii')
+            row['weights'] = base64.b64encode(weights).decode('ascii') if weights else None
+            archive[str(mid)] = row
+        return archive
+
+    def _write_archive(self, guild_id, rows, deleted, full):
+        if full:
+            self.conn.execute('DELETE FROM archive WHERE guild_id = ?', (guild_id,))
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO archive (message_id, guild_id, ended_at, record, eligible, weights) VALUES (?, ?, ?, ?, ?, ?)',
+            [(int(mid), guild_id, row['ended_at'],
+              json.dumps({k: v for k, v in row.items() if k not in ('eligible', 'weights')}, separators=(',', ':')),
+              base64.b64decode(row['eligible']), base64.b64decode(row['weights']) if row.get('weights') else None)
+             for mid, row in rows.items()]
+        )
+        self.conn.executemany('DELETE FROM archive WHERE message_id = ? AND guild_id = ?', [(int(mid), guild_id) for mid in deleted])
+
+    def _load_stats(self, guild_id):
+        return dict(self._iter_stats(guild_id))
+
+    def _iter_stats(self, guild_id):
+        for uid, messages, vc_time, uname, extra in self.conn.execute(
+                'SELECT user_id, messages, vc_time, name, extra FROM user_stats WHERE guild_id = ?', (guild_id,)):
+            entry = json.loads(extra) if extra else {}
+            entry.update({'messages': messages, 'vc_time': vc_time, 'name': uname})
+            yield str(uid), entry
+
+    def _write_stats(self, guild_id, rows, deleted, full):
+        if full:
+            self.conn.execute('DELETE FROM user_stats WHERE guild_id = ?', (guild_id,))
+        self.conn.executemany(
+            'INSERT INTO user_stats (guild_id, user_id, messages, vc_time, name, extra) VALUES (?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT(guild_id, user_id) DO UPDATE SET messages=excluded.messages, vc_time=excluded.vc_time, '
+            'name=excluded.name, extra=excluded.extra',
+            [(guild_id, *self._stats_row(uid, entry)) for uid, entry in rows.items()]
+        )
+        self.conn.executemany('DELETE FROM user_stats WHERE guild_id = ? AND user_id = ?', [(guild_id, int(uid)) for uid in deleted])
+
+    @staticmethod
+    def _stats_row(uid, entry):
+        extra = {k: v for k, v in entry.items() if k not in ('messages', 'vc_time', 'name')}
+        return (int(uid), entry.get('messages', 0), entry.get('vc_time', 0), entry.get('name'),
+                json.dumps(extra, separators=(',', ':')) if extra else None)
+
+    def _load_giveaways(self, guild_id, mids=None):
+        # A guild's giveaways, or only the given message ids
+        where, params = 'g.guild_id = ?', (guild_id,)
+        if mids is not None:
+            where += f" AND g.message_id IN ({', '.join('?' * len(mids))})"
+            params += tuple(int(mid) for mid in mids)
+        giveaways = {}
+        cols = ', '.join(self.GIVEAWAY_COLUMNS)
+        for row in self.conn.execute(f'SELECT message_id, {cols}, extra FROM giveaways g WHERE {where}', params):
+            data = json.loads(row[-1]) if row[-1] else {}
+            data.update(zip(self.GIVEAWAY_COLUMNS, row[1:-1]))
+            data['ended'] = bool(data['ended'])
+            data['message_id'] = row[0]
+            data['requirements'] = {}
+            giveaways[str(row[0])] = data
+        for mid, kind, value in self.conn.execute(
+                'SELECT r.message_id, r.kind, r.value FROM requirements r JOIN giveaways g USING (message_id) '
+                f'WHERE {where}', params):
+            giveaways[str(mid)]['requirements'][kind] = json.loads(value)
+        entrants = {}
+        for mid, uid in self.conn.execute(
+                'SELECT e.message_id, e.user_id FROM entrants e JOIN giveaways g USING (message_id) '
+                f'WHERE {where}', params):
+            entrants.setdefault(str(mid), []).append(uid)
+        for mid, ids in entrants.items():
+            giveaways[mid]['entrants'] = pack_ids(ids)
+        return giveaways
+
+    def _write_giveaways(self, guild_id, rows, deleted, full):
+        if full:
+            # Rows are upserted like partial writes, so entrant changes still
+            # apply on top of what is stored; only giveaways that are gone go
+            kept = {int(mid) for mid in rows}
+            deleted = [*deleted, *(mid for mid, in self.conn.execute(
+                'SELECT message_id FROM giveaways WHERE guild_id = ?', (guild_id,)) if mid not in kept)]
+        cols = ', '.join(self.GIVEAWAY_COLUMNS)
+        marks = ', '.join('?' * (len(self.GIVEAWAY_COLUMNS) + 3))
+        updates = ', '.join(f'{c}=excluded.{c}' for c in self.GIVEAWAY_COLUMNS + ('extra', 'guild_id'))
+        skip = set(self.GIVEAWAY_COLUMNS) | {'message_id', 'requirements', 'guild_id'}
+        for mid, data in rows.items():
+            extra = {k: v for k, v in data.items() if k not in skip}
+            packed = extra.pop('entrants', None)
+            self.conn.execute(
+                f'INSERT INTO giveaways (message_id, {cols}, extra, guild_id) VALUES ({marks}) '
+                f'ON CONFLICT(message_id) DO UPDATE SET {updates}',
+                (int(mid), *(int(bool(data.get(c))) if c == 'ended' else data.get(c) for c in self.GIVEAWAY_COLUMNS),
+                 json.dumps(extra, separators=(',', ':')) if extra else None, guild_id)
+            )
+            self.conn.execute('DELETE FROM requirements WHERE message_id = ?', (int(mid),))
+            self.conn.executemany(
+                'INSERT INTO requirements (message_id, kind, value) VALUES (?, ?, ?)',
+                [(int(mid), kind, json.dumps(value)) for kind, value in (data.get('requirements') or {}).items()]
+            )
+            if isinstance(packed, EntrantWrite) and packed.full is None:
+                self.conn.executemany('INSERT OR IGNORE INTO entrants (message_id, user_id) VALUES (?, ?)',
+                                      [(int(mid), uid) for uid in packed.added])
+                self.conn.executemany('DELETE FROM entrants WHERE message_id = ? AND user_id = ?',
+                                      [(int(mid), uid) for uid in packed.removed])
+            elif packed is not None:
+                # The whole set: a live one, or packed ids from a JSON import
+                ids = sorted(packed.full) if isinstance(packed, EntrantWrite) else unpack_ids(packed)
+                self.conn.execute('DELETE FROM entrants WHERE message_id = ?', (int(mid),))
+                self.conn.executemany('INSERT INTO entrants (message_id, user_id) VALUES (?, ?)',
+                                      [(int(mid), uid) for uid in ids])
+        for mid in deleted:
+            # A giveaway moved to another partition is still owned by that one
+            if self.conn.execute('DELETE FROM giveaways WHERE message_id = ? AND guild_id = ?', (int(mid), guild_id)).rowcount:
+                self.conn.execute('DELETE FROM requirements WHERE message_id = ?', (int(mid),))
+                self.conn.execute('DELETE FROM entrants WHERE message_id = ?', (int(mid),))
+
+def open_storage():
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteBackend(DB_FILE)
+    return JsonBackend()
+
+class WriteBehindStore:
+    """Coalesces writes.
+
+    Handlers call mark_dirty() instead of writing; a background loop flushes
+    everything dirty at most once per FLUSH_INTERVAL. Snapshots are taken on
+    the event loop (cheap dict copies) and serialized/written on a single
+    executor thread. Row-based backends only receive the rows that changed.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+        self.sources = {}
+        self.dirty = {}
+        self.flush_count = 0
+        self.files_written = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.failed_in_a_row = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self._lock = asyncio.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='persistence')
+
+    def register(self, name, source, copy_row=None, on_failed=None):
+        # source() returns the live dict; copy_row(key, value) copies one row
+        # when a flush starts; on_failed(rows) hears about rows that were
+        # taken for a flush that failed and will be taken again
+        self.sources[name] = (source, copy_row or (lambda key, value: dict(value)), on_failed)
+
+    def load(self, name):
+        return self.backend.load(name)
+
+    def iter_rows(self, name):
+        # (key, row) pairs, read incrementally where the backend can
+        return self.backend.iter_rows(name)
+
+    def load_rows(self, name, keys):
+        # Only the given rows, where they exist
+        return self.backend.load_rows(name, keys)
+
+    def partitions(self):
+        return self.backend.partitions()
+
+    def mark_dirty(self, name, key=None):
+        # key=None means "rewrite everything", otherwise only that row changed
+        if key is None or not self.backend.per_row:
+            self.dirty[name] = None
+        elif self.dirty.get(name, ()) is not None:
+            self.dirty.setdefault(name, set()).add(key)
+
+    def _take_batch(self):
+        batch = []
+        for name, keys in self.dirty.items():
+            source, copy_row, _ = self.sources[name]
+            data = source()
+            if keys is None:
+                if hasattr(data, 'snapshot'):
+                    # Column stores hand over a cheap copy; rows are built off-loop
+                    rows = data.snapshot()
+                else:
+                    rows = {k: copy_row(k, v) for k, v in data.items()}
+                batch.append((name, rows, [], True, keys))
+            else:
+                rows = {k: copy_row(k, data[k]) for k in keys if k in data}
+                deleted = [k for k in keys if k not in data]
+                batch.append((name, rows, deleted, False, keys))
+        self.dirty = {}
+        return batch
+
+    def _write_batch(self, batch):
+        for name, rows, deleted, full, _ in batch:
+            if hasattr(rows, 'to_rows'):
+                rows = rows.to_rows()
+            self.backend.write(name, rows, deleted, full)
+
+    def _requeue(self, batch):
+        for name, rows, _, _, keys in batch:
+            on_failed = self.sources[name][2]
+            if on_failed is not None:
+                on_failed(rows)
+            if keys is None:
+                self.dirty[name] = None
+            else:
+                for key in keys:
+                    self.mark_dirty(name, key)
+
+    def _record(self, start, batch):
+        ms = (time.perf_counter() - start) * 1000
+        self.failed_in_a_row = 0
+        self.flush_count += 1
+        self.files_written += len(batch)
+        self.rows_written += sum(len(rows) + len(deleted) for _, rows, deleted, _, _ in batch)
+        self.last_flush_ms = ms
+        self.max_flush_ms = max(self.max_flush_ms, ms)
+        self.total_flush_ms += ms
+
+    async def flush(self):
+        async with self._lock:
+            if not self.dirty:
+                return
+            start = time.perf_counter()
+            batch = self._take_batch()
+            try:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._write_batch, batch)
+            except Exception as e:
+                # Keep the data dirty so the next tick retries
+                self._requeue(batch)
+                self.failures += 1
+                self.failed_in_a_row += 1
+                audit('persistence_flush_failed', logging.ERROR, error=str(e), partitions=len(batch))
+                return
+            self._record(start, batch)
+
+    def flush_sync(self):
+        # Used at interpreter exit when the event loop is no longer running
+        if not self.dirty:
+            return
+        start = time.perf_counter()
+        batch = self._take_batch()
+        self._write_batch(batch)
+        self._record(start, batch)
+
+    def stats(self):
+        avg = self.total_flush_ms / self.flush_count if self.flush_count else 0.0
+        return {
+            'backend': STORAGE_BACKEND,
+            'flushes': self.flush_count,
+            'files_written': self.files_written,
+            'rows_written': self.rows_written,
+            'failures': self.failures,
+            'failed_in_a_row': self.failed_in_a_row,
+            'pending': len(self.dirty),
+            'last_ms': self.last_flush_ms,
+            'avg_ms': avg,
+            'max_ms': self.max_flush_ms,
+        }
+
+# -------------------- USER STATS STORE --------------------
+class StatsStore:
+    """Per-user activity counters in flat columns.
+
+    User IDs map to slots; message counts and VC seconds live in int64
+    arrays indexed by slot, so a user costs a few dozen bytes instead of a
+    dict of dicts. Names are not stored per message: they are resolved from
+    the client cache when needed, with the name seen when the slot was
+    created (or loaded from disk) as the fallback.
+    """
+    def __init__(self):
+        self.slots = {}
+        self.ids = array('q')
+        self.messages = array('q')
+        self.vc_seconds = array('q')
+        self.names = {}
+        # slot -> [[epoch, messages, vc_seconds], ...], see ACTIVITY BASELINES
+        self.snaps = {}
+        # start_time -> [has, messages, vc_seconds] columns by slot: each
+        # user's baseline for a running giveaway, kept current as snaps are
+        # taken so an ending reads them with one gather
+        self.baselines = {}
+        # (slots covered, argsort of ids, sorted ids) for slots_of
+        self._sorted = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        store = cls()
+        for uid, row in rows.items():
+            store.add_row(uid, row)
+        return store
+
+    def add_row(self, uid, row):
+        slot = self.slot(int(uid))
+        self.messages[slot] = int(row.get('messages', 0))
+        self.vc_seconds[slot] = int(round(row.get('vc_time', 0) * 60))
+        if row.get('name'):
+            self.names[slot] = row['name']
+        if row.get('snaps'):
+            self.snaps[slot] = [[e, m, int(round(vc * 60))] for e, m, vc in row['snaps']]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, uid):
+        return int(uid) in self.slots
+
+    def __getitem__(self, uid):
+        return self.row(self.slots[int(uid)])
+
+    def items(self):
+        for uid, slot in self.slots.items():
+            yield uid, self.row(slot)
+
+    def slot(self, uid, who=None):
+        slot = self.slots.get(uid)
+        if slot is None:
+            slot = self.slots[uid] = len(self.ids)
+            self.ids.append(uid)
+            self.messages.append(0)
+            self.vc_seconds.append(0)
+            if who is not None:
+                self.names[slot] = str(who)
+        return slot
+
+    def get(self, uid):
+        # (messages, vc_minutes) for one user, zeros if never seen
+        slot = self.slots.get(int(uid))
+        if slot is None:
+            return 0, 0.0
+        return self.messages[slot], self.vc_seconds[slot] / 60
+
+    def name_of(self, uid):
+        user = bot.get_user(int(uid))
+        if user is not None:
+            return str(user)
+        slot = self.slots.get(int(uid))
+        return self.names.get(slot, str(uid))
+
+    def row(self, slot):
+        row = {'messages': self.messages[slot], 'vc_time': self.vc_seconds[slot] / 60,
+               'name': self.names.get(slot)}
+        if slot in self.snaps:
+            row['snaps'] = [[e, m, vc / 60] for e, m, vc in self.snaps[slot]]
+        return row
+
+    def snapshot(self):
+        return StatsSnapshot(self)
+
+    def slots_of(self, uids):
+        # Slot of each id in an int64 array, -1 if never seen. The ids are
+        # sorted once; slots added since are searched on their own until
+        # there are enough of them to sort everything again.
+        n = len(self.ids)
+        if self._sorted is None or n - self._sorted[0] > self._sorted[0] // 8:
+            ids = np.frombuffer(self.ids, dtype=np.int64)
+            order = np.argsort(ids)
+            self._sorted = (n, order, ids[order])
+            del ids
+        covered, order, sorted_ids = self._sorted
+        slots = lookup_sorted(sorted_ids, order, uids, -1)
+        if covered < n:
+            tail = np.frombuffer(self.ids, dtype=np.int64)[covered:].copy()
+            tail_order = np.argsort(tail)
+            slots = np.where(slots >= 0, slots, lookup_sorted(tail[tail_order], tail_order + covered, uids, -1))
+        return slots
+
+    def track_baselines(self, starts):
+        # Baseline columns for exactly these start times
+        for since in [since for since in self.baselines if since not in starts]:
+            del self.baselines[since]
+        for since in starts:
+            if since in self.baselines:
+                continue
+            column = self.baselines[since] = [array('b'), array('q'), array('q')]
+            for slot, snaps in self.snaps.items():
+                i = bisect.bisect_left(snaps, [since])
+                if i < len(snaps):
+                    self._set_baseline(column, slot, snaps[i])
+
+    def note_snap(self, slot, snap):
+        # A snap just taken is the baseline for each tracked start it is the
+        # first snap at or after
+        for since, column in self.baselines.items():
+            if since <= snap[0] and (slot >= len(column[0]) or not column[0][slot]):
+                self._set_baseline(column, slot, snap)
+
+    @staticmethod
+    def _set_baseline(column, slot, snap):
+        has, messages, vc_seconds = column
+        if slot >= len(has):
+            grow = slot + 1 - len(has)
+            has.frombytes(bytes(grow))
+            messages.frombytes(bytes(8 * grow))
+            vc_seconds.frombytes(bytes(8 * grow))
+        has[slot] = 1
+        messages[slot] = snap[1]
+        vc_seconds[slot] = snap[2]
+
+    def baselines_of(self, since, slots):
+        # (has, messages, vc_seconds) arrays for these slots (all >= 0)
+        column = self.baselines.get(since)
+        if column is None:
+            # Not a running giveaway's start: look each snap up
+            picked = []
+            for slot in slots.tolist():
+                snaps = self.snaps.get(slot)
+                i = bisect.bisect_left(snaps, [since]) if snaps else 0
+                picked.append(snaps[i] if snaps and i < len(snaps) else (None, 0, 0))
+            return (np.fromiter((p[0] is not None for p in picked), dtype=bool, count=len(picked)),
+                    np.fromiter((p[1] for p in picked), dtype=np.int64, count=len(picked)),
+                    np.fromiter((p[2] for p in picked), dtype=np.int64, count=len(picked)))
+        has, messages, vc_seconds = column
+        # Slots past the end of the columns have no baseline yet
+        inside = slots < len(has)
+        idx = np.where(inside, slots, 0)
+        if not len(has):
+            return np.zeros(len(slots), dtype=bool), np.zeros(len(slots), dtype=np.int64), np.zeros(len(slots), dtype=np.int64)
+        return (inside & np.frombuffer(has, dtype=np.int8)[idx].astype(bool),
+                np.frombuffer(messages, dtype=np.int64)[idx], np.frombuffer(vc_seconds, dtype=np.int64)[idx])
+
+    def absorb(self, other):
+        # Add another store's counters to this one; its baseline snaps are dropped
+        for uid, theirs in other.slots.items():
+            slot = self.slot(uid)
+            self.messages[slot] += other.messages[theirs]
+            self.vc_seconds[slot] += other.vc_seconds[theirs]
+            if theirs in other.names:
+                self.names.setdefault(slot, other.names[theirs])
+
+    def memory_report(self):
+        columns = {name: arr.buffer_info()[1] * arr.itemsize
+                   for name, arr in (('ids', self.ids), ('messages', self.messages), ('vc_seconds', self.vc_seconds))}
+        report = {
+            'users': len(self.ids),
+            **{f'{name}_bytes': size for name, size in columns.items()},
+            'slot_map_bytes': sys.getsizeof(self.slots) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in self.slots.items()),
+            'names': len(self.names),
+            'names_bytes': sys.getsizeof(self.names) + sum(sys.getsizeof(n) for n in self.names.values()),
+            'snap_users': len(self.snaps),
+            'snaps_bytes': sys.getsizeof(self.snaps) + sum(sys.getsizeof(v) + 88 * len(v) for v in self.snaps.values()),
+        }
+        report['total_bytes'] = sum(v for k, v in report.items() if k.endswith('_bytes'))
+        return report
+
+class StatsSnapshot:
+    # Point-in-time copy of a StatsStore; to_rows() runs on the persistence thread
+    def __init__(self, store):
+        self.ids = array('q', store.ids)
+        self.messages = array('q', store.messages)
+        self.vc_seconds = array('q', store.vc_seconds)
+        self.names = dict(store.names)
+        self.snaps = {slot: list(snaps) for slot, snaps in store.snaps.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def to_rows(self):
+        rows = {}
+        for slot, uid in enumerate(self.ids):
+            row = {'messages': self.messages[slot], 'vc_time': self.vc_seconds[slot] / 60,
+                   'name': self.names.get(slot)}
+            if slot in self.snaps:
+                row['snaps'] = [[e, m, vc / 60] for e, m, vc in self.snaps[slot]]
+            rows[str(uid)] = row
+        return rows
 
 # Data storage
-user_stats = load_json(STATS_FILE, {})
-giveaways = load_json(GIVEAWAY_FILE, {})
-vc_tracking = {}
-temp_giveaways = {}
+persistence = WriteBehindStore(open_storage())
+
+# msg_id -> record for every giveaway this shard owns, across guilds. The
+# records are shared with each GuildState's own dict, which is what gets
+# persisted; this index only exists for lookups by message id.
+giveaways = {}
+
+# Live entrant sets, kept current from raw reaction events. A giveaway is in
+# entrants_synced once its set is known to match the message's reactions.
+entrant_index = {}
+entrants_synced = set()
+entrant_journal = {}
+# Entrants added (True) or removed (False) since the last flush, per
+# giveaway, so row-based backends only write those. None means the whole
+# set is written again.
+entrant_changes = {}
+
+def entrant_changed(mid, uid, added):
+    changes = entrant_changes.setdefault(mid, {})
+    if changes is not None:
+        changes[uid] = added
+
+def replace_entrants(mid, ids):
+    entrant_index[mid] = ids
+    entrant_changes[mid] = None
+
+def giveaway_row(mid, data):
+    row = dict(data)
+    changes = entrant_changes.pop(mid, {})
+    if changes is None or not persistence.backend.per_row:
+        row['entrants'] = EntrantWrite(full=set(entrant_index.get(mid, ())))
+    else:
+        row['entrants'] = EntrantWrite(added=[uid for uid, added in changes.items() if added],
+                                       removed=[uid for uid, added in changes.items() if not added])
+    scope = state_of(data).scoped.get(mid)
+    if scope is not None:
+        row['activity'] = scope.row()
+    return row
+
+def giveaway_rows_failed(rows):
+    # The changes taken for a failed flush were rolled back: rewrite those sets
+    for mid in rows:
+        if mid in giveaways:
+            entrant_changes[mid] = None
+
+def shard_of(guild_id):
+    return (guild_id >> 22) % SHARD_COUNT if SHARD_COUNT else 0
+
+def owns_guild(guild_id):
+    return SHARD_IDS is None or shard_of(guild_id) in SHARD_IDS
+
+class GuildState:
+    """Everything the bot tracks for one guild.
+
+    Each guild is a separate persistence partition, so flushes, giveaway
+    endings and activity baselines only touch the guild they belong to. A
+    shard only creates states for guilds it receives events for.
+    """
+    def __init__(self, guild_id):
+        self.guild_id = guild_id
+        self.stats_key = (STATS_FILE, guild_id)
+        self.giveaways_key = (GIVEAWAY_FILE, guild_id)
+        self.vc_key = (VC_SESSIONS_FILE, guild_id)
+        self.archive_key = (ARCHIVE_FILE, guild_id)
+        # Stats are the biggest partition and no giveaway needs them to be
+        # scheduled, so they load on first use or in the background; see STARTUP.
+        # Activity counted before then waits in pending_activity.
+        self._stats = None
+        self.pending_activity = {}
+        self.giveaways = persistence.load(self.giveaways_key)
+        self.vc = VoiceLedger(self)
+        self.vc.restored = persistence.load(self.vc_key)
+        # Ended giveaways, oldest first; see GIVEAWAY ARCHIVE
+        rows = persistence.load(self.archive_key)
+        self.archive = {mid: archived_record(row) for mid, row in sorted(rows.items(), key=lambda kv: kv[1]['ended_at'])}
+        self.archive_bytes = sum(snapshot_bytes(rec) for rec in self.archive.values())
+        # See GIVEAWAY LOOKUP
+        self.lookup = GiveawayIndex()
+        self.archive_lookup = GiveawayIndex()
+        for mid, rec in self.archive.items():
+            self.archive_lookup.add(mid, rec)
+        self.setups = SetupSessions(SETUP_TIMEOUT, SETUP_MAX_SESSIONS)
+        # See CHANNEL INDEX
+        self.channels = None
+        # See ACTIVITY DEMAND
+        self.message_rule = None
+        self.vc_rule = None
+        self.scoped = {}
+        self.scoped_messages = []
+        self.scoped_vc = []
+        # See ACTIVITY BASELINES
+        self.activity_epoch = 0.0
+        self.oldest_epoch = 0.0
+        # Start times of running giveaways on the shared counters
+        self.baseline_starts = set()
+        for mid, data in self.giveaways.items():
+            self.load_giveaway(mid, data)
+        self.lookup.sort()
+        self.archive_lookup.sort()
+        persistence.register(self.stats_key, lambda: self.stats, lambda uid, row: row)
+        persistence.register(self.giveaways_key, lambda: self.giveaways, giveaway_row, giveaway_rows_failed)
+        persistence.register(self.vc_key, lambda: self.vc.sessions, lambda uid, session: [*session, time.time()])
+        persistence.register(self.archive_key, lambda: self.archive, archive_row)
+
+    def load_giveaway(self, mid, data):
+        # A stored giveaway: at startup, or one adopted from another process
+        data['guild_id'] = self.guild_id
+        self.giveaways[mid] = giveaways[mid] = data
+        entrant_index[mid] = set(unpack_ids(data.pop('entrants', None)))
+        if 'activity' in data:
+            self.scoped[mid] = ScopedActivity(mid, data, data.pop('activity'))
+        self.lookup.add(mid, data)
+
+    @property
+    def stats_loaded(self):
+        return self._stats is not None
+
+    @property
+    def stats(self):
+        if self._stats is None:
+            self.stats = StatsStore.from_rows(persistence.load(self.stats_key))
+        return self._stats
+
+    @stats.setter
+    def stats(self, store):
+        self._stats = store
+        if np is not None:
+            store.track_baselines(self.baseline_starts)
+        pending, self.pending_activity = self.pending_activity, {}
+        for uid, entries in pending.items():
+            for epoch, messages, seconds, who in entries:
+                self._count(uid, messages, seconds, who, epoch)
+
+    def count_activity(self, uid, messages=0, seconds=0, who=None):
+        # Messages and VC seconds for the shared counters. Until the stats
+        # have loaded they are buffered per activity epoch, so the load is
+        # never forced on the event loop and baselines still land in order.
+        if self._stats is not None:
+            return self._count(uid, messages, seconds, who, self.activity_epoch)
+        entries = self.pending_activity.setdefault(uid, [])
+        if not entries or entries[-1][0] != self.activity_epoch:
+            entries.append([self.activity_epoch, 0, 0, None])
+        entry = entries[-1]
+        entry[1] += messages
+        entry[2] += seconds
+        if who is not None:
+            entry[3] = str(who)
+
+    def _count(self, uid, messages, seconds, who, epoch):
+        slot = self._stats.slot(uid, who)
+        touch_activity(self, slot, epoch)
+        self._stats.messages[slot] += messages
+        self._stats.vc_seconds[slot] += seconds
+        persistence.mark_dirty(self.stats_key, uid)
+
+guild_states = {}
+
+def state_for(guild_id):
+    state = guild_states.get(guild_id)
+    if state is None:
+        state = guild_states[guild_id] = GuildState(guild_id)
+    return state
+
+def state_of(data):
+    return guild_states[data['guild_id']]
+
+def load_partitions():
+    # Only the guilds this shard serves are loaded; unpartitioned data goes
+    # to whichever process runs shard 0
+    for guild_id in sorted(persistence.partitions()):
+        if owns_guild(guild_id):
+            state_for(guild_id)
+
+def adopt_legacy_state():
+    # Data saved before guilds were partitioned: giveaways move to their
+    # channel's guild. Stats and VC sessions can only be attributed when the
+    # bot is in exactly one guild.
+    legacy = guild_states.get(LEGACY_GUILD)
+    if legacy is None:
+        return
+    moved = 0
+    for mid, data in list(legacy.giveaways.items()):
+        channel = bot.get_channel(data['channel_id'])
+        if channel is None:
+            continue
+        del legacy.giveaways[mid]
+        legacy.lookup.discard(mid)
+        persistence.mark_dirty(legacy.giveaways_key, mid)
+        add_giveaway(state_for(channel.guild.id), mid, data)
+        moved += 1
+    if SHARD_IDS is None and len(bot.guilds) == 1 and legacy.vc.restored:
+        # Stats follow in adopt_legacy_stats, once warm_stats has loaded them
+        target = state_for(bot.guilds[0].id)
+        target.vc.restored = {**legacy.vc.restored, **target.vc.restored}
+        legacy.vc.restored = {}
+        for state in (legacy, target):
+            persistence.mark_dirty(state.vc_key)
+    if moved:
+        audit('legacy_giveaways_moved', giveaways=moved)
+
+def adopt_legacy_stats():
+    # Called by warm_stats, so neither store is loaded in one go on the loop
+    legacy = guild_states.get(LEGACY_GUILD)
+    if legacy is None or not legacy.stats_loaded or not len(legacy.stats):
+        return
+    if SHARD_IDS is None and len(bot.guilds) == 1:
+        target = state_for(bot.guilds[0].id)
+        if len(target.stats):
+            target.stats.absorb(legacy.stats)
+        else:
+            target.stats = legacy.stats
+        legacy.stats = StatsStore()
+        for state in (legacy, target):
+            persistence.mark_dirty(state.stats_key)
+        audit('legacy_stats_adopted', guild_id=target.guild_id)
+    else:
+        # Which guild they belong to is unknown while the bot is in several
+        audit('legacy_stats_left', logging.WARNING, users=len(legacy.stats), guild_id=LEGACY_GUILD)
+
+def setups_for(interaction):
+    return state_for(interaction.guild_id).setups
+
+# -------------------- SETUP SESSIONS --------------------
+# Drafts being built in a GiveawaySetupView. A draft lives as long as the
+# view that edits it: it expires SETUP_TIMEOUT after it was last touched and
+# is dropped from the view's on_timeout. A guild keeps at most
+# SETUP_MAX_SESSIONS, evicting the least recently used.
+SETUP_TIMEOUT = 300
+SETUP_MAX_SESSIONS = int(os.environ.get('SETUP_MAX_SESSIONS', 200))
+
+class SetupSessions:
+    """One guild's setup drafts by user id, least recently used first.
+
+    `awaiting_image` maps only the users whose next upload is the giveaway
+    image to their prompt (followup webhook, message id), so on_message
+    checks a set that is almost always empty.
+    """
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sessions = {}  # user_id -> [expires_at, draft]
+        self.awaiting_image = {}
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __getitem__(self, user_id):
+        draft = self.get(user_id)
+        if draft is None:
+            raise KeyError(user_id)
+        return draft
+
+    def get(self, user_id, default=None):
+        entry = self.sessions.pop(user_id, None)
+        if entry is None:
+            return default
+        now = time.monotonic()
+        if entry[0] <= now:
+            self.expired += 1
+            self.awaiting_image.pop(user_id, None)
+            return default
+        # Re-inserting keeps the dict in least-recently-used order
+        entry[0] = now + self.ttl
+        self.sessions[user_id] = entry
+        return entry[1]
+
+    def __setitem__(self, user_id, draft):
+        self.sessions.pop(user_id, None)
+        self.sessions[user_id] = [time.monotonic() + self.ttl, draft]
+        self.prune()
+
+    def pop(self, user_id, default=None):
+        self.awaiting_image.pop(user_id, None)
+        entry = self.sessions.pop(user_id, None)
+        return default if entry is None else entry[1]
+
+    def __delitem__(self, user_id):
+        if self.pop(user_id) is None:
+            raise KeyError(user_id)
+
+    def prune(self):
+        now = time.monotonic()
+        while self.sessions:
+            user_id, (expires_at, _) = next(iter(self.sessions.items()))
+            if expires_at > now and len(self.sessions) <= self.max_size:
+                break
+            if expires_at > now:
+                self.evicted += 1
+            else:
+                self.expired += 1
+            self.pop(user_id)
+
+    def await_image(self, user_id, followup, prompt_id):
+        self.awaiting_image[user_id] = (followup, prompt_id)
+
+def add_giveaway(state, mid, data):
+    data['guild_id'] = state.guild_id
+    # New, or moved from another partition: its stored entrants are not known
+    entrant_changes[mid] = None
+    state.giveaways[mid] = giveaways[mid] = data
+    state.lookup.add(mid, data)
+    persistence.mark_dirty(state.giveaways_key, mid)
+
+def mark_giveaway_dirty(mid):
+    persistence.mark_dirty(state_of(giveaways[mid]).giveaways_key, mid)
+
+def remove_giveaway(mid):
+    data = giveaways.pop(mid, None)
+    if data is None:
+        return
+    state = state_of(data)
+    state.giveaways.pop(mid, None)
+    state.lookup.discard(mid)
+    giveaway_messages.invalidate(mid)
+    forget_entrants(mid)
+    leases.drop(mid)
+    end_failures.pop(mid, None)
+    persistence.mark_dirty(state.giveaways_key, mid)
+
+# -------------------- GIVEAWAY LOOKUP --------------------
+# Commands, modals and slash autocomplete find giveaways by short ID, by a
+# prefix of the message ID or by the start of the prize name. Each of those
+# terms is filed once in a sorted list, so a prefix lookup is a bisect plus a
+# scan over the matching run, and memory stays one entry per term.
+AUTOCOMPLETE_LIMIT = 25  # Discord's limit on autocomplete choices
+
+class GiveawayIndex:
+    """Prefix index over one guild's giveaways (running or archived)."""
+    def __init__(self):
+        self.keys = []      # (term, msg_id), sorted before each lookup
+        self.unsorted = False
+        self.entries = {}   # msg_id -> (short ID, terms it is filed under), in insertion order
+        self.short = {}
+
+    @staticmethod
+    def terms(mid, data):
+        prize = (data.get('prize') or '').lower()
+        # The whole prize as well as each word, so "nitro cl" finds "Nitro Classic"
+        return [mid, (data.get('giveaway_id') or '').lower(), prize, *prize.split()]
+
+    def add(self, mid, data):
+        self.discard(mid)
+        terms = {term for term in self.terms(mid, data) if term}
+        # Appended now and sorted once on the next lookup, so loading a
+        # guild's giveaways is one sort rather than an insort per term
+        self.keys.extend((term, mid) for term in terms)
+        self.unsorted = True
+        short = data.get('giveaway_id')
+        self.entries[mid] = (short, terms)
+        if short:
+            self.short[short] = mid
+
+    def sort(self):
+        if self.unsorted:
+            self.keys.sort()
+            self.unsorted = False
+        return self.keys
+
+    def discard(self, mid):
+        entry = self.entries.pop(mid, None)
+        if entry is None:
+            return
+        short, terms = entry
+        keys = self.sort()
+        for term in terms:
+            del keys[bisect.bisect_left(keys, (term, mid))]
+        if self.short.get(short) == mid:
+            del self.short[short]
+
+    def matches(self, prefix):
+        # Giveaways with a term starting with prefix, each once
+        keys = self.sort()
+        seen = set()
+        i = bisect.bisect_left(keys, (prefix,))
+        while i < len(keys) and keys[i][0].startswith(prefix):
+            mid = keys[i][1]
+            if mid not in seen:
+                seen.add(mid)
+                yield mid
+            i += 1
+
+    def search(self, query, limit=AUTOCOMPLETE_LIMIT):
+        query = query.strip().lower()
+        return list(itertools.islice(self.matches(query) if query else self.entries, limit))
+
+    def resolve(self, key):
+        # Exact message ID, then short ID, then a message ID prefix
+        if key in self.entries:
+            return key
+        if key in self.short:
+            return self.short[key]
+        return next((mid for mid in self.matches(key) if mid.startswith(key)), None) if key else None
+
+# -------------------- GIVEAWAY ARCHIVE --------------------
+# Ended giveaways keep the entrants that were eligible when they ended, as a
+# sorted array of user ids (8 bytes each) plus entry counts for bonus
+# giveaways, so rerolls are drawn locally without fetching any reactions.
+# The oldest are evicted once a guild's snapshots pass ARCHIVE_MAX_BYTES or
+# they are older than ARCHIVE_MAX_DAYS.
+ARCHIVE_MAX_DAYS = float(os.environ.get('ARCHIVE_MAX_DAYS', 7))
+ARCHIVE_MAX_BYTES = int(os.environ.get('ARCHIVE_MAX_BYTES', 4 * 1024 * 1024))
+
+def snapshot_bytes(rec):
+    weights = rec['weights']
+    return rec['eligible'].itemsize * len(rec['eligible']) + (weights.itemsize * len(weights) if weights else 0)
+
+def archived_record(row):
+    row['eligible'] = unpack_array('Q', row.get('eligible'))
+    row['weights'] = unpack_array('H', row['weights']) if row.get('weights') else None
+    return row
+
+def archive_row(mid, rec):
+    row = dict(rec)
+    row['winner_ids'] = list(rec['winner_ids'])
+    row['eligible'] = pack_array(rec['eligible'])
+    row['weights'] = pack_array(rec['weights']) if rec['weights'] else None
+    return row
+
+def archive_giveaway(mid, data, winner_ids, eligible, weights=None):
+    state = state_of(data)
+    rec = dict(data)
+    rec.update(ended=True, ended_at=time.time(), winner_ids=list(winner_ids), eligible=eligible, weights=weights)
+    state.archive[mid] = rec
+    state.archive_lookup.add(mid, rec)
+    state.archive_bytes += snapshot_bytes(rec)
+    persistence.mark_dirty(state.archive_key, mid)
+    prune_archive(state)
+
+def prune_archive(state, now=None):
+    cutoff = (now or time.time()) - ARCHIVE_MAX_DAYS * 86400
+    # Dicts keep insertion order, so the oldest entry is always first
+    while state.archive:
+        mid, rec = next(iter(state.archive.items()))
+        # The newest snapshot is kept even if it alone is over the budget
+        too_big = state.archive_bytes > ARCHIVE_MAX_BYTES and len(state.archive) > 1
+        if rec['ended_at'] >= cutoff and not too_big:
+            break
+        del state.archive[mid]
+        state.archive_lookup.discard(mid)
+        state.archive_bytes -= snapshot_bytes(rec)
+        persistence.mark_dirty(state.archive_key, mid)
+
+def reroll_archived(state, mid, k=1):
+    # Previous winners (the original ones and earlier rerolls) are excluded
+    rec = state.archive[mid]
+    rng = draw_rng(mid, rec)
+    picked = sample_snapshot(rec['eligible'], rec['weights'], k, rng, exclude=rec['winner_ids'])
+    rec['winner_ids'].extend(picked)
+    persistence.mark_dirty(state.archive_key, mid)
+    return picked
+
+atexit.register(persistence.flush_sync)
+
+@tasks.loop(seconds=FLUSH_INTERVAL)
+async def flush_loop():
+    await persistence.flush()
 
 # Default emoji options
 EMOJI_OPTIONS = ["🎉", "🎁", "🏆", "⭐", "🎈", "🎊", "👑", "💎", "🍕", "🍦"]
@@ -54,32 +1920,52 @@ async def set_winner(ctx, member: discord.Member = None, giveaway_id: str = None
         )
         await ctx.send(embed=embed, delete_after=10)
         return
+    state = state_for(ctx.guild.id)
     if not giveaway_id:
-        if not giveaways:
+        if not state.giveaways:
             await ctx.send("No active giveaways.", delete_after=5)
             return
         embed = discord.Embed(title="📋 Active Giveaways", color=discord.Color.blue())
-        for msg_id, data in list(giveaways.items())[:10]:
+        for msg_id, data in list(state.giveaways.items())[:10]:
             short_id = data.get('giveaway_id', msg_id[:6])
             emoji = data.get('emoji', '🎉')
             embed.add_field(name=f"{emoji} ID: `{short_id}`", value=data['prize'][:50], inline=False)
         await ctx.send(embed=embed, delete_after=15)
         return
 
-    matched = None
-    full_id = None
-    for msg_id, data in giveaways.items():
-        if data.get('giveaway_id') == giveaway_id or msg_id.startswith(giveaway_id):
-            matched = data
-            full_id = msg_id
-            break
-    if not matched:
+    full_id = state.lookup.resolve(giveaway_id)
+    if full_id is None:
         await ctx.send(f"❌ Giveaway ID not found.", delete_after=5)
         return
 
+    # A standby process sees the same command; only one may act on it
+    if not await leases.claim_once(f'cmd:{ctx.message.id}'):
+        return
+    await ctx.send(await force_winner(state, full_id, member), delete_after=5)
+
+async def force_winner(state, full_id, member):
+    # Shared by $set and /giveaway set; returns the reply for the admin
+    matched = state.giveaways.get(full_id)
+    if matched is None:
+        return "❌ Giveaway ID not found."
+    if full_id in ending_giveaways:
+        return "❌ That giveaway is already ending."
+    # Marked before claiming so the scheduler cannot start the same ending
+    # meanwhile; a held claim is refused even to the process holding it
+    ending_giveaways.add(full_id)
+    key = f'end:{full_id}'
+    try:
+        if not await leases.claim(key):
+            return "❌ That giveaway is already ending."
+        return await force_winner_claimed(state, full_id, matched, member, key)
+    finally:
+        ending_giveaways.discard(full_id)
+
+async def force_winner_claimed(state, full_id, matched, member, key):
     channel = bot.get_channel(matched['channel_id'])
     try:
-        msg = await channel.fetch_message(int(full_id))
+        reqs = matched.get('requirements', {})
+        eligible, weights, report = await entrant_snapshot(full_id, matched, reqs)
         embed = discord.Embed(
             title="🎉 Giveaway Ended",
             description=f"**Winner:** {member.mention}\n**Prize:** {matched['prize']}",
@@ -87,23 +1973,173 @@ async def set_winner(ctx, member: discord.Member = None, giveaway_id: str = None
         )
         if matched.get('image_url'):
             embed.set_image(url=matched['image_url'])
-        await msg.reply(embed=embed)
-        del giveaways[full_id]
-        save_json(GIVEAWAY_FILE, giveaways)
-        await ctx.send(f"✅ Winner set.", delete_after=5)
+        await rest.call(rest.ANNOUNCE, channel.id, channel.get_partial_message(int(full_id)).reply, embed=embed)
+        archive_giveaway(full_id, matched, [member.id], eligible, weights)
+        audit('giveaway_ended', **ending_summary(full_id, matched, reqs, report, [member.id]), forced=True)
+        remove_giveaway(full_id)
+        scheduler.cancel(full_id)
+        refresh_activity_epochs(state)
+        await leases.complete(key)
+        return "✅ Winner set."
     except Exception as e:
-        await ctx.send(f"❌ Error: {e}", delete_after=5)
+        await leases.release(key)
+        # A scheduled ending that fired meanwhile was skipped; let it run again
+        scheduler.schedule(full_id, matched['end_time'])
+        return f"❌ Error: {e}"
+
+@bot.command(name='flushstats', hidden=True)
+async def flush_stats(ctx):
+    if not ctx.author.guild_permissions.administrator:
+        return
+    st = persistence.stats()
+    embed = discord.Embed(title="💾 Persistence", color=0x2C3E50)
+    embed.add_field(name="Backend", value=st['backend'], inline=True)
+    embed.add_field(name="Flushes", value=st['flushes'], inline=True)
+    embed.add_field(name="Rows written", value=st['rows_written'], inline=True)
+    embed.add_field(name="Pending", value=st['pending'], inline=True)
+    embed.add_field(name="Last / Avg / Max", value=f"{st['last_ms']:.1f} / {st['avg_ms']:.1f} / {st['max_ms']:.1f} ms", inline=False)
+    embed.add_field(name="Failures", value=st['failures'], inline=True)
+    await ctx.send(embed=embed, delete_after=15)
+
+@bot.command(name='statsmem', hidden=True)
+async def stats_memory(ctx):
+    if not ctx.author.guild_permissions.administrator:
+        return
+    report = state_for(ctx.guild.id).stats.memory_report()
+    embed = discord.Embed(title="🧮 Stats Store Memory", color=0x2C3E50)
+    embed.add_field(name="Users", value=report['users'], inline=True)
+    embed.add_field(name="Total", value=f"{report['total_bytes'] / 1024:.1f} KiB", inline=True)
+    embed.add_field(name="Per user", value=f"{report['total_bytes'] / max(1, report['users']):.1f} B", inline=True)
+    embed.add_field(name="Breakdown", value="\n".join(
+        f"{k[:-6]}: {v / 1024:.1f} KiB" for k, v in report.items() if k.endswith('_bytes') and k != 'total_bytes'
+    ), inline=False)
+    await ctx.send(embed=embed, delete_after=30)
+
+@bot.command(name='profile', hidden=True)
+async def profile_bot(ctx, seconds: float = None, mode: str = 'sample'):
+    # Profiles the process that answers; each worker reports on itself
+    if not ctx.author.guild_permissions.administrator:
+        return
+    if seconds is None or mode not in ('sample', 'cprofile'):
+        embed = discord.Embed(
+            title="🔬 Profile Command",
+            description=f"Usage: `$profile SECONDS [sample|cprofile]` (at most {PROFILE_MAX_SECONDS}s)",
+            color=0x2C3E50
+        )
+        slow = [f"<t:{int(ts)}:R> `{kind}:{name}` {took * 1000:.0f} ms"
+                for ts, kind, name, took in reversed(slow_callbacks.recent)]
+        embed.add_field(name=f"Slow callbacks (≥ {SLOW_CALLBACK_SECONDS * 1000:.0f} ms)",
+                        value="\n".join(slow)[:1024] or "None recorded.", inline=False)
+        await ctx.send(embed=embed, delete_after=30)
+        return
+    if profiler.running:
+        await ctx.send("❌ A profile is already running.", delete_after=5)
+        return
+    seconds = min(max(seconds, 1.0), PROFILE_MAX_SECONDS)
+    await ctx.send(f"🔬 Profiling `{WORKER_ID}` for {seconds:g}s ({mode})...", delete_after=seconds + 5)
+    base, samples, top = await profiler.run(seconds, deterministic=mode == 'cprofile')
+    embed = discord.Embed(title="🔬 Profile Saved", color=0x2C3E50)
+    embed.add_field(name="Worker", value=WORKER_ID, inline=True)
+    embed.add_field(name="Samples", value=samples, inline=True)
+    embed.add_field(name="Files", value=f"`{base}.txt`\n`{base}.collapsed`", inline=False)
+    embed.add_field(name="Top functions (own time)", value="\n".join(
+        f"{100 * count / max(1, samples):.1f}% `{frame[:80]}`" for frame, count in top
+    ) or "No samples.", inline=False)
+    await ctx.send(embed=embed, delete_after=60)
+
+# -------------------- CHANNEL INDEX --------------------
+# Text channels the bot can post in, per guild, in sidebar order. Built the
+# first time the picker opens and dropped whenever a channel, a role or the
+# bot's own member changes, so permissions are not recomputed per click.
+
+def postable_channels(guild):
+    state = state_for(guild.id)
+    if state.channels is None:
+        me = guild.me
+        state.channels = [(ch.id, ch.name, ch.name.lower()) for ch in guild.text_channels
+                          if ch.permissions_for(me).send_messages]
+    return state.channels
+
+def invalidate_channels(guild):
+    state = guild_states.get(guild.id)
+    if state is not None:
+        state.channels = None
+
+@bot.event
+async def on_guild_channel_create(channel):
+    invalidate_channels(channel.guild)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    invalidate_channels(channel.guild)
+
+@bot.event
+async def on_guild_channel_update(before, after):
+    invalidate_channels(after.guild)
+
+@bot.event
+async def on_guild_role_create(role):
+    invalidate_channels(role.guild)
+
+@bot.event
+async def on_guild_role_delete(role):
+    invalidate_channels(role.guild)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    invalidate_channels(after.guild)
+
+@bot.event
+async def on_member_update(before, after):
+    if after.id == bot.user.id:
+        invalidate_channels(after.guild)
 
 # -------------------- CHANNEL SELECT VIEW --------------------
-class ChannelSelectView(View):
-    def __init__(self):
-        super().__init__(timeout=60)
+PICKER_PAGE_SIZE = 25  # Discord's limit on select options
 
-    @discord.ui.select(placeholder="Select a channel...", min_values=1, max_values=1)
+class ChannelSelectView(TimedView):
+    """Pages through the channel index, optionally filtered by name."""
+    def __init__(self, channels):
+        super().__init__(timeout=120)
+        self.channels = channels
+        self.search('')
+
+    @property
+    def pages(self):
+        return max(1, -(-len(self.matches) // PICKER_PAGE_SIZE))
+
+    def search(self, query):
+        self.query = query.strip().lstrip('#').lower()
+        self.matches = [c for c in self.channels if self.query in c[2]] if self.query else self.channels
+        self.page = 0
+        self.render()
+
+    def render(self):
+        first = self.page * PICKER_PAGE_SIZE
+        options = [discord.SelectOption(label=f"#{name}"[:100], value=str(cid))
+                   for cid, name, _ in self.matches[first:first + PICKER_PAGE_SIZE]]
+        self.select_channel.options = options or [discord.SelectOption(label="No matching channels", value="0")]
+        self.select_channel.disabled = not options
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages - 1
+
+    def content(self):
+        found = f"{len(self.matches)} channels"
+        if self.query:
+            found += f" matching `{self.query}`"
+        return f"Select a channel ({found}, page {self.page + 1}/{self.pages}):"
+
+    async def show(self, interaction):
+        await interaction.response.edit_message(content=self.content(), view=self)
+
+    @discord.ui.select(placeholder="Select a channel...", min_values=1, max_values=1, row=0)
     async def select_channel(self, interaction: discord.Interaction, select: Select):
         channel = interaction.guild.get_channel(int(select.values[0]))
+        if channel is None:
+            return await interaction.response.send_message("That channel no longer exists.", ephemeral=True)
         giveaway_id = ''.join(random.choices('0123456789abcdef', k=6))
-        temp_giveaways[interaction.user.id] = {
+        setups = setups_for(interaction)
+        setups[interaction.user.id] = {
             'channel': channel,
             'prize': None,
             'duration': None,
@@ -112,36 +2148,67 @@ class ChannelSelectView(View):
             'custom_req': None,
             'emoji': '🎉',
             'image_url': None,
-            'waiting_for_image': False,
-            'giveaway_id': giveaway_id
+            'giveaway_id': giveaway_id,
+            'winners': 1,
+            'bonus': {},
+            'channel_rules': {}
         }
-        view = GiveawaySetupView(interaction.user.id)
+        view = GiveawaySetupView(interaction.user.id, interaction.guild_id)
         await interaction.response.edit_message(
             content=f"**Setup in {channel.mention}** | ID: `{giveaway_id}`\nUse the buttons below.",
             view=view
         )
 
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary, row=1)
+    async def prev_page(self, interaction: discord.Interaction, button: Button):
+        self.page = max(0, self.page - 1)
+        self.render()
+        await self.show(interaction)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary, row=1)
+    async def next_page(self, interaction: discord.Interaction, button: Button):
+        self.page = min(self.pages - 1, self.page + 1)
+        self.render()
+        await self.show(interaction)
+
+    @discord.ui.button(label="Search", emoji="🔍", style=discord.ButtonStyle.primary, row=1)
+    async def search_btn(self, interaction: discord.Interaction, button: Button):
+        await interaction.response.send_modal(ChannelSearchModal(self))
+
+class ChannelSearchModal(TimedModal, title="Find Channel"):
+    query = TextInput(label="Channel name contains (empty = all)", required=False, max_length=100)
+
+    def __init__(self, picker):
+        super().__init__()
+        self.picker = picker
+        self.query.default = picker.query
+
+    async def on_submit(self, interaction: discord.Interaction):
+        self.picker.search(self.query.value)
+        await self.picker.show(interaction)
+
 # -------------------- CUSTOM EMOJI MODAL --------------------
-class CustomEmojiModal(Modal, title="Custom Emoji"):
+class CustomEmojiModal(TimedModal, title="Custom Emoji"):
     def __init__(self, user_id):
         super().__init__()
         self.user_id = user_id
         self.add_item(TextInput(label="Emoji", placeholder="e.g. 🎉 or :pepe: or <:name:id>", max_length=50))
 
     async def on_submit(self, interaction: discord.Interaction):
-        if self.user_id not in temp_giveaways:
+        setups = setups_for(interaction)
+        if self.user_id not in setups:
             return await interaction.response.send_message("Setup expired.", ephemeral=True)
         emoji_input = self.children[0].value.strip()
         custom_emoji_match = re.match(r"<a?:\w+:\d+>", emoji_input)
         if custom_emoji_match or len(emoji_input) == 1 or emoji_input in EMOJI_OPTIONS:
-            temp_giveaways[self.user_id]['emoji'] = emoji_input
+            setups[self.user_id]['emoji'] = emoji_input
             await interaction.response.send_message(f"Emoji set to {emoji_input}", ephemeral=True)
         else:
-            temp_giveaways[self.user_id]['emoji'] = emoji_input
+            setups[self.user_id]['emoji'] = emoji_input
             await interaction.response.send_message(f"Emoji set to {emoji_input} (make sure it's valid)", ephemeral=True)
 
 # -------------------- EMOJI SELECT VIEW --------------------
-class EmojiSelectView(View):
+class EmojiSelectView(TimedView):
     def __init__(self, user_id):
         super().__init__(timeout=60)
         self.user_id = user_id
@@ -157,8 +2224,9 @@ class EmojiSelectView(View):
         async def callback(interaction: discord.Interaction):
             if interaction.user.id != self.user_id:
                 return await interaction.response.send_message("Not your setup.", ephemeral=True)
-            if self.user_id in temp_giveaways:
-                temp_giveaways[self.user_id]['emoji'] = emoji
+            setups = setups_for(interaction)
+            if self.user_id in setups:
+                setups[self.user_id]['emoji'] = emoji
                 await interaction.response.send_message(f"Emoji set to {emoji}", ephemeral=True)
             else:
                 await interaction.response.send_message("Setup expired.", ephemeral=True)
@@ -170,27 +2238,35 @@ class EmojiSelectView(View):
         await interaction.response.send_modal(CustomEmojiModal(self.user_id))
 
 # -------------------- IMAGE URL MODAL --------------------
-class ImageUrlModal(Modal, title="Set Image URL"):
+class ImageUrlModal(TimedModal, title="Set Image URL"):
     def __init__(self, user_id):
         super().__init__()
         self.user_id = user_id
         self.add_item(TextInput(label="Image URL", placeholder="https://i.imgur.com/example.jpg", max_length=200))
 
     async def on_submit(self, interaction: discord.Interaction):
-        if self.user_id not in temp_giveaways:
+        setups = setups_for(interaction)
+        if self.user_id not in setups:
             return await interaction.response.send_message("Setup expired.", ephemeral=True)
         url = self.children[0].value.strip()
-        temp_giveaways[self.user_id]['image_url'] = url
+        setups[self.user_id]['image_url'] = url
         preview_embed = discord.Embed(title="✅ Image URL Set", description="Preview (will auto-delete):")
         preview_embed.set_image(url=url)
         await interaction.response.send_message(embed=preview_embed, ephemeral=True)
-        print(f"Image URL stored for user {self.user_id}: {url}")
+        audit('image_set', user_id=self.user_id, guild_id=interaction.guild_id, source='url', url=url)
 
 # -------------------- GIVEAWAY SETUP VIEW --------------------
-class GiveawaySetupView(View):
-    def __init__(self, user_id):
-        super().__init__(timeout=300)
+class GiveawaySetupView(TimedView):
+    def __init__(self, user_id, guild_id):
+        super().__init__(timeout=SETUP_TIMEOUT)
         self.user_id = user_id
+        self.guild_id = guild_id
+
+    async def on_timeout(self):
+        # The draft can no longer be launched; free it now rather than at expiry
+        state = guild_states.get(self.guild_id)
+        if state is not None:
+            state.setups.pop(self.user_id)
 
     @discord.ui.button(label="Prize", style=discord.ButtonStyle.primary, row=0)
     async def set_prize(self, interaction: discord.Interaction, button: Button):
@@ -228,12 +2304,23 @@ class GiveawaySetupView(View):
             return await interaction.response.send_message("Not yours.", ephemeral=True)
         await interaction.response.send_modal(CustomReqModal(self.user_id))
 
+    @discord.ui.button(label="Channels", style=discord.ButtonStyle.secondary, row=1)
+    async def set_channels(self, interaction: discord.Interaction, button: Button):
+        if interaction.user.id != self.user_id:
+            return await interaction.response.send_message("Not yours.", ephemeral=True)
+        await interaction.response.send_modal(ChannelRulesModal(self.user_id))
+
     @discord.ui.button(label="Upload Image", style=discord.ButtonStyle.secondary, row=2)
     async def upload_image(self, interaction: discord.Interaction, button: Button):
         if interaction.user.id != self.user_id:
             return await interaction.response.send_message("Not yours.", ephemeral=True)
-        await interaction.response.send_message("📸 **Send an image now** (drag & drop).", ephemeral=True)
-        temp_giveaways[self.user_id]['waiting_for_image'] = True
+        setups = setups_for(interaction)
+        if self.user_id not in setups:
+            return await interaction.response.send_message("Session expired.", ephemeral=True)
+        # Sent as a followup so its id is known and on_message can delete it
+        await interaction.response.defer()
+        prompt = await interaction.followup.send("📸 **Send an image now** (drag & drop).", ephemeral=True, wait=True)
+        setups.await_image(self.user_id, interaction.followup, prompt.id)
 
     @discord.ui.button(label="Set Image URL", style=discord.ButtonStyle.secondary, row=2)
     async def set_image_url(self, interaction: discord.Interaction, button: Button):
@@ -241,11 +2328,24 @@ class GiveawaySetupView(View):
             return await interaction.response.send_message("Not yours.", ephemeral=True)
         await interaction.response.send_modal(ImageUrlModal(self.user_id))
 
+    @discord.ui.button(label="Winners", style=discord.ButtonStyle.primary, row=2)
+    async def set_winners(self, interaction: discord.Interaction, button: Button):
+        if interaction.user.id != self.user_id:
+            return await interaction.response.send_message("Not yours.", ephemeral=True)
+        await interaction.response.send_modal(WinnersModal(self.user_id))
+
+    @discord.ui.button(label="Bonus Entries", style=discord.ButtonStyle.secondary, row=2)
+    async def set_bonus(self, interaction: discord.Interaction, button: Button):
+        if interaction.user.id != self.user_id:
+            return await interaction.response.send_message("Not yours.", ephemeral=True)
+        await interaction.response.send_modal(BonusModal(self.user_id))
+
     @discord.ui.button(label="LAUNCH", style=discord.ButtonStyle.success, row=3)
     async def launch(self, interaction: discord.Interaction, button: Button):
         if interaction.user.id != self.user_id:
             return await interaction.response.send_message("Not yours.", ephemeral=True)
-        data = temp_giveaways.get(self.user_id)
+        setups = setups_for(interaction)
+        data = setups.get(self.user_id)
         if not data or not data.get('prize') or not data.get('duration'):
             return await interaction.response.send_message("Prize and Duration required.", ephemeral=True)
         await self.create_giveaway(interaction, data)
@@ -254,8 +2354,9 @@ class GiveawaySetupView(View):
     async def cancel(self, interaction: discord.Interaction, button: Button):
         if interaction.user.id != self.user_id:
             return await interaction.response.send_message("Not yours.", ephemeral=True)
-        if self.user_id in temp_giveaways:
-            del temp_giveaways[self.user_id]
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            del setups[self.user_id]
         await interaction.response.edit_message(content="Cancelled.", view=None)
 
     async def create_giveaway(self, interaction, data):
@@ -275,133 +2376,419 @@ class GiveawaySetupView(View):
         except:
             return await interaction.response.send_message("Invalid duration format.", ephemeral=True)
 
-        end_time = datetime.utcnow() + timedelta(seconds=seconds)
+        # Every giveaway time is an epoch timestamp from time.time()
+        end_time = time.time() + seconds
         emoji = data.get('emoji', '🎉')
 
-        req_list = []
         req_dict = {}
         if data.get('min_messages'):
             req_dict['min_messages'] = int(data['min_messages'])
-            req_list.append(f"• **{data['min_messages']} messages**")
         if data.get('min_vc'):
             req_dict['min_vc_minutes'] = int(data['min_vc'])
-            req_list.append(f"• **{data['min_vc']} min in VC**")
         if data.get('custom_req'):
             req_dict['custom'] = data['custom_req']
-            req_list.append(f"• {data['custom_req']}")
-
-        # Professional embed
-        embed = discord.Embed(
-            title=f"{emoji} **GIVEAWAY** {emoji}",
-            description=f"## {data['prize']}\n\n"
-                       f"━━━━━━━━━━━━━━━━━━━━━━\n\n"
-                       f"**Hosted by:** {interaction.user.mention}\n"
-                       f"**Ends:** <t:{int(end_time.timestamp())}:R>\n"
-                       f"**ID:** `{data['giveaway_id']}`\n\n"
-                       f"━━━━━━━━━━━━━━━━━━━━━━",
-            color=0x5865F2
-        )
-        if req_list:
-            embed.add_field(name="Requirements", value="\n".join(req_list), inline=False)
-        embed.add_field(name="How to enter", value=f"React with {emoji} below!", inline=False)
-        if data.get('image_url'):
-            embed.set_image(url=data['image_url'])
-        embed.set_footer(text="Winner will be announced instantly.")
-        embed.timestamp = end_time
-
-        await interaction.response.defer(ephemeral=True)
-        msg = await data['channel'].send(embed=embed)
-        await msg.add_reaction(emoji)
-
-        giveaways[str(msg.id)] = {
+        counted = req_dict.get('min_messages') or req_dict.get('min_vc_minutes') or (data.get('bonus') or {}).get('per_messages')
+        if counted and data.get('channel_rules'):
+            req_dict.update(data['channel_rules'])
+        record = {
             'channel_id': data['channel'].id,
             'prize': data['prize'],
-            'end_time': end_time.timestamp(),
+            'end_time': end_time,
             'requirements': req_dict,
             'image_url': data.get('image_url'),
-            'message_id': msg.id,
             'host_id': interaction.user.id,
             'giveaway_id': data['giveaway_id'],
             'emoji': emoji,
+            'winners': max(1, int(data.get('winners') or 1)),
+            'bonus': data.get('bonus') or {},
+            'seed': secrets.token_hex(8),
             'ended': False
         }
-        save_json(GIVEAWAY_FILE, giveaways)
+        inputs = embed_inputs(record)
+
+        await interaction.response.defer(ephemeral=True)
+        msg = await data['channel'].send(embed=render_giveaway(inputs))
+        await msg.add_reaction(emoji)
+        start_time = time.time()
+        state = state_for(interaction.guild_id)
+        start_activity_epoch(state, start_time)
+
+        entrant_index[str(msg.id)] = set()
+        entrants_synced.add(str(msg.id))
+        record.update(message_id=msg.id, start_time=start_time)
+        add_giveaway(state, str(msg.id), record)
+        giveaway_messages.remember(str(msg.id), inputs)
+        refresh_activity_epochs(state)
 
-        del temp_giveaways[self.user_id]
+        state.setups.pop(self.user_id, None)
         await interaction.followup.send(f"✅ Giveaway posted in {data['channel'].mention}", ephemeral=True)
-        asyncio.create_task(watch_giveaway(msg.id, end_time.timestamp(), emoji, req_dict))
+        hold_giveaway(str(msg.id), record)
 
 # -------------------- MODALS --------------------
-class PrizeModal(Modal, title="Prize"):
+class PrizeModal(TimedModal, title="Prize"):
+    def __init__(self, user_id):
+        super().__init__()
+        self.user_id = user_id
+        self.add_item(TextInput(label="Prize name", placeholder="e.g. Discord Nitro", max_length=100))
+
+    async def on_submit(self, interaction: discord.Interaction):
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            setups[self.user_id]['prize'] = self.children[0].value
+        await interaction.response.send_message(f"Prize set to **{self.children[0].value}**", ephemeral=True)
+
+class DurationModal(TimedModal, title="Duration"):
+    def __init__(self, user_id):
+        super().__init__()
+        self.user_id = user_id
+        self.add_item(TextInput(label="Duration", placeholder="e.g. 10m, 1h, 2d", max_length=10))
+
+    async def on_submit(self, interaction: discord.Interaction):
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            setups[self.user_id]['duration'] = self.children[0].value
+        await interaction.response.send_message(f"Duration set to **{self.children[0].value}**", ephemeral=True)
+
+class MessageReqModal(TimedModal, title="Message Requirement"):
+    def __init__(self, user_id):
+        super().__init__()
+        self.user_id = user_id
+        self.add_item(TextInput(label="Minimum messages", placeholder="e.g. 100", max_length=10))
+
+    async def on_submit(self, interaction: discord.Interaction):
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            setups[self.user_id]['min_messages'] = self.children[0].value
+        await interaction.response.send_message(f"Message requirement set to **{self.children[0].value}**", ephemeral=True)
+
+class VCReqModal(TimedModal, title="VC Requirement"):
     def __init__(self, user_id):
         super().__init__()
         self.user_id = user_id
-        self.add_item(TextInput(label="Prize name", placeholder="e.g. Discord Nitro", max_length=100))
+        self.add_item(TextInput(label="Minutes in VC", placeholder="e.g. 50", max_length=10))
 
     async def on_submit(self, interaction: discord.Interaction):
-        if self.user_id in temp_giveaways:
-            temp_giveaways[self.user_id]['prize'] = self.children[0].value
-        await interaction.response.send_message(f"Prize set to **{self.children[0].value}**", ephemeral=True)
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            setups[self.user_id]['min_vc'] = self.children[0].value
+        await interaction.response.send_message(f"VC requirement set to **{self.children[0].value} min**", ephemeral=True)
 
-class DurationModal(Modal, title="Duration"):
+class WinnersModal(TimedModal, title="Winners"):
     def __init__(self, user_id):
         super().__init__()
         self.user_id = user_id
-        self.add_item(TextInput(label="Duration", placeholder="e.g. 10m, 1h, 2d", max_length=10))
+        self.add_item(TextInput(label="Number of winners", placeholder="e.g. 3", max_length=3))
 
     async def on_submit(self, interaction: discord.Interaction):
-        if self.user_id in temp_giveaways:
-            temp_giveaways[self.user_id]['duration'] = self.children[0].value
-        await interaction.response.send_message(f"Duration set to **{self.children[0].value}**", ephemeral=True)
+        value = self.children[0].value.strip()
+        if not value.isdigit() or int(value) < 1:
+            return await interaction.response.send_message("Enter a whole number of at least 1.", ephemeral=True)
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            setups[self.user_id]['winners'] = int(value)
+        await interaction.response.send_message(f"Winners set to **{value}**", ephemeral=True)
 
-class MessageReqModal(Modal, title="Message Requirement"):
+class BonusModal(TimedModal, title="Bonus Entries"):
     def __init__(self, user_id):
         super().__init__()
         self.user_id = user_id
-        self.add_item(TextInput(label="Minimum messages", placeholder="e.g. 100", max_length=10))
+        self.add_item(TextInput(label="Role bonuses", placeholder="e.g. @VIP:2, Supporter:1, 123456789:3", required=False, max_length=300))
+        self.add_item(TextInput(label="Extra entries for server boosters", placeholder="e.g. 1", required=False, max_length=3))
+        self.add_item(TextInput(label="1 extra entry per N messages over the req", placeholder="e.g. 50", required=False, max_length=6))
+        self.add_item(TextInput(label="Max extra entries from activity", placeholder="e.g. 5", required=False, max_length=3))
 
     async def on_submit(self, interaction: discord.Interaction):
-        if self.user_id in temp_giveaways:
-            temp_giveaways[self.user_id]['min_messages'] = self.children[0].value
-        await interaction.response.send_message(f"Message requirement set to **{self.children[0].value}**", ephemeral=True)
+        roles_text, booster, per_messages, max_activity = (c.value.strip() for c in self.children)
+        bonus = {}
+        roles, unknown = parse_role_bonuses(interaction.guild, roles_text)
+        if unknown:
+            return await interaction.response.send_message(f"Couldn't read: {', '.join(unknown)}. Use `role:entries`.", ephemeral=True)
+        for key, value in (('booster', booster), ('per_messages', per_messages), ('max_activity', max_activity)):
+            if value and (not value.isdigit() or int(value) < 1):
+                return await interaction.response.send_message("Numbers must be whole and at least 1.", ephemeral=True)
+            if value:
+                bonus[key] = int(value)
+        if roles:
+            bonus['roles'] = roles
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            setups[self.user_id]['bonus'] = bonus
+        summary = "\n".join(describe_bonus(bonus)) or "No bonus entries."
+        await interaction.response.send_message(f"Bonus entries set:\n{summary}", ephemeral=True)
 
-class VCReqModal(Modal, title="VC Requirement"):
+def parse_role_bonuses(guild, text):
+    # "@VIP:2, Supporter=1, 123:3" -> ({role_id: 2, ...}, [unreadable parts])
+    roles, unknown = {}, []
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        name, sep, value = part.replace('=', ':').rpartition(':')
+        name = name.strip().lstrip('@')
+        role = None
+        if sep and value.strip().isdigit() and name:
+            match = re.fullmatch(r"<@&(\d+)>|(\d+)", name)
+            if match:
+                role = guild.get_role(int(match.group(1) or match.group(2)))
+            else:
+                role = discord.utils.find(lambda r: r.name.lower() == name.lower(), guild.roles)
+        if role is None or int(value) < 1:
+            unknown.append(part)
+        else:
+            roles[str(role.id)] = int(value)
+    return roles, unknown
+
+def describe_bonus(bonus):
+    lines = [f"• <@&{rid}>: +{w}" for rid, w in (bonus.get('roles') or {}).items()]
+    if bonus.get('booster'):
+        lines.append(f"• Server boosters: +{bonus['booster']}")
+    if bonus.get('per_messages'):
+        lines.append(f"• +1 per {bonus['per_messages']} messages over the requirement (max +{bonus.get('max_activity') or 10})")
+    return lines
+
+class ChannelRulesModal(TimedModal, title="Counted Channels"):
     def __init__(self, user_id):
         super().__init__()
         self.user_id = user_id
-        self.add_item(TextInput(label="Minutes in VC", placeholder="e.g. 50", max_length=10))
+        self.add_item(TextInput(label="Only count activity in", placeholder="e.g. #general, #chat, Gaming VC", required=False, max_length=300))
+        self.add_item(TextInput(label="Never count activity in", placeholder="e.g. #spam, #bot-commands", required=False, max_length=300))
 
     async def on_submit(self, interaction: discord.Interaction):
-        if self.user_id in temp_giveaways:
-            temp_giveaways[self.user_id]['min_vc'] = self.children[0].value
-        await interaction.response.send_message(f"VC requirement set to **{self.children[0].value} min**", ephemeral=True)
+        rules = {}
+        for key, child in zip(('allow_channels', 'deny_channels'), self.children):
+            ids, unknown = parse_channels(interaction.guild, child.value)
+            if unknown:
+                return await interaction.response.send_message(f"Couldn't find: {', '.join(unknown)}", ephemeral=True)
+            if ids:
+                rules[key] = ids
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            setups[self.user_id]['channel_rules'] = rules
+        summary = "\n".join(describe_channel_rules(rules)) or "Activity counts in every channel."
+        await interaction.response.send_message(summary, ephemeral=True)
+
+def parse_channels(guild, text):
+    # "#general, 123, Gaming VC" -> ([channel ids], [unreadable parts])
+    ids, unknown = [], []
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        match = re.fullmatch(r"<#(\d+)>|(\d+)", part)
+        if match:
+            channel = guild.get_channel(int(match.group(1) or match.group(2)))
+        else:
+            name = part.lstrip('#').lower()
+            channel = discord.utils.find(lambda c: c.name.lower() == name, guild.channels)
+        if channel is None:
+            unknown.append(part)
+        else:
+            ids.append(channel.id)
+    return ids, unknown
+
+def describe_channel_rules(rules):
+    lines = []
+    if rules.get('allow_channels'):
+        lines.append(f"• Only counted in {' '.join(f'<#{cid}>' for cid in rules['allow_channels'])}")
+    if rules.get('deny_channels'):
+        lines.append(f"• Not counted in {' '.join(f'<#{cid}>' for cid in rules['deny_channels'])}")
+    return lines
 
-class CustomReqModal(Modal, title="Custom Requirement"):
+class CustomReqModal(TimedModal, title="Custom Requirement"):
     def __init__(self, user_id):
         super().__init__()
         self.user_id = user_id
         self.add_item(TextInput(label="Custom rule", placeholder="e.g. Must be in server for 7 days", style=discord.TextStyle.paragraph, max_length=200))
 
     async def on_submit(self, interaction: discord.Interaction):
-        if self.user_id in temp_giveaways:
-            temp_giveaways[self.user_id]['custom_req'] = self.children[0].value
+        setups = setups_for(interaction)
+        if self.user_id in setups:
+            setups[self.user_id]['custom_req'] = self.children[0].value
         await interaction.response.send_message(f"Custom rule added.", ephemeral=True)
 
+# -------------------- ACTIVITY BASELINES --------------------
+# Stats are never reset. Each giveaway stores its launch time as start_time
+# and requirements count activity since then: current counters minus the
+# counters the user had at launch.
+#
+# Snapshots are taken lazily. The first time a user's counters change after a
+# launch, their old values are appended to their 'snaps' list tagged with
+# activity_epoch (the latest launch time). The baseline for a giveaway that
+# started at S is the first snap tagged >= S, or the current counters if the
+# user has not been active since S. That is one append per user per launch,
+# no matter how many giveaways are running. Epochs live on the GuildState,
+# so a launch in one guild costs nothing in the others.
+
+def refresh_activity_epochs(state):
+    starts = [d['start_time'] for d in state.giveaways.values() if d.get('start_time') and not d.get('ended')]
+    state.oldest_epoch = min(starts) if starts else 0.0
+    state.activity_epoch = max([state.activity_epoch, *starts]) if starts else 0.0
+    compile_demand(state)
+
+def touch_activity(state, slot, epoch=None):
+    # Call before changing a user's counters; buffered counts pass the epoch
+    # they were counted in
+    epoch = state.activity_epoch if epoch is None else epoch
+    if not epoch:
+        return
+    stats = state.stats
+    snaps = stats.snaps.get(slot)
+    if snaps and snaps[-1][0] >= epoch:
+        return
+    if snaps is None:
+        snaps = stats.snaps[slot] = []
+    snaps.append([epoch, stats.messages[slot], stats.vc_seconds[slot]])
+    stats.note_snap(slot, snaps[-1])
+    # Snaps older than every running giveaway are never read again
+    while snaps[0][0] < state.oldest_epoch:
+        del snaps[0]
+
+def start_activity_epoch(state, start_time):
+    # Fold open VC sessions into the counters so time before launch is not
+    # credited to the new giveaway
+    state.vc.fold_open()
+    state.activity_epoch = max(state.activity_epoch, start_time)
+
+def activity_since(state, user_id, since=None, scope=None):
+    # (messages, vc_minutes) since the given start_time, or all-time if None.
+    # A giveaway with its own channels passes its ScopedActivity instead.
+    if scope is not None:
+        uid = int(user_id)
+        return scope.messages.get(uid, 0), (scope.vc_seconds.get(uid, 0) + state.vc.open_seconds(uid, scope=scope)) / 60
+    stats = state.stats
+    slot = stats.slots.get(int(user_id))
+    if slot is None:
+        # First activity is a voice session still running: no slot until it closes
+        open_seconds = state.vc.open_seconds(int(user_id))
+        if since:
+            open_seconds = min(open_seconds, max(0.0, time.time() - since))
+        return 0, open_seconds / 60
+    messages = stats.messages[slot]
+    vc_seconds = stats.vc_seconds[slot] + state.vc.open_seconds(int(user_id))
+    if not since:
+        return messages, vc_seconds / 60
+    snaps = stats.snaps.get(slot, ())
+    i = bisect.bisect_left(snaps, [since])
+    if i == len(snaps):
+        # Untouched since launch, apart from a VC session still running
+        open_seconds = min(state.vc.open_seconds(int(user_id)), max(0.0, time.time() - since))
+        return 0, open_seconds / 60
+    _, base_messages, base_vc = snaps[i]
+    return messages - base_messages, (vc_seconds - base_vc) / 60
+
+# -------------------- ACTIVITY DEMAND --------------------
+# Messages and voice time are only counted while a running giveaway needs
+# them (a message/VC requirement, or bonus entries for messages). Giveaways
+# that count every channel share the guild's counters, see ACTIVITY BASELINES.
+# One that limits its channels counts into its own ScopedActivity instead, so
+# its rule never changes what another giveaway counts. The rules are compiled
+# whenever a giveaway starts or ends.
+
+class ChannelRule:
+    """Channels that count: only those in `only`, or all except `skip`."""
+    __slots__ = ('only', 'skip')
+
+    def __init__(self, only=None, skip=frozenset()):
+        self.only = only
+        self.skip = skip
+
+    def __contains__(self, channel_id):
+        if self.only is not None:
+            return channel_id in self.only
+        return channel_id not in self.skip
+
+    def __eq__(self, other):
+        return isinstance(other, ChannelRule) and (self.only, self.skip) == (other.only, other.skip)
+
+    @classmethod
+    def for_requirements(cls, reqs):
+        deny = frozenset(reqs.get('deny_channels') or ())
+        if reqs.get('allow_channels'):
+            return cls(only=frozenset(reqs['allow_channels']) - deny)
+        return cls(skip=deny)
+
+class ScopedActivity:
+    """Messages and voice seconds per user for one giveaway, since its start
+    and only in its own channels. Saved with the giveaway record."""
+    __slots__ = ('mid', 'rule', 'start', 'messages', 'vc_seconds')
+
+    def __init__(self, mid, data, row=None):
+        self.mid = mid
+        self.rule = ChannelRule.for_requirements(data.get('requirements') or {})
+        self.start = data.get('start_time') or time.time()
+        row = row or {}
+        self.messages = {int(uid): n for uid, n in (row.get('messages') or {}).items()}
+        self.vc_seconds = {int(uid): n for uid, n in (row.get('vc_seconds') or {}).items()}
+
+    def row(self):
+        return {'messages': dict(self.messages), 'vc_seconds': dict(self.vc_seconds)}
+
+    def add_message(self, uid):
+        self.messages[uid] = self.messages.get(uid, 0) + 1
+        self._changed()
+
+    def add_vc(self, uid, seconds):
+        if seconds > 0:
+            self.vc_seconds[uid] = self.vc_seconds.get(uid, 0) + int(seconds)
+            self._changed()
+
+    def _changed(self):
+        # Open sessions are folded in once more after the giveaway has ended
+        if self.mid in giveaways:
+            mark_giveaway_dirty(self.mid)
+
+def compile_demand(state):
+    shared_messages = shared_vc = False
+    shared_starts = set()
+    scoped, scoped_messages, scoped_vc = {}, [], []
+    for mid, data in state.giveaways.items():
+        if data.get('ended'):
+            continue
+        reqs = data.get('requirements') or {}
+        needs_messages = bool(reqs.get('min_messages') or (data.get('bonus') or {}).get('per_messages'))
+        needs_vc = bool(reqs.get('min_vc_minutes'))
+        if not (needs_messages or needs_vc):
+            continue
+        if not (reqs.get('allow_channels') or reqs.get('deny_channels')):
+            shared_messages |= needs_messages
+            shared_vc |= needs_vc
+            if data.get('start_time'):
+                shared_starts.add(data['start_time'])
+            continue
+        scope = scoped[mid] = state.scoped.get(mid) or ScopedActivity(mid, data)
+        if needs_messages:
+            scoped_messages.append(scope)
+        if needs_vc:
+            scoped_vc.append(scope)
+    state.scoped = scoped
+    state.baseline_starts = shared_starts
+    if state.stats_loaded and np is not None:
+        state.stats.track_baselines(shared_starts)
+    state.message_rule = ChannelRule() if shared_messages else None
+    state.scoped_messages = scoped_messages
+    vc_rule = ChannelRule() if shared_vc else None
+    if vc_rule != state.vc_rule or scoped_vc != state.scoped_vc:
+        # Credit open sessions under the rules they were counted with, then
+        # re-evaluate who is in a counted voice channel
+        state.vc.fold_open()
+        state.vc_rule = vc_rule
+        state.scoped_vc = scoped_vc
+        state.vc.resync(bot.get_guild(state.guild_id))
+
 # -------------------- IMAGE HANDLER (UPLOAD) --------------------
 @bot.event
+@timed('on_message')
 async def on_message(message):
     if message.author.bot:
         return
-    # Track stats
-    uid = str(message.author.id)
-    if uid not in user_stats:
-        user_stats[uid] = {"messages": 0, "vc_time": 0, "name": str(message.author)}
-    user_stats[uid]["messages"] += 1
-    user_stats[uid]["name"] = str(message.author)
-    save_json(STATS_FILE, user_stats)
+    if message.guild is None:
+        return await bot.process_commands(message)
+    # Track stats, if a running giveaway counts this channel
+    state = state_for(message.guild.id)
+    rule = state.message_rule
+    if rule is not None and message.channel.id in rule:
+        state.count_activity(message.author.id, messages=1, who=message.author)
+    for scope in state.scoped_messages:
+        if message.channel.id in scope.rule:
+            scope.add_message(message.author.id)
 
     # Image waiting
-    if message.author.id in temp_giveaways and temp_giveaways[message.author.id].get('waiting_for_image'):
+    setups = state.setups
+    if setups.awaiting_image and message.author.id in setups.awaiting_image:
         try:
             await message.delete()
         except:
@@ -410,174 +2797,937 @@ async def on_message(message):
             att = message.attachments[0]
             if att.content_type and att.content_type.startswith('image/'):
                 image_url = att.url
-                temp_giveaways[message.author.id]['image_url'] = image_url
-                temp_giveaways[message.author.id]['waiting_for_image'] = False
+                followup, prompt_id = setups.awaiting_image.pop(message.author.id)
+                draft = setups.get(message.author.id)
+                if draft is not None:
+                    draft['image_url'] = image_url
                 preview_embed = discord.Embed(title="✅ Image Added", description="Preview (will auto-delete):")
                 preview_embed.set_image(url=image_url)
                 await message.channel.send(embed=preview_embed, delete_after=10)
-                async for msg in message.channel.history(limit=5):
-                    if msg.author == bot.user and "Send an image" in msg.content:
-                        await msg.delete()
-                        break
-                print(f"Image URL stored via upload: {image_url}")
+                try:
+                    await followup.delete_message(prompt_id)
+                except discord.HTTPException:
+                    pass
+                audit('image_set', user_id=message.author.id, guild_id=message.guild.id, source='upload', url=image_url)
             else:
                 await message.channel.send("❌ That file is not an image. Please upload a .jpg, .png, or .gif", delete_after=3)
         else:
             await message.channel.send("❌ You didn't attach an image. Please upload an image file.", delete_after=3)
 
-    await bot.process_commands(message)
+    if message.content.startswith(COMMAND_PREFIXES):
+        await bot.process_commands(message)
+
+# -------------------- ENTRANT TRACKING --------------------
+def find_reaction(msg, emoji):
+    for reaction in msg.reactions:
+        if str(reaction.emoji) == emoji:
+            return reaction
+    return None
+
+def forget_entrants(mid):
+    entrant_index.pop(mid, None)
+    entrant_changes.pop(mid, None)
+    entrants_synced.discard(mid)
+
+def track_entrant(payload, added):
+    mid = str(payload.message_id)
+    data = giveaways.get(mid)
+    if data is None or str(payload.emoji) != data.get('emoji', '🎉'):
+        return
+    if bot.user and payload.user_id == bot.user.id:
+        return
+    journal = entrant_journal.get(mid)
+    if journal is not None:
+        journal.append((added, payload.user_id))
+    ids = entrant_index.setdefault(mid, set())
+    if added:
+        ids.add(payload.user_id)
+    else:
+        ids.discard(payload.user_id)
+    entrant_changed(mid, payload.user_id, added)
+    mark_giveaway_dirty(mid)
+
+@bot.event
+@timed('on_raw_reaction_add')
+async def on_raw_reaction_add(payload):
+    track_entrant(payload, True)
+
+@bot.event
+@timed('on_raw_reaction_remove')
+async def on_raw_reaction_remove(payload):
+    track_entrant(payload, False)
+
+@bot.event
+async def on_raw_reaction_clear(payload):
+    mid = str(payload.message_id)
+    if mid in giveaways:
+        replace_entrants(mid, set())
+        mark_giveaway_dirty(mid)
+
+@bot.event
+async def on_raw_reaction_clear_emoji(payload):
+    mid = str(payload.message_id)
+    if mid in giveaways and str(payload.emoji) == giveaways[mid].get('emoji', '🎉'):
+        replace_entrants(mid, set())
+        mark_giveaway_dirty(mid)
+
+async def reconcile_entrants(mid):
+    # One REST scan after downtime. Events that arrive while the scan is
+    # running are journaled and replayed on top of the scanned set.
+    data = giveaways.get(mid)
+    channel = bot.get_channel(data['channel_id']) if data else None
+    if channel is None:
+        return
+    journal = entrant_journal[mid] = []
+    try:
+        msg = await rest.call(rest.SYNC, channel.id, channel.fetch_message, int(mid))
+        reaction = find_reaction(msg, data.get('emoji', '🎉'))
+        scanned = set()
+        if reaction:
+            async for u in reaction.users():
+                if u != bot.user:
+                    scanned.add(u.id)
+    except Exception as e:
+        audit('entrant_reconcile_failed', logging.WARNING, message_id=mid, error=str(e))
+        return
+    finally:
+        entrant_journal.pop(mid, None)
+    for added, uid in journal:
+        if added:
+            scanned.add(uid)
+        else:
+            scanned.discard(uid)
+    if mid in giveaways:
+        replace_entrants(mid, scanned)
+        entrants_synced.add(mid)
+        mark_giveaway_dirty(mid)
+
+async def reconcile_all_entrants():
+    # Reaction events may have been missed while disconnected
+    pending = [mid for mid, data in giveaways.items() if not data.get('ended')]
+    entrants_synced.difference_update(pending)
+    slots = asyncio.Semaphore(SCHEDULER_CONCURRENCY)
+    async def one(mid):
+        async with slots:
+            await reconcile_entrants(mid)
+    await asyncio.gather(*(one(mid) for mid in pending))
+    audit('entrants_reconciled', synced=len(entrants_synced), pending=len(pending))
+
+# -------------------- LEASES --------------------
+# Several bot processes (replicas, or a hot standby on the same shards) can
+# share one LEASE_FILE. Every ending and reroll is claimed there first so
+# exactly one process runs it, and a claim held by a process that crashed
+# expires after LEASE_TTL. Replicas should use the sqlite storage backend so
+# they also share giveaway data: each process also records in LEASE_FILE
+# which giveaways it holds and when they end, so an ending only waits for a
+# process that can run it, and one created (or loaded) by another process
+# after this one started is read from the store and scheduled here too.
+LEASE_FILE = os.environ.get('LEASE_FILE', 'leases.db')
+LEASE_TTL = float(os.environ.get('LEASE_TTL', 60))
+WORKER_ID = os.environ.get('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+
+class LeaseStore:
+    """Expiring claims in a small SQLite file shared by every process.
+
+    A claim is a single conditional upsert, so two processes racing for a key
+    cannot both win. Completed keys stay taken (until RETENTION has passed),
+    which is what makes endings exactly-once. Workers heartbeat into the same
+    file, with the giveaways they took on or dropped since the last beat, so
+    scheduled endings can be split between the live ones that hold them.
+    Statements run on their own thread so lock waits never block the event
+    loop.
+    """
+    RETENTION = 86400
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS leases (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires REAL NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            seen REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS holders (
+            msg_id TEXT NOT NULL,
+            worker_id TEXT NOT NULL,
+            guild_id INTEGER NOT NULL,
+            end_time REAL NOT NULL,
+            PRIMARY KEY (msg_id, worker_id)
+        );
+    """
+
+    def __init__(self, path, worker_id, ttl):
+        self.worker_id = worker_id
+        self.ttl = ttl
+        self.live_workers = [worker_id]
+        # Giveaways taken on or dropped since the last heartbeat, and the ones
+        # other workers hold that this one does not
+        self.holding = {}
+        self.dropping = set()
+        self.unheld = []
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+        # A new process holds no claims yet: any still open under this worker
+        # id (a fixed WORKER_ID) are left over from before a restart
+        self.conn.execute('DELETE FROM leases WHERE owner = ? AND done = 0', (worker_id,))
+        self.conn.execute('DELETE FROM holders WHERE worker_id = ?', (worker_id,))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='leases')
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _claim(self, key):
+        now = time.time()
+        cur = self.conn.execute(
+            'INSERT INTO leases (key, owner, expires) VALUES (?, ?, ?) '
+            'ON CONFLICT(key) DO UPDATE SET owner=excluded.owner, expires=excluded.expires '
+            'WHERE leases.done = 0 AND leases.expires < ?',
+            (key, self.worker_id, now + self.ttl, now)
+        )
+        return cur.rowcount == 1
+
+    def _claim_once(self, key):
+        # One-shot events (a command, a button click): the first claim is final
+        cur = self.conn.execute('INSERT OR IGNORE INTO leases (key, owner, expires, done) VALUES (?, ?, ?, 1)',
+                                (key, self.worker_id, time.time() + self.RETENTION))
+        return cur.rowcount == 1
+
+    def _renew(self, key):
+        self.conn.execute('UPDATE leases SET expires = ? WHERE key = ? AND owner = ? AND done = 0',
+                          (time.time() + self.ttl, key, self.worker_id))
+
+    def _complete(self, key):
+        self.conn.execute('UPDATE leases SET done = 1, expires = ? WHERE key = ? AND owner = ?',
+                          (time.time() + self.RETENTION, key, self.worker_id))
+
+    def _release(self, key):
+        self.conn.execute('DELETE FROM leases WHERE key = ? AND owner = ? AND done = 0', (key, self.worker_id))
+
+    def _completed(self, key):
+        return self.conn.execute('SELECT 1 FROM leases WHERE key = ? AND done = 1', (key,)).fetchone() is not None
+
+    def _heartbeat(self, holding, dropping):
+        now = time.time()
+        self.conn.execute('INSERT OR REPLACE INTO workers (worker_id, seen) VALUES (?, ?)', (self.worker_id, now))
+        self.conn.execute('DELETE FROM workers WHERE seen < ?', (now - 10 * self.ttl,))
+        # Expired claims are as good as missing; completed ones expire after RETENTION
+        self.conn.execute('DELETE FROM leases WHERE expires < ?', (now,))
+        self.conn.executemany('INSERT OR REPLACE INTO holders (msg_id, worker_id, guild_id, end_time) VALUES (?, ?, ?, ?)',
+                              [(mid, self.worker_id, guild_id, end_time) for mid, (guild_id, end_time) in holding.items()])
+        self.conn.executemany('DELETE FROM holders WHERE msg_id = ?', [(mid,) for mid in dropping])
+        # Ended giveaways, and workers gone for good once survivors have had
+        # 10 TTLs to take their giveaways on, hold nothing
+        self.conn.execute("DELETE FROM holders WHERE msg_id IN (SELECT substr(key, 5) FROM leases "
+                          "WHERE key LIKE 'end:%' AND done = 1) OR worker_id NOT IN (SELECT worker_id FROM workers)")
+        live = sorted(w for w, in self.conn.execute('SELECT worker_id FROM workers WHERE seen >= ?', (now - self.ttl,)))
+        unheld = self.conn.execute('SELECT msg_id, guild_id FROM holders GROUP BY msg_id '
+                                   'HAVING SUM(worker_id = ?) = 0', (self.worker_id,)).fetchall()
+        return live, unheld
+
+    def _holders(self, msg_id):
+        return {w for w, in self.conn.execute('SELECT worker_id FROM holders WHERE msg_id = ?', (msg_id,))}
+
+    def _leave(self):
+        self.conn.execute('DELETE FROM workers WHERE worker_id = ?', (self.worker_id,))
+
+    async def claim(self, key):
+        won = await self._run(self._claim, key)
+        metrics.inc('giveaway_bot_lease_claims_total', result='won' if won else 'lost')
+        return won
+
+    async def claim_once(self, key):
+        won = await self._run(self._claim_once, key)
+        metrics.inc('giveaway_bot_lease_claims_total', result='won' if won else 'lost')
+        return won
+
+    async def complete(self, key):
+        await self._run(self._complete, key)
+
+    async def release(self, key):
+        await self._run(self._release, key)
+
+    async def completed(self, key):
+        return await self._run(self._completed, key)
+
+    def hold(self, msg_id, guild_id, end_time):
+        # Written with the next heartbeat
+        self.dropping.discard(msg_id)
+        self.holding[msg_id] = (guild_id, end_time)
+
+    def drop(self, msg_id):
+        self.holding.pop(msg_id, None)
+        self.dropping.add(msg_id)
+
+    async def heartbeat(self):
+        holding, dropping = self.holding, self.dropping
+        self.holding, self.dropping = {}, set()
+        try:
+            live, self.unheld = await self._run(self._heartbeat, holding, dropping)
+        except Exception:
+            # Sent again with the next beat, unless changed meanwhile
+            for mid, row in holding.items():
+                if mid not in self.dropping:
+                    self.holding.setdefault(mid, row)
+            self.dropping |= {mid for mid in dropping if mid not in self.holding}
+            raise
+        self.live_workers = live or [self.worker_id]
+
+    async def leave(self):
+        await self._run(self._leave)
+
+    def keep_alive(self, key):
+        # Renews a held claim until the returned task is cancelled
+        async def renew():
+            while True:
+                await asyncio.sleep(self.ttl / 3)
+                await self._run(self._renew, key)
+        return asyncio.create_task(renew())
+
+    def prefers(self, key, workers=None):
+        # Rendezvous hashing: all live workers agree on one owner per key and
+        # only the departed worker's keys move when the set changes
+        return max(workers or self.live_workers, key=lambda w: zlib.crc32(f'{w}|{key}'.encode())) == self.worker_id
+
+    async def prefers_held(self, msg_id):
+        # Only a live worker known to hold the giveaway is waited for
+        holders = await self._run(self._holders, msg_id)
+        holders.add(self.worker_id)
+        return self.prefers(msg_id, [w for w in self.live_workers if w in holders] or [self.worker_id])
+
+leases = LeaseStore(LEASE_FILE, WORKER_ID, LEASE_TTL)
+
+@tasks.loop(seconds=max(1.0, LEASE_TTL / 3))
+async def lease_heartbeat():
+    await leases.heartbeat()
+    adopt_unheld_giveaways()
+
+def hold_giveaway(mid, data):
+    # Schedules the ending here and tells the other workers this one holds it
+    scheduler.schedule(mid, data['end_time'])
+    leases.hold(mid, data['guild_id'], data['end_time'])
+
+def adopt_unheld_giveaways():
+    # Giveaways another process created or loaded after this one started.
+    # Only a shared store has them; one not flushed yet is found next beat.
+    if STORAGE_BACKEND != 'sqlite':
+        return
+    by_guild = {}
+    for mid, guild_id in leases.unheld:
+        if mid not in giveaways and owns_guild(guild_id):
+            by_guild.setdefault(guild_id, []).append(mid)
+    for guild_id, mids in by_guild.items():
+        state = state_for(guild_id)
+        rows = persistence.load_rows(state.giveaways_key, mids)
+        adopted = [mid for mid, data in rows.items() if not data.get('ended') and mid not in giveaways]
+        for mid in adopted:
+            state.load_giveaway(mid, rows[mid])
+            hold_giveaway(mid, rows[mid])
+        if adopted:
+            refresh_activity_epochs(state)
+            audit('giveaways_adopted', guild_id=guild_id, message_ids=adopted)
 
 # -------------------- INSTANT WINNER CHECKING --------------------
-async def watch_giveaway(msg_id, end_time, emoji, reqs):
-    await asyncio.sleep(max(0, end_time - datetime.utcnow().timestamp()))
-    if str(msg_id) not in giveaways:
+SCHEDULER_CONCURRENCY = int(os.environ.get('SCHEDULER_CONCURRENCY', 5))
+# A failed ending is retried after END_RETRY_SECONDS, doubling up to END_RETRY_MAX
+END_RETRY_SECONDS = float(os.environ.get('END_RETRY_SECONDS', 5))
+END_RETRY_MAX = float(os.environ.get('END_RETRY_MAX', 300))
+
+class GiveawayScheduler:
+    """One timer for every giveaway.
+
+    Pending endings live in a min-heap of (end_time, seq, msg_id). Rescheduling
+    pushes a new entry and cancelling forgets the live seq, so stale heap
+    entries are simply skipped when they reach the top. Overdue giveaways fire
+    immediately, at most SCHEDULER_CONCURRENCY at a time.
+    """
+    def __init__(self, callback, concurrency):
+        self.callback = callback
+        self.heap = []
+        self.live = {}
+        self.running = set()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._task = None
+
+    def __len__(self):
+        return len(self.live)
+
+    def __contains__(self, msg_id):
+        return msg_id in self.live
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def schedule(self, msg_id, end_time):
+        seq = next(self._seq)
+        self.live[msg_id] = seq
+        heapq.heappush(self.heap, (end_time, seq, msg_id))
+        if self.heap[0][1] == seq:
+            self._wakeup.set()
+        self._compact()
+
+    reschedule = schedule
+
+    def cancel(self, msg_id):
+        self.live.pop(msg_id, None)
+        self._compact()
+
+    def _compact(self):
+        # Drop stale entries once they outnumber the live ones
+        if len(self.heap) > 64 and len(self.heap) > 2 * len(self.live):
+            self.heap = [e for e in self.heap if self.live.get(e[2]) == e[1]]
+            heapq.heapify(self.heap)
+
+    def _head(self):
+        while self.heap and self.live.get(self.heap[0][2]) != self.heap[0][1]:
+            heapq.heappop(self.heap)
+        return self.heap[0] if self.heap else None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            head = self._head()
+            if head is None:
+                await self._wakeup.wait()
+                continue
+            delay = head[0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._slots.acquire()
+            # The heap may have changed while we waited for a free slot
+            if self._head() != head:
+                self._slots.release()
+                continue
+            heapq.heappop(self.heap)
+            del self.live[head[2]]
+            task = asyncio.create_task(self._fire(head[2]))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def _fire(self, msg_id):
+        try:
+            await self.callback(msg_id)
+        except Exception as e:
+            audit('giveaway_fire_failed', logging.ERROR, message_id=msg_id, error=str(e))
+        finally:
+            self._slots.release()
+
+async def fire_giveaway(msg_id):
+    data = giveaways.get(msg_id)
+    if not data:
+        return
+    # Live workers holding it split the endings; the others only step in
+    # once the preferred one has had LEASE_TTL to do it
+    fallback_at = data['end_time'] + LEASE_TTL
+    if time.time() < fallback_at and not await leases.prefers_held(msg_id):
+        scheduler.schedule(msg_id, fallback_at)
+        return
+    await end_giveaway_instant(msg_id, data.get('emoji', '🎉'), data.get('requirements', {}))
+
+scheduler = GiveawayScheduler(fire_giveaway, SCHEDULER_CONCURRENCY)
+ending_giveaways = set()
+end_failures = {}  # msg_id -> endings failed in a row
+
+def retry_ending(msg_id):
+    # Here after a backoff; once the lease is released any other process can
+    # retry it as well
+    if msg_id not in giveaways:
         return
-    await end_giveaway_instant(str(msg_id), emoji, reqs)
+    failures = end_failures[msg_id] = end_failures.get(msg_id, 0) + 1
+    scheduler.schedule(msg_id, time.time() + min(END_RETRY_MAX, END_RETRY_SECONDS * 2 ** (failures - 1)))
 
+def rehydrate_giveaways():
+    # Reload every pending giveaway after a restart; overdue ones fire right away
+    for state in guild_states.values():
+        refresh_activity_epochs(state)
+        prune_archive(state)
+    for mid, data in giveaways.items():
+        if not data.get('ended'):
+            hold_giveaway(mid, data)
+
+@timed('end_giveaway_instant')
 async def end_giveaway_instant(msg_id, emoji, reqs):
-    global user_stats
     data = giveaways.get(msg_id)
-    if not data or data.get('ended'):
+    if not data or data.get('ended') or msg_id in ending_giveaways:
+        return
+    ending_giveaways.add(msg_id)
+    scheduler.cancel(msg_id)
+    laps = Laps()
+    key = f'end:{msg_id}'
+    if not await leases.claim(key):
+        if await leases.completed(key):
+            # Another process ended it
+            remove_giveaway(msg_id)
+            refresh_activity_epochs(state_of(data))
+        else:
+            # Still held by another process: check back once it could have expired
+            scheduler.schedule(msg_id, time.time() + LEASE_TTL)
+        ending_giveaways.discard(msg_id)
         return
+    renewer = leases.keep_alive(key)
+    ended = False
     channel = bot.get_channel(data['channel_id'])
+    laps.lap('claim')
     try:
-        msg = await channel.fetch_message(int(msg_id))
-        reaction = discord.utils.get(msg.reactions, emoji=emoji)
-        users = [u async for u in reaction.users() if u != bot.user] if reaction else []
-
-        print(f"\n🎯 Ending giveaway: {data['prize']}")
-        print(f"Requirements: {reqs}")
-
-        eligible = []
-        for u in users:
-            uid = str(u.id)
-            stats = user_stats.get(uid, {"messages": 0, "vc_time": 0})
-            print(f"User {u.name}: messages={stats['messages']}, vc_time={stats['vc_time']:.1f}")
-            if check_requirements(uid, reqs):
-                eligible.append(u)
-                print(f"  ✅ Eligible")
-            else:
-                print(f"  ❌ Not eligible")
+        eligible, weights, report = await entrant_snapshot(msg_id, data, reqs)
+        laps.lap('eligibility')
+        winners = sample_snapshot(eligible, weights, data.get('winners', 1), draw_rng(msg_id, data))
+        laps.lap('draw')
+        audit_entrants(msg_id, data, eligible, reqs)
 
-        if eligible:
-            winner = random.choice(eligible)
-            desc = f"**Winner:** {winner.mention}\n**Prize:** {data['prize']}"
+        if winners:
+            label = "Winner" if len(winners) == 1 else "Winners"
+            desc = f"**{label}:** {', '.join(f'<@{uid}>' for uid in winners)}\n**Prize:** {data['prize']}"
             color = 0x00FF00
-            print(f"Winner chosen: {winner.name}")
         else:
             desc = f"No eligible entries.\n**Prize:** {data['prize']}"
             color = 0xFF0000
-            print("No eligible entries")
 
         embed = discord.Embed(title="🎉 Giveaway Ended", description=desc, color=color)
         if data.get('image_url'):
             embed.set_image(url=data['image_url'])
-        await msg.reply(embed=embed)
+        await rest.call(rest.ANNOUNCE, channel.id, channel.get_partial_message(int(msg_id)).reply, embed=embed)
+        laps.lap('announce')
 
-        # Remove giveaway
-        del giveaways[msg_id]
-        save_json(GIVEAWAY_FILE, giveaways)
-
-        # 🧹 RESET ALL STATS AFTER GIVEAWAY
-        user_stats = {}
-        save_json(STATS_FILE, user_stats)
-        print(f"⚠️ All user stats have been reset for the next giveaway. (Now 0 users tracked)")
+        # Move it to the archive, where rerolls can find it
+        archive_giveaway(msg_id, data, winners, eligible, weights)
+        remove_giveaway(msg_id)
+        refresh_activity_epochs(state_of(data))
+        laps.lap('archive')
+        ended = True
+        audit('giveaway_ended', **ending_summary(msg_id, data, reqs, report, winners), phases_ms=laps.ms)
 
     except Exception as e:
-        print(f"Error ending giveaway: {e}")
+        audit('giveaway_end_failed', logging.ERROR, message_id=msg_id, error=str(e))
+    finally:
+        renewer.cancel()
+        # A failed ending is released so another process can retry it
+        await (leases.complete(key) if ended else leases.release(key))
+        ending_giveaways.discard(msg_id)
+        if not ended:
+            retry_ending(msg_id)
+
+class AliasSampler:
+    """Weighted draws in O(1) each after an O(n) build (Vose's alias method)."""
+    def __init__(self, items, weights, rng=random):
+        self.items = items
+        self.weights = weights
+        self.rng = rng
+        n = len(items)
+        total = sum(weights)
+        scaled = [w * n / total for w in weights]
+        self.prob = prob = [1.0] * n
+        self.alias = alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] += scaled[s] - 1
+            (small if scaled[l] < 1 else large).append(l)
+
+    def draw(self):
+        i = self.rng.randrange(len(self.items))
+        return self.items[i] if self.rng.random() < self.prob[i] else self.items[self.alias[i]]
+
+    def without(self, seen):
+        rest = [(it, w) for it, w in zip(self.items, self.weights) if it not in seen]
+        return AliasSampler([it for it, _ in rest], [w for _, w in rest], self.rng)
+
+    def sample(self, k, exclude=()):
+        # k distinct items, none of them in exclude. Repeats are redrawn,
+        # which keeps every pick proportional to weight among the items left;
+        # if one heavy item (or the excluded ones) keeps coming back, rebuild
+        # the table without them.
+        k = min(k, len(self.items))
+        picked = []
+        seen = set(exclude)
+        misses = 0
+        while len(picked) < k:
+            item = self.draw()
+            if item not in seen:
+                seen.add(item)
+                picked.append(item)
+                continue
+            misses += 1
+            if misses > 2 * k + 16:
+                rest = self.without(seen)
+                return picked + (rest.sample(k - len(picked)) if rest.items else [])
+        return picked
+
+class UniformSampler(AliasSampler):
+    """Equal-weight draws with AliasSampler's distinct sampling, no table needed."""
+    def __init__(self, items, rng=random):
+        self.items = items
+        self.rng = rng
+
+    def draw(self):
+        return self.items[self.rng.randrange(len(self.items))]
+
+    def without(self, seen):
+        return UniformSampler([it for it in self.items if it not in seen], self.rng)
+
+def eligibility(state, entrant_ids, reqs, since=None, scope=None):
+    """Check a whole batch of entrants against the requirements at once.
+
+    Returns (mask, report): mask[i] says whether entrant_ids[i] qualifies,
+    report holds the entrant/eligible counts and how many failed each
+    requirement. With NumPy the counters are gathered into arrays straight
+    from the stats columns and compared in one pass; without it the same
+    checks run in a plain loop. scope is the giveaway's ScopedActivity when
+    it counts its own channels.
+    """
+    ids = entrant_ids if isinstance(entrant_ids, list) else list(entrant_ids)
+    report = {'entrants': len(ids), 'eligible': len(ids), 'failed': {}}
+    min_messages = reqs.get('min_messages') if reqs else None
+    min_vc = reqs.get('min_vc_minutes') if reqs else None
+    if not ids or not (min_messages or min_vc):
+        return [True] * len(ids), report
+    if np is not None:
+        messages, vc_minutes = activity_columns(state, ids, since, scope)
+        mask = np.ones(len(ids), dtype=bool)
+        for name, minimum, values in (('min_messages', min_messages, messages), ('min_vc_minutes', min_vc, vc_minutes)):
+            if minimum:
+                ok = values >= minimum
+                report['failed'][name] = int(len(ids) - np.count_nonzero(ok))
+                mask &= ok
+        report['eligible'] = int(np.count_nonzero(mask))
+        return mask, report
+    mask = []
+    failed = {name: 0 for name, minimum in (('min_messages', min_messages), ('min_vc_minutes', min_vc)) if minimum}
+    for uid in ids:
+        messages, vc_minutes = activity_since(state, uid, since, scope)
+        ok = True
+        if min_messages and messages < min_messages:
+            failed['min_messages'] += 1
+            ok = False
+        if min_vc and vc_minutes < min_vc:
+            failed['min_vc_minutes'] += 1
+            ok = False
+        mask.append(ok)
+    report['failed'] = failed
+    report['eligible'] = sum(mask)
+    return mask, report
 
-def check_requirements(user_id, reqs):
+def lookup_sorted(keys, values, uids, missing=0):
+    # values[i] where keys[i] == uid, for each uid; keys sorted ascending
+    if not len(keys):
+        return np.full(len(uids), missing, dtype=values.dtype)
+    pos = np.searchsorted(keys, uids)
+    pos[pos == len(keys)] = 0
+    return np.where(keys[pos] == uids, values[pos], missing)
+
+def gather_counts(table, uids, dtype):
+    # table.get(uid, 0) for each uid. A table much bigger than the batch is
+    # probed per uid; otherwise it is sorted and searched in one go.
+    if len(table) > 4 * len(uids):
+        return np.fromiter((table.get(uid, 0) for uid in uids.tolist()), dtype=dtype, count=len(uids))
+    keys = np.fromiter(table.keys(), dtype=np.int64, count=len(table))
+    values = np.fromiter(table.values(), dtype=dtype, count=len(table))
+    order = np.argsort(keys)
+    return lookup_sorted(keys[order], values[order], uids)
+
+def activity_columns(state, ids, since=None, scope=None):
+    """NumPy version of activity_since over many users: (messages, vc_minutes) arrays.
+
+    Counters, slots and baselines are all gathered with array operations:
+    slots through StatsStore.slots_of, baselines from the columns kept for
+    each running giveaway (see ACTIVITY BASELINES). What is left in Python is
+    one pass over the open voice sessions, and over a scoped giveaway's
+    counts when those outnumber the batch.
+    """
+    n = len(ids)
+    now = time.time()
+    uids = np.fromiter(ids, dtype=np.int64, count=n)
+    if scope is not None:
+        messages = gather_counts(scope.messages, uids, np.int64)
+        vc_seconds = gather_counts(scope.vc_seconds, uids, np.float64) + state.vc.open_columns(uids, now, scope)
+        return messages, vc_seconds / 60
+    stats = state.stats
+    # Includes users whose first activity is the session, who have no slot yet
+    open_seconds = state.vc.open_columns(uids, now)
+    # Open time for users without a baseline since the giveaway started
+    fresh = np.minimum(open_seconds, max(0.0, now - since)) if since else open_seconds
+    if not len(stats):
+        return np.zeros(n, dtype=np.int64), fresh / 60
+    slots = stats.slots_of(uids)
+    known = slots >= 0
+    idx = np.where(known, slots, 0)
+    # Zero-copy views of the array('q') columns; gone again before anything can append
+    messages = np.frombuffer(stats.messages, dtype=np.int64)[idx]
+    vc_seconds = np.frombuffer(stats.vc_seconds, dtype=np.int64)[idx].astype(np.float64)
+    vc_seconds += open_seconds
+    if since:
+        active, base_messages, base_vc = stats.baselines_of(since, idx)
+        messages = np.where(active, messages - base_messages, 0)
+        vc_seconds = np.where(active, vc_seconds - base_vc, fresh)
+    messages[~known] = 0
+    vc_seconds[~known] = fresh[~known]
+    return messages, vc_seconds / 60
+
+def ending_summary(msg_id, data, reqs, report, winners):
+    # The per-giveaway audit record: who could enter, why the rest could not
+    return {
+        'message_id': msg_id,
+        'giveaway_id': data.get('giveaway_id'),
+        'guild_id': data.get('guild_id'),
+        'prize': data.get('prize'),
+        'requirements': reqs,
+        'entrants': report['entrants'],
+        'eligible': report['eligible'],
+        'failed': report['failed'],
+        'bonus_entries': report.get('bonus_entries', 0),
+        'winners': list(winners),
+    }
+
+def audit_entrants(msg_id, data, eligible, reqs):
+    # A sample of per-entrant checks, only worked out when DEBUG is on and the
+    # entrants are known locally
+    if not audit_logger.isEnabledFor(logging.DEBUG) or msg_id not in entrants_synced:
+        return
+    ids = list(entrant_index.get(msg_id, ()))
+    k = min(len(ids), AUDIT_ENTRANT_MAX, max(1, round(len(ids) * AUDIT_ENTRANT_SAMPLE)))
+    state = state_of(data)
+    since = data.get('start_time')
+    scope = state.scoped.get(msg_id)
+    for uid in random.sample(ids, k):
+        messages, vc_minutes = activity_since(state, uid, since, scope)
+        i = bisect.bisect_left(eligible, uid)
+        audit('entrant_checked', logging.DEBUG, message_id=msg_id, user_id=uid, messages=messages,
+              vc_minutes=round(vc_minutes, 1), eligible=i < len(eligible) and eligible[i] == uid)
+
+def merge_reports(total, report):
+    total['entrants'] += report['entrants']
+    total['eligible'] += report['eligible']
+    for name, n in report['failed'].items():
+        total['failed'][name] = total['failed'].get(name, 0) + n
+
+def entry_weights(state, bonus, reqs, ids, since=None, scope=None):
+    """Entries per user: 1 plus any bonus entries from the giveaway's rules.
+
+    bonus holds 'roles' (role id -> extra entries), 'booster' (extra entries
+    for server boosters) and 'per_messages'/'max_activity' (one extra entry
+    per that many messages above the message requirement, capped). Roles are
+    read from the member cache.
+    """
+    weights = [1] * len(ids)
+    guild = bot.get_guild(state.guild_id)
+    roles = {int(rid): w for rid, w in (bonus.get('roles') or {}).items()}
+    if guild is not None and (roles or bonus.get('booster')):
+        boosters = {m.id for m in guild.premium_subscribers} if bonus.get('booster') else ()
+        for j, uid in enumerate(ids):
+            if uid in boosters:
+                weights[j] += bonus['booster']
+            if roles:
+                member = guild.get_member(uid)
+                if member is not None:
+                    weights[j] += sum(w for rid, w in roles.items() if member.get_role(rid))
+    per = bonus.get('per_messages')
+    if per:
+        floor = (reqs or {}).get('min_messages') or 0
+        cap = bonus.get('max_activity') or 10
+        if np is not None:
+            messages = activity_columns(state, ids, since, scope)[0].tolist()
+        else:
+            messages = [activity_since(state, uid, since, scope)[0] for uid in ids]
+        for j, m in enumerate(messages):
+            weights[j] += min(cap, max(0, m - floor) // per)
+    return weights
+
+def draw_rng(msg_id, data):
+    # Every ending and reroll gets its own seed from the giveaway's stored
+    # salt and a draw counter, so any draw can be replayed from the record.
+    # The caller persists the bumped counter.
+    data['draws'] = data.get('draws', 0) + 1
+    return random.Random(f"{data.get('seed', msg_id)}:{data['draws']}")
+
+def sample_snapshot(eligible, weights, k, rng, exclude=()):
+    # k distinct winners from an eligible snapshot: uniform, or weighted by
+    # bonus entries through an alias table
+    if weights:
+        return AliasSampler(eligible, weights, rng).sample(k, exclude)
+    if exclude:
+        return UniformSampler(eligible, rng).sample(k, exclude)
+    return rng.sample(eligible, min(k, len(eligible)))
+
+def eligible_snapshot(state, entrant_ids, reqs, since=None, bonus=None, scope=None):
+    """Who could win right now, from one bulk eligibility pass.
+
+    Returns (eligible, weights, report): the eligible user ids as a sorted
+    array('Q'), their entry counts as an array('H') when the giveaway has
+    bonus entries (else None), and the eligibility report.
+    """
+    ids = sorted(entrant_ids)
+    mask, report = eligibility(state, ids, reqs, since, scope)
+    eligible = array('Q', (uid for uid, ok in zip(ids, mask) if ok))
+    weights = None
+    if bonus and eligible:
+        counts = entry_weights(state, bonus, reqs, eligible, since, scope)
+        report['bonus_entries'] = sum(counts) - len(counts)
+        weights = array('H', (min(w, 0xFFFF) for w in counts))
+    return eligible, weights, report
+
+async def eligible_snapshot_streaming(state, reaction, reqs, since=None, bonus=None, scope=None):
+    """eligible_snapshot for entrants that are not in the live index yet.
+
+    Reactors are checked a page at a time as they arrive; only the eligible
+    ones are kept, packed at 8 bytes (plus 2 for the entry count) each.
+    """
+    eligible = array('Q')
+    counts = array('H')
+    report = {'entrants': 0, 'eligible': 0, 'failed': {}}
+    if reaction is None:
+        return eligible, None, report
+    page = []
+
+    def check_page():
+        mask, page_report = eligibility(state, page, reqs, since, scope)
+        merge_reports(report, page_report)
+        passed = [uid for uid, ok in zip(page, mask) if ok]
+        eligible.extend(passed)
+        if bonus:
+            counts.extend(min(w, 0xFFFF) for w in entry_weights(state, bonus, reqs, passed, since, scope))
+        page.clear()
+
+    async for u in reaction.users():
+        if u == bot.user:
+            continue
+        page.append(u.id)
+        if len(page) >= 100:
+            check_page()
+    check_page()
+    order = sorted(range(len(eligible)), key=eligible.__getitem__)
+    eligible = array('Q', (eligible[i] for i in order))
+    weights = None
+    if bonus and eligible:
+        weights = array('H', (counts[i] for i in order))
+        report['bonus_entries'] = sum(weights) - len(weights)
+    return eligible, weights, report
+
+async def entrant_snapshot(msg_id, data, reqs):
+    # The live entrant index makes this a local set operation; only fall
+    # back to paging the reactions over REST when it is not in sync yet.
+    state = state_of(data)
+    since = data.get('start_time')
+    bonus = data.get('bonus')
+    scope = state.scoped.get(msg_id)
+    if msg_id in entrants_synced:
+        return eligible_snapshot(state, entrant_index.get(msg_id, ()), reqs, since, bonus, scope)
+    channel = bot.get_channel(data['channel_id'])
+    msg = await rest.call(rest.FETCH, channel.id, channel.fetch_message, int(msg_id))
+    reaction = find_reaction(msg, data.get('emoji', '🎉'))
+    return await eligible_snapshot_streaming(state, reaction, reqs, since, bonus, scope)
+
+async def draw_winners(msg_id, data, reqs, k=1):
+    # Returns (winner_ids, report)
+    eligible, weights, report = await entrant_snapshot(msg_id, data, reqs)
+    rng = draw_rng(msg_id, data)
+    mark_giveaway_dirty(msg_id)
+    return sample_snapshot(eligible, weights, k, rng), report
+
+def check_requirements(state, user_id, reqs, since=None, scope=None):
+    # since is the giveaway's start_time: only activity after it counts
     if not reqs:
         return True
-    stats = user_stats.get(str(user_id), {"messages": 0, "vc_time": 0})
-    if reqs.get('min_messages') and stats['messages'] < reqs['min_messages']:
+    messages, vc_time = activity_since(state, user_id, since, scope)
+    if reqs.get('min_messages') and messages < reqs['min_messages']:
         return False
-    if reqs.get('min_vc_minutes') and stats['vc_time'] < reqs['min_vc_minutes']:
+    if reqs.get('min_vc_minutes') and vc_time < reqs['min_vc_minutes']:
         return False
     # Custom requirements are manual
     return True
 
 # -------------------- MAIN PANEL --------------------
-class GiveawayMainView(View):
+class GiveawayMainView(TimedView):
     def __init__(self):
         super().__init__(timeout=None)
 
-    @discord.ui.button(label="New Giveaway", style=discord.ButtonStyle.success, emoji="🎁")
+    @discord.ui.button(label="New Giveaway", style=discord.ButtonStyle.success, emoji="🎁", custom_id="giveaway_panel:new")
     async def new_btn(self, interaction: discord.Interaction, button: Button):
-        options = []
-        for ch in interaction.guild.text_channels[:25]:
-            if ch.permissions_for(interaction.guild.me).send_messages:
-                options.append(discord.SelectOption(label=f"#{ch.name}", value=str(ch.id)))
-        if not options:
+        channels = postable_channels(interaction.guild)
+        if not channels:
             return await interaction.response.send_message("No accessible channels.", ephemeral=True)
-        select = Select(placeholder="Choose channel...", options=options)
-        async def select_cb(inter: discord.Interaction):
-            ch = inter.guild.get_channel(int(select.values[0]))
-            gid = ''.join(random.choices('0123456789abcdef', k=6))
-            temp_giveaways[inter.user.id] = {
-                'channel': ch, 'prize': None, 'duration': None, 'min_messages': None,
-                'min_vc': None, 'custom_req': None, 'emoji': '🎉', 'image_url': None,
-                'waiting_for_image': False, 'giveaway_id': gid
-            }
-            await inter.response.edit_message(content=f"Setup in {ch.mention} | ID: `{gid}`", view=GiveawaySetupView(inter.user.id))
-        select.callback = select_cb
-        view = View(timeout=60)
-        view.add_item(select)
-        await interaction.response.send_message("Select a channel:", view=view, ephemeral=True)
+        view = ChannelSelectView(channels)
+        await interaction.response.send_message(view.content(), view=view, ephemeral=True)
 
-    @discord.ui.button(label="Edit", style=discord.ButtonStyle.primary, emoji="✏️")
+    @discord.ui.button(label="Edit", style=discord.ButtonStyle.primary, emoji="✏️", custom_id="giveaway_panel:edit")
     async def edit_btn(self, interaction: discord.Interaction, button: Button):
-        if not giveaways:
+        state = state_for(interaction.guild_id)
+        if not state.giveaways:
             return await interaction.response.send_message("No active giveaways.", ephemeral=True)
         options = []
-        for mid, d in list(giveaways.items())[:25]:
+        for mid, d in list(state.giveaways.items())[:25]:
             options.append(discord.SelectOption(label=d['prize'][:50], value=mid, emoji=d.get('emoji','🎁')))
         select = Select(placeholder="Select giveaway...", options=options)
         async def select_cb(inter: discord.Interaction):
             mid = select.values[0]
-            data = giveaways[mid]
+            data = state.giveaways[mid]
             view = EditGiveawayView(inter.user.id, data['giveaway_id'], data)
             await inter.response.edit_message(content=f"Editing: {data['prize']}", view=view)
         select.callback = select_cb
-        view = View(timeout=60)
+        view = TimedView(timeout=60)
         view.add_item(select)
         await interaction.response.send_message("Pick a giveaway:", view=view, ephemeral=True)
 
-    @discord.ui.button(label="Reroll", style=discord.ButtonStyle.secondary, emoji="🔄")
+    @discord.ui.button(label="Reroll", style=discord.ButtonStyle.secondary, emoji="🔄", custom_id="giveaway_panel:reroll")
     async def reroll_btn(self, interaction: discord.Interaction, button: Button):
-        if not giveaways:
-            return await interaction.response.send_message("No active giveaways.", ephemeral=True)
+        state = state_for(interaction.guild_id)
+        prune_archive(state)
+        if not state.archive and not state.giveaways:
+            return await interaction.response.send_message("No giveaways to reroll.", ephemeral=True)
         options = []
-        for mid, d in list(giveaways.items())[:25]:
+        # Most recently ended first, then the ones still running
+        for mid, d in list(reversed(state.archive.items()))[:25]:
+            ended = datetime.fromtimestamp(d['ended_at']).strftime('%b %d %H:%M')
+            options.append(discord.SelectOption(label=d['prize'][:50], value=mid, emoji=d.get('emoji','🎁'),
+                                                description=f"Ended {ended} · {len(d['eligible'])} eligible"))
+        for mid, d in list(state.giveaways.items())[:25 - len(options)]:
             options.append(discord.SelectOption(label=d['prize'][:50], value=mid, emoji=d.get('emoji','🎁')))
         select = Select(placeholder="Select giveaway...", options=options)
         async def select_cb(inter: discord.Interaction):
             mid = select.values[0]
-            data = giveaways[mid]
-            ch = bot.get_channel(data['channel_id'])
+            data = state.archive.get(mid) or state.giveaways.get(mid)
+            if data is None:
+                return await inter.response.send_message("That giveaway is gone.", ephemeral=True)
+            # Each reroll click is answered by exactly one process
+            if not await leases.claim_once(f'reroll:{inter.id}'):
+                return
             try:
-                msg = await ch.fetch_message(int(mid))
-                emoji = data.get('emoji','🎉')
-                react = discord.utils.get(msg.reactions, emoji=emoji)
-                users = [u async for u in react.users() if u != bot.user] if react else []
-                eligible = [u for u in users if check_requirements(u.id, data.get('requirements',{}))]
-                if eligible:
-                    winner = random.choice(eligible)
-                    embed = discord.Embed(title="🔄 Reroll Winner", description=f"{winner.mention} won **{data['prize']}**", color=0x00FF00)
-                else:
-                    embed = discord.Embed(title="Reroll", description="No eligible entries.", color=0xFF0000)
-                if data.get('image_url'):
-                    embed.set_image(url=data['image_url'])
-                await inter.response.send_message(embed=embed)
+                await inter.response.send_message(embed=await reroll_embed(state, mid, data))
             except Exception as e:
                 await inter.response.send_message(f"Error: {e}", ephemeral=True)
         select.callback = select_cb
-        view = View(timeout=60)
+        view = TimedView(timeout=60)
         view.add_item(select)
         await interaction.response.send_message("Pick a giveaway:", view=view, ephemeral=True)
 
+async def reroll_embed(state, mid, data):
+    archived = mid in state.archive
+    if archived:
+        picked = reroll_archived(state, mid)
+    else:
+        picked, _ = await draw_winners(mid, data, data.get('requirements',{}))
+    audit('giveaway_rerolled', message_id=mid, guild_id=state.guild_id, archived=archived, winners=picked)
+    if picked:
+        embed = discord.Embed(title="🔄 Reroll Winner", description=f"<@{picked[0]}> won **{data['prize']}**", color=0x00FF00)
+    else:
+        embed = discord.Embed(title="Reroll", description="No eligible entries.", color=0xFF0000)
+    if data.get('image_url'):
+        embed.set_image(url=data['image_url'])
+    return embed
+
 # -------------------- EDIT GIVEAWAY VIEW --------------------
-class EditGiveawayView(View):
+class EditGiveawayView(TimedView):
     def __init__(self, user_id, gid, data):
         super().__init__(timeout=120)
         self.user_id = user_id
@@ -609,84 +3759,323 @@ class EditGiveawayView(View):
     async def done(self, interaction: discord.Interaction, button: Button):
         await interaction.response.edit_message(content="Editing finished.", view=None)
 
-class ExtendTimeModal(Modal, title="Add Time"):
+class ExtendTimeModal(TimedModal, title="Add Time"):
     def __init__(self, gid):
         super().__init__()
         self.gid = gid
         self.add_item(TextInput(label="Extra time", placeholder="e.g. 30m, 1h", max_length=10))
 
     async def on_submit(self, interaction: discord.Interaction):
-        for mid, data in giveaways.items():
-            if data.get('giveaway_id') == self.gid:
-                try:
-                    val = self.children[0].value
-                    unit = val[-1]
-                    if unit == 'm':
-                        sec = int(val[:-1])*60
-                    elif unit == 'h':
-                        sec = int(val[:-1])*3600
-                    elif unit == 'd':
-                        sec = int(val[:-1])*86400
-                    else:
-                        return await interaction.response.send_message("Invalid format.", ephemeral=True)
-                    data['end_time'] += sec
-                    save_json(GIVEAWAY_FILE, giveaways)
-                    await interaction.response.send_message(f"Added {val}.", ephemeral=True)
-                    asyncio.create_task(watch_giveaway(mid, data['end_time'], data['emoji'], data.get('requirements',{})))
-                    return
-                except:
-                    return await interaction.response.send_message("Error parsing time.", ephemeral=True)
-        await interaction.response.send_message("Giveaway not found.", ephemeral=True)
-
-class ChangePrizeModal(Modal, title="Change Prize"):
+        state = state_for(interaction.guild_id)
+        mid = state.lookup.resolve(self.gid)
+        if mid is None:
+            return await interaction.response.send_message("Giveaway not found.", ephemeral=True)
+        data = state.giveaways[mid]
+        try:
+            val = self.children[0].value
+            unit = val[-1]
+            if unit == 'm':
+                sec = int(val[:-1])*60
+            elif unit == 'h':
+                sec = int(val[:-1])*3600
+            elif unit == 'd':
+                sec = int(val[:-1])*86400
+            else:
+                return await interaction.response.send_message("Invalid format.", ephemeral=True)
+            data['end_time'] += sec
+            mark_giveaway_dirty(mid)
+            await interaction.response.send_message(f"Added {val}.", ephemeral=True)
+            hold_giveaway(mid, data)
+        except:
+            return await interaction.response.send_message("Error parsing time.", ephemeral=True)
+        try:
+            # The post shows the end time; keep it in step
+            await rerender_giveaway(mid, data, end_time=data['end_time'])
+        except:
+            pass
+
+class ChangePrizeModal(TimedModal, title="Change Prize"):
     def __init__(self, gid):
         super().__init__()
         self.gid = gid
         self.add_item(TextInput(label="New prize name", max_length=100))
 
     async def on_submit(self, interaction: discord.Interaction):
-        for mid, data in giveaways.items():
-            if data.get('giveaway_id') == self.gid:
-                data['prize'] = self.children[0].value
-                save_json(GIVEAWAY_FILE, giveaways)
-                try:
-                    ch = bot.get_channel(data['channel_id'])
-                    msg = await ch.fetch_message(int(mid))
-                    embed = msg.embeds[0]
-                    desc = embed.description
-                    lines = desc.split('\n')
-                    lines[0] = f"## {data['prize']}"
-                    embed.description = '\n'.join(lines)
-                    await msg.edit(embed=embed)
-                except:
-                    pass
-                await interaction.response.send_message("Prize updated.", ephemeral=True)
-                return
-        await interaction.response.send_message("Giveaway not found.", ephemeral=True)
+        state = state_for(interaction.guild_id)
+        mid = state.lookup.resolve(self.gid)
+        if mid is None:
+            return await interaction.response.send_message("Giveaway not found.", ephemeral=True)
+        data = state.giveaways[mid]
+        data['prize'] = self.children[0].value
+        state.lookup.add(mid, data)
+        mark_giveaway_dirty(mid)
+        # Answer first: the embed edit is cosmetic and may wait in the REST queue
+        await interaction.response.send_message("Prize updated.", ephemeral=True)
+        try:
+            await rerender_giveaway(mid, data, prize=data['prize'])
+        except:
+            pass
+
+# -------------------- GIVEAWAY MESSAGES --------------------
+# A giveaway post's embed is rendered from a small dict of inputs taken from
+# the giveaway record. Changing the prize or the end time updates the inputs,
+# re-renders and edits through a PartialMessage: no fetch, and no parsing of
+# the old embed. Inputs of recently used posts are kept in a bounded LRU and
+# dropped when Discord reports the message deleted, or edited into something
+# they no longer render; a miss simply rebuilds them from the record.
+GIVEAWAY_MESSAGE_CACHE = int(os.environ.get('GIVEAWAY_MESSAGE_CACHE', 1000))
+
+def embed_inputs(data):
+    reqs = data.get('requirements') or {}
+    req_list = []
+    if reqs.get('min_messages'):
+        req_list.append(f"• **{reqs['min_messages']} messages**")
+    if reqs.get('min_vc_minutes'):
+        req_list.append(f"• **{reqs['min_vc_minutes']} min in VC**")
+    if reqs.get('custom'):
+        req_list.append(f"• {reqs['custom']}")
+    bonus = describe_bonus(data.get('bonus') or {})
+    # Channel rules go with whatever counts activity
+    if reqs.get('min_messages') or reqs.get('min_vc_minutes'):
+        req_list.extend(describe_channel_rules(reqs))
+    elif (data.get('bonus') or {}).get('per_messages'):
+        bonus.extend(describe_channel_rules(reqs))
+    return {
+        'prize': data['prize'],
+        'emoji': data.get('emoji', '🎉'),
+        'host_id': data.get('host_id'),
+        'winners': data.get('winners', 1),
+        'end_time': data['end_time'],
+        'giveaway_id': data.get('giveaway_id'),
+        'requirements': req_list,
+        'bonus': bonus,
+        'image_url': data.get('image_url'),
+    }
+
+def render_giveaway(inputs):
+    emoji = inputs['emoji']
+    embed = discord.Embed(
+        title=f"{emoji} **GIVEAWAY** {emoji}",
+        description=f"## {inputs['prize']}\n\n"
+                   f"━━━━━━━━━━━━━━━━━━━━━━\n\n"
+                   f"**Hosted by:** <@{inputs['host_id']}>\n"
+                   f"**Winners:** {inputs['winners']}\n"
+                   f"**Ends:** <t:{int(inputs['end_time'])}:R>\n"
+                   f"**ID:** `{inputs['giveaway_id']}`\n\n"
+                   f"━━━━━━━━━━━━━━━━━━━━━━",
+        color=0x5865F2
+    )
+    if inputs['requirements']:
+        embed.add_field(name="Requirements", value="\n".join(inputs['requirements']), inline=False)
+    if inputs['bonus']:
+        embed.add_field(name="Bonus Entries", value="\n".join(inputs['bonus']), inline=False)
+    embed.add_field(name="How to enter", value=f"React with {emoji} below!", inline=False)
+    if inputs['image_url']:
+        embed.set_image(url=inputs['image_url'])
+    embed.set_footer(text="Winner will be announced instantly.")
+    embed.timestamp = datetime.fromtimestamp(inputs['end_time'], timezone.utc)
+    return embed
+
+class GiveawayMessages:
+    """Embed inputs by message id, least recently used first."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def remember(self, mid, inputs):
+        self.entries.pop(mid, None)
+        self.entries[mid] = inputs
+        if len(self.entries) > self.max_size:
+            del self.entries[next(iter(self.entries))]
+
+    def inputs(self, mid, data):
+        inputs = self.entries.get(mid)
+        if inputs is None:
+            self.misses += 1
+            inputs = embed_inputs(data)
+        else:
+            self.hits += 1
+        self.remember(mid, inputs)
+        return inputs
+
+    def invalidate(self, mid):
+        self.entries.pop(mid, None)
+
+    def edited(self, mid, data):
+        # MESSAGE_UPDATE also arrives for the bot's own edits: keep the inputs
+        # while the post still shows what they render
+        inputs = self.entries.get(mid)
+        if inputs is None or 'embeds' not in data:
+            return
+        embeds = data['embeds']
+        if not embeds or embeds[0].get('description') != render_giveaway(inputs).description:
+            del self.entries[mid]
+
+giveaway_messages = GiveawayMessages(GIVEAWAY_MESSAGE_CACHE)
+
+async def rerender_giveaway(mid, data, **changes):
+    inputs = giveaway_messages.inputs(mid, data)
+    inputs.update(changes)
+    channel = bot.get_channel(data['channel_id'])
+    await rest.call(rest.EDIT, channel.id, channel.get_partial_message(int(mid)).edit, embed=render_giveaway(inputs))
+
+@bot.event
+async def on_raw_message_edit(payload):
+    giveaway_messages.edited(str(payload.message_id), payload.data)
+
+@bot.event
+async def on_raw_message_delete(payload):
+    giveaway_messages.invalidate(str(payload.message_id))
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    for mid in payload.message_ids:
+        giveaway_messages.invalidate(str(mid))
 
 # -------------------- STATS TRACKING --------------------
+VC_EXCLUDE_AFK = os.environ.get('VC_EXCLUDE_AFK', '1') == '1'
+VC_EXCLUDE_DEAFENED = os.environ.get('VC_EXCLUDE_DEAFENED', '0') == '1'
+VC_EXCLUDE_MUTED = os.environ.get('VC_EXCLUDE_MUTED', '0') == '1'
+VC_CHECKPOINT_MINUTES = float(os.environ.get('VC_CHECKPOINT_MINUTES', 5))
+
+class VoiceLedger:
+    """Open voice sessions, updated in O(1) per voice state change.
+
+    sessions maps user id -> [started, counted, channel_id], counted being
+    False while AFK or deafened (see VC_EXCLUDE_*). Time is only added to the
+    stats store, and to each ScopedActivity counting the channel, when a
+    segment closes (leave, move, a change that flips whether time counts, or
+    a change of counted channels); queries add the open segment on the fly.
+    Checkpoints persist the open sessions in one batch write so a restart can
+    credit time up to the last checkpoint.
+    """
+    def __init__(self, state):
+        self.state = state
+        self.sessions = {}
+        self.restored = {}
+
+    def __len__(self):
+        return len(self.sessions)
+
+    @staticmethod
+    def counts(state):
+        if state.channel is None:
+            return False
+        if VC_EXCLUDE_AFK and state.afk:
+            return False
+        if VC_EXCLUDE_DEAFENED and (state.self_deaf or state.deaf):
+            return False
+        if VC_EXCLUDE_MUTED and (state.self_mute or state.mute):
+            return False
+        return True
+
+    def _accrue(self, uid, seconds):
+        if seconds <= 0:
+            return
+        self.state.count_activity(uid, seconds=int(seconds))
+
+    def _close(self, uid, session, now):
+        started, counted, channel_id = session[:3]
+        if not counted:
+            return
+        rule = self.state.vc_rule
+        if rule is not None and channel_id in rule:
+            self._accrue(uid, now - started)
+        for scope in self.state.scoped_vc:
+            if channel_id in scope.rule:
+                scope.add_vc(uid, now - max(started, scope.start))
+
+    def tracking(self):
+        return self.state.vc_rule is not None or bool(self.state.scoped_vc)
+
+    def transition(self, uid, after, now=None):
+        now = time.time() if now is None else now
+        channel_id = after.channel.id if after.channel else None
+        counted = self.counts(after)
+        session = self.sessions.get(uid)
+        if session is not None:
+            if session[1] == counted and session[2] == channel_id:
+                return
+            self._close(uid, session, now)
+        if channel_id is None:
+            if self.sessions.pop(uid, None) is not None:
+                # So the next checkpoint does not leave a closed session behind
+                persistence.mark_dirty(self.state.vc_key, uid)
+        else:
+            self.sessions[uid] = [now, counted, channel_id]
+
+    def open_seconds(self, uid, now=None, scope=None):
+        # The open segment, for the shared counters or for one ScopedActivity
+        session = self.sessions.get(uid)
+        if session is None or not session[1]:
+            return 0
+        rule = self.state.vc_rule if scope is None else scope.rule
+        if rule is None or session[2] not in rule:
+            return 0
+        started = session[0] if scope is None else max(session[0], scope.start)
+        return int(max(0, (time.time() if now is None else now) - started))
+
+    def open_columns(self, uids, now, scope=None):
+        # open_seconds for an array of users, in one pass over the sessions
+        if not self.sessions:
+            return np.zeros(len(uids))
+        table = {uid: self.open_seconds(uid, now, scope) for uid in self.sessions}
+        return gather_counts(table, uids, np.float64)
+
+    def fold_open(self, now=None):
+        # Close and reopen every counted segment at `now`
+        now = time.time() if now is None else now
+        for uid, session in self.sessions.items():
+            if session[1]:
+                self._close(uid, session, now)
+                session[0] = now
+
+    def restore(self):
+        # Credit sessions from before a restart up to their last checkpoint
+        for uid, session in self.restored.items():
+            if session[3]:
+                self._close(int(uid), session, session[3])
+        self.restored = {}
+
+    def resync(self, guild):
+        # Voice events can be missed while disconnected, and the counted
+        # channels change with the running giveaways: rebuild from the cache.
+        # Nothing is tracked while no giveaway needs voice time.
+        if guild is None:
+            return
+        now = time.time()
+        seen = set()
+        channels = (*guild.voice_channels, *guild.stage_channels) if self.tracking() else ()
+        for channel in channels:
+            for member in channel.members:
+                if member.bot or member.voice is None:
+                    continue
+                seen.add(member.id)
+                self.transition(member.id, member.voice, now)
+        for uid in [uid for uid in self.sessions if uid not in seen]:
+            self._close(uid, self.sessions.pop(uid), now)
+        persistence.mark_dirty(self.state.vc_key)
+
 @bot.event
+@timed('on_voice_state_update')
 async def on_voice_state_update(member, before, after):
-    uid = str(member.id)
-    if uid not in user_stats:
-        user_stats[uid] = {"messages": 0, "vc_time": 0, "name": str(member)}
-    if before.channel is None and after.channel is not None:
-        vc_tracking[uid] = datetime.utcnow()
-    elif before.channel is not None and after.channel is None and uid in vc_tracking:
-        joined = vc_tracking.pop(uid)
-        minutes = (datetime.utcnow() - joined).total_seconds() / 60
-        user_stats[uid]["vc_time"] += minutes
-        save_json(STATS_FILE, user_stats)
-
-@tasks.loop(minutes=5)
-async def track_vc():
-    now = datetime.utcnow()
-    for uid, joined in list(vc_tracking.items()):
-        minutes = (now - joined).total_seconds() / 60
-        if minutes >= 5:
-            user_stats[uid]["vc_time"] += minutes
-            vc_tracking[uid] = now
-            save_json(STATS_FILE, user_stats)
+    if member.bot:
+        return
+    state = state_for(member.guild.id)
+    if state.vc.tracking():
+        state.vc.transition(member.id, after)
+
+@tasks.loop(minutes=VC_CHECKPOINT_MINUTES)
+async def checkpoint_vc():
+    # One batch write of the open sessions; accrual itself stays lazy
+    for state in guild_states.values():
+        if state.vc.sessions:
+            persistence.mark_dirty(state.vc_key)
 
 # -------------------- COMMANDS --------------------
 @bot.command()
@@ -699,73 +4088,365 @@ async def giveawaypanel(ctx):
     await ctx.send(embed=embed, view=GiveawayMainView())
 
 @bot.command()
+@commands.guild_only()
 async def givestats(ctx, member: discord.Member = None):
-    m = member or ctx.author
-    stats = user_stats.get(str(m.id), {"messages": 0, "vc_time": 0})
+    await ctx.send(embed=stats_embed(member or ctx.author))
+
+def stats_embed(m):
+    messages, vc_time = activity_since(state_for(m.guild.id), m.id)
     embed = discord.Embed(title=f"📊 {m.display_name}'s Stats", color=0x5865F2)
-    embed.add_field(name="Messages", value=stats['messages'], inline=True)
-    embed.add_field(name="VC Time", value=f"{stats['vc_time']:.1f} min", inline=True)
+    embed.add_field(name="Messages", value=messages, inline=True)
+    embed.add_field(name="VC Time", value=f"{vc_time:.1f} min", inline=True)
     embed.set_thumbnail(url=m.avatar.url if m.avatar else m.default_avatar.url)
-    await ctx.send(embed=embed)
+    return embed
+
+# -------------------- SLASH COMMANDS --------------------
+# The same actions as $set, $givestats and the panel's Edit/Reroll buttons.
+# Giveaway arguments autocomplete from the guild's GIVEAWAY LOOKUP indexes.
+def giveaway_choice(mid, data, ended=False):
+    label = f"{data.get('emoji', '🎁')} {data['prize']} · {data.get('giveaway_id') or mid}"
+    if ended:
+        label += " (ended)"
+    return app_commands.Choice(name=label[:100], value=mid)
+
+@slow_timed('autocomplete')
+async def running_autocomplete(interaction: discord.Interaction, current: str):
+    state = state_for(interaction.guild_id)
+    return [giveaway_choice(mid, state.giveaways[mid]) for mid in state.lookup.search(current)]
+
+@slow_timed('autocomplete')
+async def reroll_autocomplete(interaction: discord.Interaction, current: str):
+    # Ended giveaways first, then running ones, up to Discord's limit in all
+    state = state_for(interaction.guild_id)
+    choices = [giveaway_choice(mid, state.archive[mid], ended=True) for mid in state.archive_lookup.search(current)]
+    choices += [giveaway_choice(mid, state.giveaways[mid])
+                for mid in state.lookup.search(current, AUTOCOMPLETE_LIMIT - len(choices))]
+    return choices
+
+giveaway_group = app_commands.Group(name="giveaway", description="Manage giveaways", guild_only=True,
+                                    default_permissions=discord.Permissions(manage_guild=True))
+
+@giveaway_group.command(name="set", description="Pick the winner of a running giveaway yourself")
+@app_commands.describe(member="The winner", giveaway="Giveaway ID or prize")
+@app_commands.autocomplete(giveaway=running_autocomplete)
+@slow_timed('command', 'giveaway set')
+async def slash_set(interaction: discord.Interaction, member: discord.Member, giveaway: str):
+    if not interaction.user.guild_permissions.administrator:
+        return await interaction.response.send_message("Administrators only.", ephemeral=True)
+    state = state_for(interaction.guild_id)
+    mid = state.lookup.resolve(giveaway)
+    if mid is None:
+        return await interaction.response.send_message("❌ Giveaway ID not found.", ephemeral=True)
+    if not await leases.claim_once(f'cmd:{interaction.id}'):
+        return
+    await interaction.response.defer(ephemeral=True)
+    await interaction.followup.send(await force_winner(state, mid, member), ephemeral=True)
+
+@giveaway_group.command(name="edit", description="Change a running giveaway's time, prize or emoji")
+@app_commands.describe(giveaway="Giveaway ID or prize")
+@app_commands.autocomplete(giveaway=running_autocomplete)
+@slow_timed('command', 'giveaway edit')
+async def slash_edit(interaction: discord.Interaction, giveaway: str):
+    state = state_for(interaction.guild_id)
+    mid = state.lookup.resolve(giveaway)
+    if mid is None:
+        return await interaction.response.send_message("❌ Giveaway ID not found.", ephemeral=True)
+    data = state.giveaways[mid]
+    view = EditGiveawayView(interaction.user.id, data['giveaway_id'], data)
+    await interaction.response.send_message(f"Editing: {data['prize']}", view=view, ephemeral=True)
+
+@giveaway_group.command(name="reroll", description="Draw a new winner")
+@app_commands.describe(giveaway="Giveaway ID or prize")
+@app_commands.autocomplete(giveaway=reroll_autocomplete)
+@slow_timed('command', 'giveaway reroll')
+async def slash_reroll(interaction: discord.Interaction, giveaway: str):
+    state = state_for(interaction.guild_id)
+    prune_archive(state)
+    mid = state.archive_lookup.resolve(giveaway) or state.lookup.resolve(giveaway)
+    data = state.archive.get(mid) or state.giveaways.get(mid)
+    if data is None:
+        return await interaction.response.send_message("❌ Giveaway ID not found.", ephemeral=True)
+    if not await leases.claim_once(f'reroll:{interaction.id}'):
+        return
+    await interaction.response.defer()
+    try:
+        await interaction.followup.send(embed=await reroll_embed(state, mid, data))
+    except Exception as e:
+        await interaction.followup.send(f"Error: {e}", ephemeral=True)
+
+@bot.tree.command(name="givestats", description="Messages and voice time counted for giveaways")
+@app_commands.guild_only()
+@app_commands.describe(member="Whose stats (default: yours)")
+@slow_timed('command', 'givestats')
+async def slash_givestats(interaction: discord.Interaction, member: discord.Member = None):
+    await interaction.response.send_message(embed=stats_embed(member or interaction.user))
+
+bot.tree.add_command(giveaway_group)
+
+# -------------------- STARTUP --------------------
+# Only what giveaways need to be scheduled is loaded before connecting: the
+# giveaway, VC session and archive partitions (setup_hook). Once the gateway
+# is ready, giveaways are rescheduled and then user stats, entrant
+# reconciliation and slash command registration run side by side in the
+# background. A guild whose stats are needed before their turn loads them on
+# the spot. Each phase is timed and printed as one report.
+# Longest the background stats load holds the loop before yielding, seconds
+STATS_WARM_SLICE = float(os.environ.get('STATS_WARM_SLICE', 0.005))
+
+class StartupTimer:
+    """Seconds spent in each startup phase, printed once the bot is serving."""
+    def __init__(self):
+        self.phases = {}
+        self.background = {}
+        self.ready_seconds = None
+        self.gateway_started = None
+
+    def mark(self, name, since):
+        self.phases[name] = time.monotonic() - since
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.mark(name, start)
+
+    async def run_background(self, name, coro):
+        start = time.monotonic()
+        try:
+            await coro
+        except Exception as e:
+            audit('startup_task_failed', logging.ERROR, task=name, error=str(e))
+        self.background[name] = time.monotonic() - start
+        print(f"⏱️ {name} done in {self.background[name]:.2f}s (background)")
+
+    @staticmethod
+    def format(phases):
+        return " · ".join(f"{name} {seconds:.2f}s" for name, seconds in phases.items())
+
+    def report(self):
+        self.ready_seconds = time.monotonic() - IMPORT_STARTED
+        print(f"⏱️ Serving {self.ready_seconds:.2f}s after start: {self.format(self.phases)}")
+
+startup = StartupTimer()
+
+async def warm_stats():
+    # Build each guild's stats in short slices so events keep flowing
+    users = 0
+    deadline = time.monotonic() + STATS_WARM_SLICE
+    for state in list(guild_states.values()):
+        if state.stats_loaded:
+            continue
+        store = StatsStore()
+        for i, (uid, row) in enumerate(persistence.iter_rows(state.stats_key), 1):
+            store.add_row(uid, row)
+            if i % 256 == 0 and time.monotonic() >= deadline:
+                await asyncio.sleep(0)
+                deadline = time.monotonic() + STATS_WARM_SLICE
+                if state.stats_loaded:
+                    # Someone needed them first and loaded them in one go
+                    break
+        if not state.stats_loaded:
+            state.stats = store
+        users += len(state.stats)
+    adopt_legacy_stats()
+    print(f"📊 Stats loaded for {users} users in {len(guild_states)} guilds")
+
+async def sync_commands():
+    # Slash commands are global; one process registering them is enough
+    if SYNC_COMMANDS and (SHARD_IDS is None or 0 in SHARD_IDS):
+        await bot.tree.sync()
 
 # -------------------- ON_READY --------------------
 @bot.event
 async def on_ready():
     print(f'{bot.user} is online!')
-    track_vc.start()
+    first = startup.ready_seconds is None
+    if first:
+        startup.mark('gateway', startup.gateway_started)
+    if not checkpoint_vc.is_running():
+        checkpoint_vc.start()
+    if not flush_loop.is_running():
+        flush_loop.start()
+    if not lease_heartbeat.is_running():
+        # One beat before scheduling so endings are split across live workers
+        with startup.phase('leases'):
+            await leases.heartbeat()
+        lease_heartbeat.start()
+    with startup.phase('rehydrate'):
+        adopt_legacy_state()
+        rehydrate_giveaways()
+        for state in list(guild_states.values()):
+            state.vc.restore()
+        for guild in bot.guilds:
+            state_for(guild.id).vc.resync(guild)
+        scheduler.start()
+    if not getattr(bot, 'lag_monitor', None):
+        bot.lag_monitor = asyncio.create_task(monitor_loop_lag())
+    print(f"⏰ {len(scheduler)} giveaways scheduled")
+    background = [('entrants', reconcile_all_entrants())]
+    if first:
+        startup.report()
+        background += [('stats', warm_stats()), ('commands', sync_commands())]
+    for name, coro in background:
+        asyncio.create_task(startup.run_background(name, coro))
 
-# -------------------- KEEP ALIVE (24/7) --------------------
-app = Flask('')
-@app.route('/')
-def home():
-    return "Bot is alive!"
+# -------------------- WEB SERVER (KEEP ALIVE + API) --------------------
+WEB_PORT = int(os.environ.get('PORT', 8080))
+API_CACHE_TTL = float(os.environ.get('API_CACHE_TTL', 2))
 
-@app.route('/ping')
-def ping():
-    return "pong", 200
+class ResponseCache:
+    """Short-TTL cache of rendered responses so polling dashboards mostly
+    hit a dict lookup instead of walking bot state."""
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
 
-def run():
-    app.run(host='0.0.0.0', port=8080)
+    def get_or_build(self, key, build):
+        now = time.monotonic()
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > now:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        body = build()
+        self.entries[key] = (now + self.ttl, body)
+        if len(self.entries) > 1024:
+            self.entries = {k: v for k, v in self.entries.items() if v[0] > now}
+        return body
 
-def keep_alive():
-    server = Thread(target=run)
-    server.daemon = True
-    server.start()
-    print("🌐 Web server started on port 8080")
+api_cache = ResponseCache(API_CACHE_TTL)
+web_runner = None
 
-keep_alive()
-bot.run(os.environ['TOKEN'])
+def giveaway_summary(mid, data):
+    return {
+        'message_id': mid,
+        'giveaway_id': data.get('giveaway_id'),
+        'prize': data.get('prize'),
+        'channel_id': data.get('channel_id'),
+        'host_id': data.get('host_id'),
+        'emoji': data.get('emoji'),
+        'end_time': data.get('end_time'),
+        'start_time': data.get('start_time'),
+        'winners': data.get('winners', 1),
+        'requirements': data.get('requirements', {}),
+        'entrants': len(entrant_index.get(mid, ())),
+        'entrants_synced': mid in entrants_synced,
+        'guild_id': data.get('guild_id'),
+    }
 
-# -------------------- KEEP ALIVE (24/7) --------------------
-app = Flask('')
+def find_giveaway(key):
+    # Message ID, or short ID through each guild's GiveawayIndex
+    if key in giveaways:
+        return key, giveaways[key]
+    for state in guild_states.values():
+        mid = state.lookup.short.get(key)
+        if mid is not None:
+            return mid, state.giveaways[mid]
+    return None, None
 
-@app.route('/')
-def home():
-    return "Bot is alive! 🤖"
+def json_response(body, status=200):
+    return web.Response(text=body, status=status, content_type='application/json')
 
-@app.route('/ping')
-def ping():
-    return "pong", 200
+async def home(request):
+    return web.Response(text="Bot is alive! 🤖")
 
-@app.errorhandler(404)
-def not_found(e):
-    return "Not found", 404
+async def ping(request):
+    return web.Response(text="pong")
 
-@app.errorhandler(500)
-def internal_error(e):
-    return "Internal server error", 500
+async def metrics_endpoint(request):
+    body = metrics.render(*collect_gauges())
+    return web.Response(body=body.encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
 
-def run():
-    try:
-        app.run(host='0.0.0.0', port=8080)
-    except Exception as e:
-        print(f"Flask server error: {e}")
+async def healthz(request):
+    ok, checks = health_report()
+    return json_response(json.dumps({'status': 'ok' if ok else 'unhealthy', 'checks': checks}), 200 if ok else 503)
+
+async def api_giveaways(request):
+    body = api_cache.get_or_build('giveaways', lambda: json.dumps(
+        [giveaway_summary(mid, data) for mid, data in giveaways.items()]
+    ))
+    return json_response(body)
+
+async def api_giveaway(request):
+    key = request.match_info['gid']
+    def build():
+        mid, data = find_giveaway(key)
+        return json.dumps(giveaway_summary(mid, data)) if data else None
+    body = api_cache.get_or_build(f'giveaway:{key}', build)
+    if body is None:
+        return json_response(json.dumps({'error': 'giveaway not found'}), 404)
+    return json_response(body)
+
+def user_stats_body(uid, states):
+    # Guilds whose stats warm_stats has not reached yet are listed as loading
+    # rather than loaded here in one go
+    per_guild = {}
+    loading = []
+    for state in states:
+        if not state.stats_loaded:
+            loading.append(str(state.guild_id))
+        elif uid in state.stats or uid in state.vc.sessions:
+            messages, vc_minutes = activity_since(state, uid)
+            per_guild[str(state.guild_id)] = {'messages': messages, 'vc_minutes': round(vc_minutes, 2)}
+    body = {
+        'user_id': str(uid),
+        'messages': sum(g['messages'] for g in per_guild.values()),
+        'vc_minutes': round(sum(g['vc_minutes'] for g in per_guild.values()), 2),
+        'guilds': per_guild,
+    }
+    if loading:
+        body['loading'] = loading
+    return json.dumps(body)
+
+async def api_user_stats(request):
+    key = request.match_info['uid']
+    if not key.isdigit():
+        return json_response(json.dumps({'error': 'user id must be numeric'}), 400)
+    body = api_cache.get_or_build(f'user:{key}', lambda: user_stats_body(int(key), list(guild_states.values())))
+    return json_response(body)
+
+async def api_guild_user_stats(request):
+    guild_key, key = request.match_info['guild'], request.match_info['uid']
+    if not guild_key.isdigit() or not key.isdigit():
+        return json_response(json.dumps({'error': 'ids must be numeric'}), 400)
+    state = guild_states.get(int(guild_key))
+    if state is None:
+        return json_response(json.dumps({'error': 'guild not found on this shard'}), 404)
+    body = api_cache.get_or_build(f'user:{guild_key}:{key}', lambda: user_stats_body(int(key), [state]))
+    return json_response(body)
+
+def build_web_app():
+    app = web.Application()
+    app.add_routes([
+        web.get('/', home),
+        web.get('/ping', ping),
+        web.get('/metrics', metrics_endpoint),
+        web.get('/healthz', healthz),
+        web.get('/api/giveaways', api_giveaways),
+        web.get('/api/giveaways/{gid}', api_giveaway),
+        web.get('/api/users/{uid}/stats', api_user_stats),
+        web.get('/api/guilds/{guild}/users/{uid}/stats', api_guild_user_stats),
+    ])
+    return app
+
+async def start_web_server():
+    global web_runner
+    if web_runner is not None:
+        return
+    web_runner = web.AppRunner(build_web_app(), access_log=None)
+    await web_runner.setup()
+    await web.TCPSite(web_runner, '0.0.0.0', WEB_PORT).start()
+    print(f"🌐 Web server started on port {WEB_PORT}")
 
-def keep_alive():
-    server = Thread(target=run)
-    server.daemon = True
-    server.start()
-    print("🌐 Web server started on port 8080")
+async def stop_web_server():
+    global web_runner
+    if web_runner is not None:
+        await web_runner.cleanup()
+        web_runner = None
 
-keep_alive()
-bot.run(os.environ['TOKEN'])
+if __name__ == '__main__':
+    bot.run(os.environ['TOKEN'])
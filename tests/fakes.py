@@ -0,0 +1,152 @@
+"""Stand-ins for discord objects, shared by the tests, bench.py and
+lease_harness.py.
+
+`load_bot_module` imports main.py with a scratch working directory, and
+`make_giveaway` registers a running giveaway with its entrants.
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# -------------------- STUB DISCORD OBJECTS --------------------
+class FakeGuild:
+    def __init__(self, gid):
+        self.id = gid
+        self.me = None
+        self.text_channels = []
+
+    def get_channel(self, cid):
+        return next((ch for ch in self.text_channels if ch.id == cid), None)
+
+
+class FakeUser:
+    # Doubles as a guild member
+    def __init__(self, uid, guild, bot=False):
+        self.id = uid
+        self.guild = guild
+        self.bot = bot
+        self.name = f"user{uid}"
+        self.mention = f"<@{uid}>"
+
+    def __str__(self):
+        return self.name
+
+
+class FakeChannel:
+    def __init__(self, cid, guild, afk=False):
+        self.id = cid
+        self.guild = guild
+        self.afk = afk
+        self.mention = f"<#{cid}>"
+        self.name = f"channel-{cid}"
+        self.replies = 0
+
+    def permissions_for(self, member):
+        # Every 8th channel is closed to the bot
+        return FakePermissions(send_messages=self.id % 8 != 0)
+
+    def get_partial_message(self, mid):
+        return FakePartialMessage(self, mid)
+
+    async def send(self, *args, **kwargs):
+        self.replies += 1
+
+
+class FakePermissions:
+    def __init__(self, send_messages=True):
+        self.send_messages = send_messages
+
+
+class FakePartialMessage:
+    def __init__(self, channel, mid):
+        self.channel = channel
+        self.id = mid
+
+    async def reply(self, *args, **kwargs):
+        self.channel.replies += 1
+
+    async def edit(self, *args, **kwargs):
+        pass
+
+
+class FakeMessage:
+    def __init__(self, author, channel, content="hello"):
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.attachments = []
+        self.guild = channel.guild
+
+
+class FakeVoiceState:
+    def __init__(self, channel=None, self_deaf=False, self_mute=False):
+        self.channel = channel
+        self.afk = bool(channel and channel.afk)
+        self.self_deaf = self_deaf
+        self.deaf = False
+        self.self_mute = self_mute
+        self.mute = False
+
+
+class FakeReactionPayload:
+    def __init__(self, message_id, user_id, emoji, guild_id=None):
+        self.message_id = message_id
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.emoji = emoji
+        self.member = None
+
+
+class FakeResponse:
+    # Records what an interaction was answered with
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, content=None, **kwargs):
+        self.sent.append(('send_message', content, kwargs))
+
+    async def edit_message(self, content=None, **kwargs):
+        self.sent.append(('edit_message', content, kwargs))
+
+    async def send_modal(self, modal):
+        self.sent.append(('send_modal', None, {'modal': modal}))
+
+
+class FakeInteraction:
+    def __init__(self, user, guild):
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.response = FakeResponse()
+
+
+# -------------------- BOT MODULE --------------------
+def load_bot_module(workdir):
+    # main.py reads and writes its data files in the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    import main
+
+    async def no_commands(message):
+        return None
+    # Command parsing is discord.py's cost, not ours
+    main.bot.process_commands = no_commands
+    return main
+
+
+def make_giveaway(main, mid, channel, reqs, entrant_ids, winners=1):
+    start = time.time() - 3600
+    mid = str(mid)
+    main.add_giveaway(main.state_for(channel.guild.id), mid, {
+        'channel_id': channel.id, 'prize': f'Prize {mid}', 'end_time': time.time(),
+        'requirements': reqs, 'image_url': None, 'message_id': int(mid), 'host_id': 1,
+        'giveaway_id': mid[-6:], 'emoji': '🎉', 'winners': winners, 'start_time': start,
+        'ended': False,
+    })
+    for uid in entrant_ids:
+        main.track_entrant(FakeReactionPayload(int(mid), uid, '🎉', channel.guild.id), True)
+    main.entrants_synced.add(mid)
+    return mid
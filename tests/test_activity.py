@@ -0,0 +1,191 @@
+"""Message and voice activity counted toward giveaway requirements.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import FakeChannel, FakeGuild, FakeMessage, FakeUser, FakeVoiceState, load_bot_module, make_giveaway
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+
+class VoiceActivityTests(unittest.TestCase):
+    def setUp(self):
+        self.guild = FakeGuild(760000000000000000 + len(main.guild_states))
+        self.channel = FakeChannel(300, self.guild)
+        self.voice = FakeChannel(301, self.guild)
+        self.state = main.state_for(self.guild.id)
+        self.mid = make_giveaway(main, 960000000000000000 + len(main.guild_states), self.channel,
+                                 {'min_vc_minutes': 20}, [])
+        self.mids = [self.mid]
+        main.refresh_activity_epochs(self.state)
+
+    def tearDown(self):
+        for mid in self.mids:
+            main.remove_giveaway(mid)
+        main.guild_states.pop(self.guild.id, None)
+
+    def join(self, uid, minutes_ago):
+        self.state.vc.transition(uid, FakeVoiceState(self.voice), time.time() - minutes_ago * 60)
+
+    def test_open_session_counts_before_the_user_has_stats(self):
+        self.join(42, 30)
+        self.assertNotIn(42, self.state.stats.slots)
+        since = self.state.giveaways[self.mid]['start_time']
+        self.assertAlmostEqual(main.activity_since(self.state, 42)[1], 30, delta=0.1)
+        self.assertAlmostEqual(main.activity_since(self.state, 42, since)[1], 30, delta=0.1)
+        mask, _ = main.eligibility(self.state, [42, 43], {'min_vc_minutes': 20}, since)
+        self.assertEqual(list(mask), [True, False])
+
+    @unittest.skipIf(main.np is None, 'NumPy not installed')
+    def test_columns_match_per_user_path(self):
+        self.join(42, 30)
+        self.join(44, 5)
+        self.state.stats.slot(45)
+        since = self.state.giveaways[self.mid]['start_time']
+        for columns in (main.activity_columns(self.state, [42, 43, 44, 45], since),
+                        main.activity_columns(self.state, [42, 43, 44, 45])):
+            self.assertEqual(columns[0].tolist(), [0, 0, 0, 0])
+            self.assertAlmostEqual(columns[1][0], 30, delta=0.1)
+            self.assertAlmostEqual(columns[1][2], 5, delta=0.1)
+            self.assertEqual((columns[1][1], columns[1][3]), (0, 0))
+
+    @unittest.skipIf(main.np is None, 'NumPy not installed')
+    def test_columns_match_per_user_path_across_launches(self):
+        rng = random.Random(11)
+        stats = self.state.stats
+        first = self.state.giveaways[self.mid]['start_time']
+        for uid in range(100, 400):
+            stats.slot(uid)
+        later = make_giveaway(main, 961000000000000000 + len(main.guild_states), self.channel, {'min_vc_minutes': 5}, [])
+        self.mids.append(later)
+        self.state.giveaways[later]['start_time'] = time.time() - 600
+        main.refresh_activity_epochs(self.state)
+        main.start_activity_epoch(self.state, self.state.giveaways[later]['start_time'])
+        self.assertEqual(set(stats.baselines), {first, self.state.giveaways[later]['start_time']})
+        # Sessions closing after the second launch, and new users past the
+        # sorted slot index
+        stats.slots_of(main.np.array([100]))
+        for uid in rng.sample(range(100, 500), 150):
+            self.join(uid, rng.uniform(1, 40))
+            if rng.random() < 0.7:
+                self.state.vc.transition(uid, FakeVoiceState(None))
+        ids = list(range(90, 510))
+        for since in (None, first, self.state.giveaways[later]['start_time'], first + 60):
+            messages, minutes = main.activity_columns(self.state, ids, since)
+            for j, uid in enumerate(ids):
+                expected = main.activity_since(self.state, uid, since)
+                self.assertEqual(messages[j], expected[0], (since, uid))
+                self.assertAlmostEqual(minutes[j], expected[1], delta=0.02, msg=(since, uid))
+
+    def test_closed_session_keeps_its_time(self):
+        self.join(42, 30)
+        self.state.vc.transition(42, FakeVoiceState(None))
+        since = self.state.giveaways[self.mid]['start_time']
+        self.assertAlmostEqual(main.activity_since(self.state, 42, since)[1], 30, delta=0.1)
+
+
+class ChannelRuleTests(unittest.IsolatedAsyncioTestCase):
+    """A giveaway's channel rules only apply to that giveaway."""
+    def setUp(self):
+        self.guild = FakeGuild(770000000000000000 + len(main.guild_states))
+        self.general = FakeChannel(310, self.guild)
+        self.spam = FakeChannel(311, self.guild)
+        self.voice = FakeChannel(312, self.guild)
+        self.state = main.state_for(self.guild.id)
+        base = 970000000000000000 + 10 * len(main.guild_states)
+        self.only_general = make_giveaway(main, base, self.general,
+                                          {'min_messages': 2, 'min_vc_minutes': 20, 'allow_channels': [310, 312]}, [])
+        self.not_general = make_giveaway(main, base + 1, self.general,
+                                         {'min_messages': 2, 'min_vc_minutes': 20, 'deny_channels': [310, 312]}, [])
+        self.anywhere = make_giveaway(main, base + 2, self.general, {'min_messages': 2}, [])
+        main.refresh_activity_epochs(self.state)
+
+    def tearDown(self):
+        for mid in (self.only_general, self.not_general, self.anywhere):
+            main.remove_giveaway(mid)
+        main.guild_states.pop(self.guild.id, None)
+
+    def counts(self, mid, uid):
+        data = self.state.giveaways[mid]
+        return main.activity_since(self.state, uid, data['start_time'], self.state.scoped.get(mid))
+
+    async def test_messages_count_per_giveaway(self):
+        user = FakeUser(42, self.guild)
+        for channel in (self.general, self.general, self.spam):
+            await main.on_message(FakeMessage(user, channel))
+        self.assertEqual(self.counts(self.only_general, 42)[0], 2)
+        self.assertEqual(self.counts(self.not_general, 42)[0], 1)
+        self.assertEqual(self.counts(self.anywhere, 42)[0], 3)
+        eligible, _, _ = await main.entrant_snapshot(self.not_general, self.state.giveaways[self.not_general],
+                                                    {'min_messages': 2})
+        self.assertEqual(list(eligible), [])
+
+    def test_voice_counts_per_giveaway(self):
+        self.state.vc.transition(42, FakeVoiceState(self.voice), time.time() - 30 * 60)
+        self.assertAlmostEqual(self.counts(self.only_general, 42)[1], 30, delta=0.1)
+        self.assertEqual(self.counts(self.not_general, 42)[1], 0)
+        self.state.vc.transition(42, FakeVoiceState(None))
+        self.assertAlmostEqual(self.counts(self.only_general, 42)[1], 30, delta=0.1)
+        self.assertEqual(self.counts(self.not_general, 42)[1], 0)
+        self.assertNotIn(42, self.state.stats.slots)
+
+    async def test_counts_are_saved_with_the_giveaway(self):
+        await main.on_message(FakeMessage(FakeUser(42, self.guild), self.general))
+        data = self.state.giveaways[self.only_general]
+        row = main.giveaway_row(self.only_general, data)
+        restored = main.ScopedActivity(self.only_general, data, main.json.loads(main.json.dumps(row['activity'])))
+        self.assertEqual(restored.messages, {42: 1})
+        self.assertNotIn('activity', main.giveaway_row(self.anywhere, self.state.giveaways[self.anywhere]))
+
+    def test_bonus_only_giveaway_shows_its_channels(self):
+        inputs = main.embed_inputs({'prize': 'p', 'end_time': 0, 'requirements': {'allow_channels': [310]},
+                                    'bonus': {'per_messages': 5}})
+        self.assertEqual(inputs['requirements'], [])
+        self.assertIn("• Only counted in <#310>", inputs['bonus'])
+
+
+@unittest.skipUnless(hasattr(time, 'tzset'), 'needs time.tzset')
+class ClockTests(unittest.IsolatedAsyncioTestCase):
+    """Giveaway times must not depend on the host's time zone."""
+    def setUp(self):
+        self.tz = os.environ.get('TZ')
+
+    def tearDown(self):
+        if self.tz is None:
+            os.environ.pop('TZ', None)
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+
+    def use_tz(self, tz):
+        os.environ['TZ'] = tz
+        time.tzset()
+
+    async def test_scheduler_fires_on_time_in_any_zone(self):
+        for tz in ('America/New_York', 'Asia/Tokyo'):
+            with self.subTest(tz=tz):
+                self.use_tz(tz)
+                fired = asyncio.get_running_loop().create_future()
+
+                async def callback(mid):
+                    fired.set_result(time.time())
+                scheduler = main.GiveawayScheduler(callback, 1)
+                scheduler.start()
+                due = time.time() + 0.1
+                scheduler.schedule('1', due)
+                at = await asyncio.wait_for(fired, 2)
+                self.assertGreaterEqual(at, due)
+                self.assertLess(at, due + 0.5)
+                scheduler._task.cancel()
+
+
+if __name__ == '__main__':
+    unittest.main()
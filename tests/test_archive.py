@@ -0,0 +1,93 @@
+"""Ended giveaways: archived snapshots, eviction and rerolls.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import load_bot_module
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+DAY = 86400
+
+
+class ArchiveTests(unittest.IsolatedAsyncioTestCase):
+    guild_id = 750000000000000000
+
+    async def asyncSetUp(self):
+        self.real = main.persistence, main.ARCHIVE_MAX_BYTES, main.ARCHIVE_MAX_DAYS
+        self.backend = main.SqliteBackend(os.path.join(tempfile.mkdtemp(prefix='archive-'), 'bot.db'))
+        self.addCleanup(self.backend.conn.close)
+        main.persistence = main.WriteBehindStore(self.backend)
+        self.state = main.state_for(self.guild_id)
+
+    async def asyncTearDown(self):
+        main.persistence, main.ARCHIVE_MAX_BYTES, main.ARCHIVE_MAX_DAYS = self.real
+        main.guild_states.pop(self.guild_id, None)
+
+    def archive(self, mid, entrants=10, winners=(1,)):
+        data = {'guild_id': self.guild_id, 'prize': f'Prize {mid}', 'giveaway_id': f'a{mid}', 'winners': 1}
+        main.archive_giveaway(str(mid), data, winners, array('Q', range(1, entrants + 1)))
+        return self.state.archive[str(mid)]
+
+    def stored(self):
+        return sorted(str(mid) for mid, in self.backend.conn.execute('SELECT message_id FROM archive'))
+
+    async def test_old_snapshots_are_pruned(self):
+        old, recent = self.archive(1), self.archive(2)
+        old['ended_at'] -= 8 * DAY
+        recent['ended_at'] -= DAY
+        await main.persistence.flush()
+        self.assertEqual(self.stored(), ['1', '2'])
+        main.prune_archive(self.state)
+        self.assertEqual(list(self.state.archive), ['2'])
+        self.assertIsNone(self.state.archive_lookup.resolve('a1'))
+        self.assertEqual(self.state.archive_bytes, 10 * 8)
+        await main.persistence.flush()
+        self.assertEqual(self.stored(), ['2'])
+        main.ARCHIVE_MAX_DAYS = 0.5
+        main.prune_archive(self.state)
+        self.assertEqual((self.state.archive, self.state.archive_bytes), ({}, 0))
+
+    async def test_byte_budget_evicts_the_oldest(self):
+        main.ARCHIVE_MAX_BYTES = 250
+        for mid in range(1, 4):
+            self.archive(mid)
+        # 3 x 80 bytes fit; a fourth pushes the oldest out
+        self.assertEqual(list(self.state.archive), ['1', '2', '3'])
+        self.archive(4)
+        self.assertEqual(list(self.state.archive), ['2', '3', '4'])
+        self.assertEqual(self.state.archive_bytes, 240)
+        # The newest snapshot stays even when it alone is over the budget
+        self.archive(5, entrants=100)
+        self.assertEqual(list(self.state.archive), ['5'])
+        self.assertEqual(self.state.archive_bytes, 800)
+        await main.persistence.flush()
+        self.assertEqual(self.stored(), ['5'])
+
+    async def test_reloaded_archive_is_oldest_first(self):
+        self.archive(1)['weights'] = array('H', [1] * 9 + [5])
+        self.archive(2, entrants=3)['ended_at'] -= 60
+        await main.persistence.flush()
+        reloaded = main.GuildState(self.guild_id)
+        self.assertEqual(list(reloaded.archive), ['2', '1'])
+        self.assertEqual(reloaded.archive_bytes, 3 * 8 + 10 * 8 + 10 * 2)
+        self.assertEqual(list(reloaded.archive['1']['weights']), [1] * 9 + [5])
+        self.assertEqual(reloaded.archive_lookup.resolve('a2'), '2')
+
+    async def test_rerolls_skip_every_earlier_winner(self):
+        mid = '1'
+        self.archive(mid, entrants=5, winners=(1, 2))
+        picked = [main.reroll_archived(self.state, mid)[0] for _ in range(3)]
+        self.assertEqual(sorted(picked), [3, 4, 5])
+        self.assertEqual(main.reroll_archived(self.state, mid), [])
+        self.assertEqual(self.state.archive[mid]['winner_ids'], [1, 2, *picked])
+
+
+if __name__ == '__main__':
+    unittest.main()
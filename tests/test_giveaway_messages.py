@@ -0,0 +1,50 @@
+"""Cached embed inputs of giveaway posts.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import load_bot_module
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+MID = '950000000000000001'
+
+
+class MessageEditTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.inputs = main.embed_inputs({'prize': 'Nitro', 'end_time': time.time() + 60, 'giveaway_id': 'ab12cd',
+                                         'requirements': {}, 'host_id': 1})
+        main.giveaway_messages.remember(MID, self.inputs)
+        self.addCleanup(main.giveaway_messages.invalidate, MID)
+
+    async def edit(self, **data):
+        await main.on_raw_message_edit(SimpleNamespace(message_id=int(MID), data=data))
+
+    async def test_own_edit_keeps_the_inputs(self):
+        self.inputs['prize'] = 'Nitro Classic'
+        await self.edit(embeds=[main.render_giveaway(self.inputs).to_dict()])
+        self.assertIs(main.giveaway_messages.entries.get(MID), self.inputs)
+
+    async def test_update_without_embeds_keeps_the_inputs(self):
+        await self.edit(flags=0)
+        self.assertIn(MID, main.giveaway_messages.entries)
+
+    async def test_other_edit_drops_the_inputs(self):
+        embed = main.render_giveaway(dict(self.inputs, prize='Something else'))
+        await self.edit(embeds=[embed.to_dict()])
+        self.assertNotIn(MID, main.giveaway_messages.entries)
+
+    async def test_suppressed_embeds_drop_the_inputs(self):
+        await self.edit(embeds=[])
+        self.assertNotIn(MID, main.giveaway_messages.entries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+"""Giveaway-ending claims: exclusive, expiring, and safe across restarts.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import FakeChannel, FakeGuild, FakeUser, load_bot_module, make_giveaway
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+
+class LeaseStoreTests(unittest.IsolatedAsyncioTestCase):
+    def store(self, worker='w1', ttl=60):
+        return main.LeaseStore(self.path, worker, ttl)
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(prefix='leases-'), 'leases.db')
+
+    async def test_held_claim_is_refused_to_everyone(self):
+        a, b = self.store('a'), self.store('b')
+        self.assertTrue(await a.claim('end:1'))
+        self.assertFalse(await a.claim('end:1'))
+        self.assertFalse(await b.claim('end:1'))
+
+    async def test_expired_claim_can_be_taken(self):
+        a, b = self.store('a', ttl=0.05), self.store('b')
+        self.assertTrue(await a.claim('end:1'))
+        await asyncio.sleep(0.1)
+        self.assertTrue(await b.claim('end:1'))
+
+    async def test_completed_claim_stays_taken(self):
+        a, b = self.store('a', ttl=0.05), self.store('b')
+        self.assertTrue(await a.claim('end:1'))
+        await a.complete('end:1')
+        await asyncio.sleep(0.1)
+        self.assertFalse(await b.claim('end:1'))
+        self.assertTrue(await b.completed('end:1'))
+
+    async def test_restart_drops_open_claims_of_the_same_worker(self):
+        before = self.store('fixed')
+        self.assertTrue(await before.claim('end:1'))
+        self.assertTrue(await before.claim('end:2'))
+        await before.complete('end:2')
+        after = self.store('fixed')
+        self.assertTrue(await after.claim('end:1'))
+        self.assertFalse(await after.claim('end:2'))
+
+    async def test_only_holders_are_waited_for(self):
+        a, b = self.store('a'), self.store('b')
+        await a.heartbeat()
+        await b.heartbeat()
+        await a.heartbeat()
+        self.assertEqual(a.live_workers, ['a', 'b'])
+        keys = [str(i) for i in range(20)]
+        # Before b holds anything, a never defers to it
+        self.assertTrue(all([await a.prefers_held(key) for key in keys]))
+        for key in keys:
+            a.hold(key, 1, 0.0)
+            b.hold(key, 1, 0.0)
+        await a.heartbeat()
+        await b.heartbeat()
+        preferred = [await a.prefers_held(key) for key in keys]
+        self.assertEqual(preferred, [a.prefers(key) for key in keys])
+        self.assertEqual(preferred, [not await b.prefers_held(key) for key in keys])
+
+    async def test_giveaways_held_elsewhere_are_unheld_here(self):
+        a, b = self.store('a'), self.store('b')
+        a.hold('1', 10, 0.0)
+        a.hold('2', 10, 0.0)
+        await a.heartbeat()
+        await b.heartbeat()
+        self.assertEqual(sorted(b.unheld), [('1', 10), ('2', 10)])
+        b.hold('1', 10, 0.0)
+        a.drop('2')
+        await a.heartbeat()
+        await b.heartbeat()
+        self.assertEqual(b.unheld, [])
+        self.assertTrue(await a.claim('end:1'))
+        await a.complete('end:1')
+        await a.heartbeat()
+        self.assertEqual(await a._run(a._holders, '1'), set())
+
+
+class AdoptionTests(unittest.IsolatedAsyncioTestCase):
+    """Giveaways created by another process after this one loaded its guilds."""
+    async def asyncSetUp(self):
+        self.guild = FakeGuild(790000000000000000)
+        self.channel = FakeChannel(410, self.guild)
+        self.state = main.state_for(self.guild.id)
+        self.mid = '980000000000000001'
+        self.real = main.STORAGE_BACKEND, main.persistence
+        backend = main.SqliteBackend(os.path.join(tempfile.mkdtemp(prefix='adopt-'), 'giveaway_bot.db'))
+        main.STORAGE_BACKEND, main.persistence = 'sqlite', main.WriteBehindStore(backend)
+        backend.write(self.state.giveaways_key, {self.mid: {
+            'channel_id': 410, 'prize': 'Nitro', 'end_time': main.time.time() + 60, 'requirements': {},
+            'image_url': None, 'message_id': int(self.mid), 'host_id': 1, 'giveaway_id': 'zz0001',
+            'emoji': '🎉', 'winners': 1, 'start_time': 0, 'ended': False, 'entrants': main.pack_ids([5, 6])}},
+            [], False)
+
+    async def asyncTearDown(self):
+        main.remove_giveaway(self.mid)
+        main.leases.unheld = []
+        main.STORAGE_BACKEND, main.persistence = self.real
+        main.guild_states.pop(self.guild.id, None)
+
+    async def test_unheld_giveaway_is_loaded_and_scheduled(self):
+        main.leases.unheld = [(self.mid, self.guild.id), ('980000000000000002', self.guild.id)]
+        with self.assertLogs(main.audit_logger, 'INFO') as logs:
+            main.adopt_unheld_giveaways()
+        self.assertEqual(logs.records[0].fields['message_ids'], [self.mid])
+        self.assertIs(main.giveaways[self.mid], self.state.giveaways[self.mid])
+        self.assertEqual(main.entrant_index[self.mid], {5, 6})
+        self.assertEqual(self.state.lookup.resolve('zz0001'), self.mid)
+        self.assertIn(self.mid, main.scheduler.live)
+        self.assertIn(self.mid, main.leases.holding)
+        # Already here: nothing more to adopt
+        main.adopt_unheld_giveaways()
+        self.assertEqual(len(self.state.giveaways), 1)
+
+
+class EndRetryTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.guild = FakeGuild(770000000000000001)
+        self.channel = FakeChannel(401, self.guild)
+        main.bot.get_channel = {self.channel.id: self.channel}.get
+        self.mid = make_giveaway(main, 970000000000000010, self.channel, {}, [1, 2, 3])
+
+    async def asyncTearDown(self):
+        main.remove_giveaway(self.mid)
+        main.scheduler.cancel(self.mid)
+        main.guild_states.pop(self.guild.id, None)
+
+    async def test_failed_ending_is_retried_with_backoff(self):
+        real = main.entrant_snapshot
+
+        async def failing(*args):
+            raise ConnectionError('gateway hiccup')
+        main.entrant_snapshot = failing
+        try:
+            due = []
+            for _ in range(12):
+                with self.assertLogs(main.audit_logger, 'ERROR'):
+                    await main.end_giveaway_instant(self.mid, '🎉', {})
+                seq = main.scheduler.live[self.mid]
+                due.append(next(at for at, s, _ in main.scheduler.heap if s == seq) - main.time.time())
+        finally:
+            main.entrant_snapshot = real
+        self.assertAlmostEqual(due[0], main.END_RETRY_SECONDS, delta=0.5)
+        self.assertAlmostEqual(due[1], 2 * main.END_RETRY_SECONDS, delta=0.5)
+        self.assertAlmostEqual(due[-1], main.END_RETRY_MAX, delta=0.5)
+        # Nothing is held over: the next attempt can end it
+        await main.end_giveaway_instant(self.mid, '🎉', {})
+        self.assertEqual(self.channel.replies, 1)
+        self.assertNotIn(self.mid, main.giveaways)
+        self.assertNotIn(self.mid, main.end_failures)
+
+
+class ForceWinnerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.guild = FakeGuild(770000000000000000)
+        self.channel = FakeChannel(400, self.guild)
+        main.bot.get_channel = {self.channel.id: self.channel}.get
+        self.state = main.state_for(self.guild.id)
+
+    async def test_set_while_ending_announces_once(self):
+        for i, first in enumerate(('ending', 'set')):
+            with self.subTest(first=first):
+                self.channel.replies = 0
+                mid = make_giveaway(main, 970000000000000000 + i, self.channel, {}, [1, 2, 3])
+                ending = main.end_giveaway_instant(mid, '🎉', {})
+                forced = main.force_winner(self.state, mid, FakeUser(2, self.guild))
+                results = await asyncio.gather(*((ending, forced) if first == 'ending' else (forced, ending)))
+                self.assertEqual(self.channel.replies, 1)
+                self.assertNotIn(mid, main.giveaways)
+                if first == 'ending':
+                    self.assertIn("already ending", results[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Finding giveaways by short ID, message ID prefix or prize.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import FakeChannel, FakeGuild, load_bot_module, make_giveaway
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+
+class GiveawayIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.index = main.GiveawayIndex()
+        self.index.add('930000000000000001', {'giveaway_id': 'ab12cd', 'prize': 'Nitro Classic'})
+        self.index.add('930000000000000002', {'giveaway_id': 'ef34gh', 'prize': 'Steam Gift Card'})
+        self.index.add('931000000000000003', {'giveaway_id': 'ab99zz', 'prize': 'Nitro'})
+
+    def test_search_by_any_term_prefix(self):
+        self.assertEqual(self.index.search('nitro'), ['930000000000000001', '931000000000000003'])
+        self.assertEqual(self.index.search('Nitro Cl'), ['930000000000000001'])
+        self.assertEqual(self.index.search('card'), ['930000000000000002'])
+        self.assertEqual(self.index.search('AB'), ['930000000000000001', '931000000000000003'])
+        self.assertEqual(self.index.search('931'), ['931000000000000003'])
+        self.assertEqual(self.index.search('nitro', limit=1), ['930000000000000001'])
+        self.assertEqual(len(self.index.search('')), 3)
+        self.assertEqual(self.index.search('xyz'), [])
+
+    def test_resolve(self):
+        self.assertEqual(self.index.resolve('930000000000000002'), '930000000000000002')
+        self.assertEqual(self.index.resolve('ef34gh'), '930000000000000002')
+        self.assertEqual(self.index.resolve('9310'), '931000000000000003')
+        self.assertIsNone(self.index.resolve('nitro'))
+        self.assertIsNone(self.index.resolve(''))
+
+    def test_edit_and_discard(self):
+        self.index.add('930000000000000001', {'giveaway_id': 'ab12cd', 'prize': 'Steam Key'})
+        self.assertEqual(self.index.search('nitro'), ['931000000000000003'])
+        self.assertEqual(self.index.search('steam'), ['930000000000000001', '930000000000000002'])
+        self.index.discard('930000000000000002')
+        self.assertEqual(self.index.search('steam'), ['930000000000000001'])
+        self.assertIsNone(self.index.resolve('ef34gh'))
+        self.assertEqual(len(self.index.keys), sum(len(terms) for _, terms in self.index.entries.values()))
+
+
+class FindGiveawayTests(unittest.TestCase):
+    def setUp(self):
+        self.guild = FakeGuild(740000000000000000)
+        self.mid = make_giveaway(main, 932000000000123456, FakeChannel(330, self.guild), {}, [])
+
+    def tearDown(self):
+        main.remove_giveaway(self.mid)
+        main.guild_states.pop(self.guild.id, None)
+
+    def test_by_message_or_short_id(self):
+        data = main.giveaways[self.mid]
+        self.assertEqual(main.find_giveaway(self.mid), (self.mid, data))
+        self.assertEqual(main.find_giveaway('123456'), (self.mid, data))
+        self.assertEqual(main.find_giveaway('12345'), (None, None))
+        main.remove_giveaway(self.mid)
+        self.assertEqual(main.find_giveaway('123456'), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
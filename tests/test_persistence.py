@@ -0,0 +1,258 @@
+"""Write-behind persistence: flush failures and health, and carrying data
+over from JSON files and older databases.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import FakeChannel, FakeGuild, FakeReactionPayload, load_bot_module, make_giveaway
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+# The tables as they were before guild partitioning
+UNPARTITIONED_SCHEMA = """
+    CREATE TABLE user_stats (user_id INTEGER PRIMARY KEY, messages INTEGER NOT NULL DEFAULT 0,
+                             vc_time REAL NOT NULL DEFAULT 0, name TEXT, extra TEXT);
+    CREATE TABLE giveaways (message_id INTEGER PRIMARY KEY, giveaway_id TEXT, channel_id INTEGER, host_id INTEGER,
+                            prize TEXT, end_time REAL, emoji TEXT, image_url TEXT,
+                            ended INTEGER NOT NULL DEFAULT 0, extra TEXT);
+    CREATE TABLE requirements (message_id INTEGER NOT NULL, kind TEXT NOT NULL, value TEXT,
+                               PRIMARY KEY (message_id, kind));
+    CREATE TABLE entrants (message_id INTEGER NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (message_id, user_id));
+"""
+UNPARTITIONED_VC_SESSIONS = """
+    CREATE TABLE vc_sessions (user_id INTEGER PRIMARY KEY, started REAL NOT NULL, counted INTEGER NOT NULL,
+                              channel_id INTEGER, checkpointed REAL);
+"""
+
+
+class FlakyBackend:
+    per_row = True
+
+    def __init__(self):
+        self.failing = 0
+        self.written = []
+
+    def write(self, name, rows, deleted, full):
+        if self.failing:
+            self.failing -= 1
+            raise OSError('disk full')
+        self.written.append((name, dict(rows), list(deleted)))
+
+
+class FlushHealthTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.backend = FlakyBackend()
+        self.store = main.WriteBehindStore(self.backend)
+        self.data = {'1': {'messages': 1}}
+        self.store.register('stats', lambda: self.data)
+        self.real = main.persistence
+        main.persistence = self.store
+
+    async def asyncTearDown(self):
+        main.persistence = self.real
+
+    def persistence_ok(self):
+        return main.health_report()[1]['persistence_ok']
+
+    async def test_transient_failure_recovers(self):
+        self.backend.failing = 1
+        self.store.mark_dirty('stats', '1')
+        await self.store.flush()
+        self.assertEqual((self.store.failures, self.store.failed_in_a_row), (1, 1))
+        self.assertTrue(self.persistence_ok())
+        await self.store.flush()
+        self.assertEqual(self.backend.written, [('stats', {'1': {'messages': 1}}, [])])
+        # Still dirty again on a busy bot, but the last flush worked
+        self.store.mark_dirty('stats', '1')
+        self.assertEqual((self.store.failures, self.store.failed_in_a_row), (1, 0))
+        self.assertTrue(self.persistence_ok())
+
+    async def test_repeated_failures_are_unhealthy_until_a_flush_works(self):
+        self.backend.failing = main.HEALTH_MAX_FLUSH_FAILURES
+        self.store.mark_dirty('stats', '1')
+        for _ in range(main.HEALTH_MAX_FLUSH_FAILURES):
+            await self.store.flush()
+        self.assertFalse(self.persistence_ok())
+        await self.store.flush()
+        self.assertTrue(self.persistence_ok())
+        self.assertFalse(self.store.dirty)
+
+
+class EntrantWriteTests(unittest.IsolatedAsyncioTestCase):
+    """Entrants are written as changes on SQLite and as whole sets on JSON."""
+    guild_id = 790000000000000000
+
+    def use_backend(self, backend):
+        if hasattr(backend, 'conn'):
+            self.addCleanup(backend.conn.close)
+        main.persistence = main.WriteBehindStore(backend)
+        main.guild_states.pop(self.guild_id, None)
+        self.guild = FakeGuild(self.guild_id)
+        self.channel = FakeChannel(500, self.guild)
+        self.state = main.state_for(self.guild_id)
+
+    async def asyncSetUp(self):
+        self.real = main.persistence
+        self.dir = tempfile.mkdtemp(prefix='entrants-')
+
+    async def asyncTearDown(self):
+        for mid in list(self.state.giveaways):
+            main.remove_giveaway(mid)
+        main.guild_states.pop(self.guild_id, None)
+        main.persistence = self.real
+
+    def react(self, mid, uid, added=True):
+        main.track_entrant(FakeReactionPayload(int(mid), uid, '🎉', self.guild_id), added)
+
+    def stored(self, backend, mid):
+        return sorted(uid for uid, in backend.conn.execute(
+            'SELECT user_id FROM entrants WHERE message_id = ?', (int(mid),)))
+
+    async def test_one_reaction_writes_one_row(self):
+        backend = main.SqliteBackend(os.path.join(self.dir, 'bot.db'))
+        self.use_backend(backend)
+        mid = make_giveaway(main, 980000000000000000, self.channel, {}, range(1, 50001))
+        await main.persistence.flush()
+        self.assertEqual(len(self.stored(backend, mid)), 50000)
+
+        before = backend.conn.total_changes
+        self.react(mid, 50001)
+        await main.persistence.flush()
+        # The giveaway row, its requirement rows and one entrant
+        self.assertLess(backend.conn.total_changes - before, 5)
+        self.assertEqual(len(self.stored(backend, mid)), 50001)
+
+    async def test_changes_replay_to_the_live_set(self):
+        backend = main.SqliteBackend(os.path.join(self.dir, 'bot.db'))
+        self.use_backend(backend)
+        mid = make_giveaway(main, 980000000000000001, self.channel, {}, [1, 2, 3])
+        await main.persistence.flush()
+        self.react(mid, 4)
+        self.react(mid, 2, False)
+        self.react(mid, 5)
+        self.react(mid, 5, False)
+        await main.persistence.flush()
+        self.assertEqual(self.stored(backend, mid), [1, 3, 4])
+
+        # A full rewrite of the partition keeps the stored entrants
+        main.persistence.mark_dirty(self.state.giveaways_key)
+        await main.persistence.flush()
+        self.assertEqual(self.stored(backend, mid), [1, 3, 4])
+
+        main.replace_entrants(mid, {7, 8})
+        main.mark_giveaway_dirty(mid)
+        await main.persistence.flush()
+        self.assertEqual(self.stored(backend, mid), [7, 8])
+
+    async def test_failed_flush_rewrites_the_set(self):
+        backend = main.SqliteBackend(os.path.join(self.dir, 'bot.db'))
+        self.use_backend(backend)
+        mid = make_giveaway(main, 980000000000000002, self.channel, {}, [1, 2])
+        await main.persistence.flush()
+        self.react(mid, 3)
+        write = backend.write
+
+        def fail(*args):
+            raise OSError('disk full')
+        backend.write = fail
+        await main.persistence.flush()
+        backend.write = write
+        self.react(mid, 4)
+        await main.persistence.flush()
+        self.assertEqual(self.stored(backend, mid), [1, 2, 3, 4])
+
+    async def test_json_stores_the_packed_set(self):
+        self.use_backend(main.JsonBackend())
+        mid = make_giveaway(main, 980000000000000003, self.channel, {}, [3, 1, 2])
+        self.react(mid, 1, False)
+        await main.persistence.flush()
+        saved = main.load_json(main.JsonBackend.path(self.state.giveaways_key))
+        self.assertEqual(list(main.unpack_ids(saved[mid]['entrants'])), [2, 3])
+
+
+class MigrationTests(unittest.TestCase):
+    """JSON files and unpartitioned databases are carried over into SQLite once."""
+    giveaway = {'channel_id': 7, 'prize': 'Nitro', 'end_time': 1000.0, 'requirements': {'min_messages': 2},
+                'image_url': None, 'message_id': 950000000000000001, 'host_id': 1, 'giveaway_id': 'ab12cd',
+                'emoji': '🎉', 'winners': 2, 'start_time': 500.0, 'ended': False}
+
+    def setUp(self):
+        # Backends read their files relative to the working directory
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tempfile.mkdtemp(prefix='migrate-'))
+
+    def open(self, path=main.DB_FILE):
+        backend = main.SqliteBackend(path)
+        self.addCleanup(backend.conn.close)
+        return backend
+
+    def events(self, logs):
+        return [record.getMessage() for record in logs.records]
+
+    def test_legacy_and_per_guild_files_are_imported_once(self):
+        legacy, guild = main.LEGACY_GUILD, 123
+        main.save_json(main.STATS_FILE, {'42': {'messages': 3, 'vc_time': 1.5, 'name': 'a', 'last_seen': 9}})
+        main.save_json(main.GIVEAWAY_FILE, {'950000000000000001': {**self.giveaway, 'entrants': main.pack_ids([6, 5])}})
+        main.save_json(main.VC_SESSIONS_FILE, {'42': [100.0, True, 7, 150.0]})
+        os.makedirs(os.path.join(main.DATA_DIR, str(guild)))
+        main.save_json(main.JsonBackend.path((main.STATS_FILE, guild)), {'43': {'messages': 1, 'vc_time': 0, 'name': 'b'}})
+        with self.assertLogs(main.audit_logger, 'INFO') as logs:
+            backend = self.open()
+        self.assertEqual(self.events(logs), ['json_migrated'] * 4)
+        self.assertEqual(backend.partitions(), {legacy, guild})
+        self.assertEqual(backend.load((main.STATS_FILE, legacy)),
+                         {'42': {'messages': 3, 'vc_time': 1.5, 'name': 'a', 'last_seen': 9}})
+        self.assertEqual(backend.load((main.STATS_FILE, guild)), {'43': {'messages': 1, 'vc_time': 0, 'name': 'b'}})
+        self.assertEqual(backend.load((main.VC_SESSIONS_FILE, legacy)), {'42': [100.0, True, 7, 150.0]})
+        stored = backend.load((main.GIVEAWAY_FILE, legacy))['950000000000000001']
+        self.assertEqual(list(main.unpack_ids(stored.pop('entrants'))), [5, 6])
+        self.assertEqual(stored, self.giveaway)
+        self.assertFalse(os.path.exists(main.STATS_FILE))
+        self.assertTrue(os.path.exists(main.STATS_FILE + '.migrated'))
+
+        # A file showing up again for a partition already in the database is left alone
+        main.save_json(main.STATS_FILE, {'44': {'messages': 1, 'vc_time': 0, 'name': 'c'}})
+        backend.conn.close()
+        self.assertEqual(list(self.open().load((main.STATS_FILE, legacy))), ['42'])
+        self.assertTrue(os.path.exists(main.STATS_FILE))
+
+    def test_unpartitioned_database_is_upgraded(self):
+        for has_vc in (True, False):
+            with self.subTest(has_vc=has_vc):
+                path = f'vc-{has_vc}.db'
+                conn = sqlite3.connect(path)
+                conn.executescript(UNPARTITIONED_SCHEMA + (UNPARTITIONED_VC_SESSIONS if has_vc else ''))
+                with conn:
+                    conn.execute("INSERT INTO user_stats VALUES (42, 3, 1.5, 'a', NULL)")
+                    conn.execute("INSERT INTO giveaways VALUES (950000000000000001, 'ab12cd', 7, 1, 'Nitro', 1000.0, "
+                                 "'🎉', NULL, 0, NULL)")
+                    conn.execute("INSERT INTO entrants VALUES (950000000000000001, 5)")
+                    if has_vc:
+                        conn.execute("INSERT INTO vc_sessions VALUES (42, 100.0, 1, 7, 150.0)")
+                conn.close()
+                with self.assertLogs(main.audit_logger, 'INFO') as logs:
+                    backend = self.open(path)
+                self.assertEqual(self.events(logs), ['database_upgraded'])
+                legacy = main.LEGACY_GUILD
+                self.assertEqual(backend.partitions(), {legacy})
+                self.assertEqual(backend.load((main.STATS_FILE, legacy)), {'42': {'messages': 3, 'vc_time': 1.5, 'name': 'a'}})
+                self.assertEqual(backend.load((main.VC_SESSIONS_FILE, legacy)),
+                                 {'42': [100.0, True, 7, 150.0]} if has_vc else {})
+                stored = backend.load((main.GIVEAWAY_FILE, legacy))['950000000000000001']
+                self.assertEqual((stored['prize'], list(main.unpack_ids(stored['entrants']))), ('Nitro', [5]))
+                # The same user can now have stats in another guild
+                backend.write((main.STATS_FILE, 123), {'42': {'messages': 1, 'vc_time': 0, 'name': 'a'}}, [], False)
+                self.assertEqual(backend.load((main.STATS_FILE, legacy))['42']['messages'], 3)
+                backend.conn.close()
+                with self.assertNoLogs(main.audit_logger, 'INFO'):
+                    self.assertEqual(self.open(path).partitions(), {legacy, 123})
+
+
+if __name__ == '__main__':
+    unittest.main()
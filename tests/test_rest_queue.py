@@ -0,0 +1,147 @@
+"""RestQueue: lane ordering, channel backoff and 429 retries.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import load_bot_module
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+
+async def now():
+    return time.monotonic()
+
+
+def rate_limited(retry_after=0.01):
+    e = main.discord.HTTPException(SimpleNamespace(status=429, reason='Too Many Requests'), 'rate limited')
+    e.retry_after = retry_after
+    return e
+
+
+class RestQueueTests(unittest.IsolatedAsyncioTestCase):
+    def queue(self, concurrency=8, per_channel=2, rate=1000):
+        return main.RestQueue(concurrency, per_channel, rate, max_backoff=1.0)
+
+    async def test_higher_priority_starts_first(self):
+        q = self.queue(concurrency=1)
+        gate = asyncio.Event()
+        order = []
+
+        async def record(name):
+            order.append(name)
+
+        blocker = asyncio.create_task(q.call(q.ANNOUNCE, 1, gate.wait))
+        await asyncio.sleep(0)
+        calls = [asyncio.create_task(q.call(priority, channel, record, name)) for priority, channel, name in (
+            (q.EDIT, 1, 'edit'), (q.FETCH, 2, 'fetch'), (q.ANNOUNCE, 3, 'announce-3'),
+            (q.ANNOUNCE, 1, 'announce-1'), (q.SYNC, 1, 'sync'),
+        )]
+        await asyncio.sleep(0)
+        gate.set()
+        await asyncio.wait_for(asyncio.gather(blocker, *calls), 2)
+        self.assertEqual(order, ['announce-3', 'announce-1', 'fetch', 'sync', 'edit'])
+
+    async def test_same_lane_keeps_submission_order(self):
+        q = self.queue(per_channel=1)
+        order = []
+
+        async def record(i):
+            order.append(i)
+        await asyncio.wait_for(asyncio.gather(*(q.call(q.ANNOUNCE, 1, record, i) for i in range(10))), 2)
+        self.assertEqual(order, list(range(10)))
+
+    async def test_per_channel_limit(self):
+        q = self.queue(per_channel=2)
+        peak = 0
+
+        async def work():
+            nonlocal peak
+            peak = max(peak, q.active.get(1, 0))
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(asyncio.gather(*(q.call(q.ANNOUNCE, 1, work) for _ in range(6))), 2)
+        self.assertEqual(peak, 2)
+        self.assertEqual(q.running, 0)
+
+    async def test_backoff_doubles_and_delays_the_channel(self):
+        q = self.queue()
+        q.backoff(1, 0.05)
+        q.backoff(1, 0.05)
+        self.assertEqual(q.strikes[1], 2)
+        self.assertGreater(q.cooldown[1] - time.monotonic(), 0.07)
+
+        start = time.monotonic()
+        other = await asyncio.wait_for(q.call(q.ANNOUNCE, 2, now), 1)
+        cooled = await asyncio.wait_for(q.call(q.ANNOUNCE, 1, now), 1)
+        self.assertLess(other - start, 0.05)
+        self.assertGreaterEqual(cooled - start, 0.08)
+        # A call started after the cooldown clears the strikes
+        self.assertNotIn(1, q.strikes)
+
+    async def test_backoff_is_capped(self):
+        q = self.queue()
+        for _ in range(10):
+            q.backoff(None, 0.5)
+        self.assertLessEqual(q.cooldown[None] - time.monotonic(), 1.0)
+
+    async def test_429_is_retried_after_the_cooldown(self):
+        q = self.queue()
+        lane = (1, 'POST')
+        attempts = []
+
+        async def send():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                # What the trace hook does before discord.py raises
+                q.observe(lane, 0, 0.05)
+                raise rate_limited()
+            return 'sent'
+        self.assertEqual(await asyncio.wait_for(q.call(q.ANNOUNCE, 1, send), 2), 'sent')
+        self.assertEqual(len(attempts), 2)
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.04)
+        self.assertEqual((q.running, len(q), q.active), (0, 0, {}))
+
+    async def test_429_without_observe_is_retried(self):
+        q = self.queue()
+        attempts = []
+
+        async def send():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise main.discord.RateLimited(0.01)
+            return 'sent'
+        self.assertEqual(await asyncio.wait_for(q.call(q.ANNOUNCE, 1, send), 2), 'sent')
+        self.assertEqual(len(attempts), 3)
+
+    async def test_429_gives_up_after_retries(self):
+        q = self.queue()
+        attempts = []
+
+        async def send():
+            attempts.append(1)
+            q.observe((1, 'POST'), 0, 0.01)
+            raise rate_limited()
+        with self.assertRaises(main.discord.HTTPException):
+            await asyncio.wait_for(q.call(q.ANNOUNCE, 1, send), 5)
+        self.assertEqual(len(attempts), 4)
+        self.assertEqual((q.running, len(q)), (0, 0))
+
+    async def test_errors_reach_the_caller(self):
+        q = self.queue()
+
+        async def fail():
+            raise ValueError('boom')
+        with self.assertRaises(ValueError):
+            await asyncio.wait_for(q.call(q.EDIT, 1, fail), 1)
+        self.assertEqual(q.running, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Winner draws: alias tables, distinct picks and replayable seeds.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import os
+import random
+import sys
+import tempfile
+import unittest
+from array import array
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import load_bot_module
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+DRAWS = 60000
+
+
+class AliasSamplerTests(unittest.TestCase):
+    def assertShares(self, counts, weights, total):
+        for item, weight in weights.items():
+            self.assertAlmostEqual(counts[item] / total, weight / sum(weights.values()), delta=0.01, msg=item)
+
+    def test_draws_are_proportional_to_weight(self):
+        weights = {10: 1, 20: 2, 30: 7, 40: 0}
+        sampler = main.AliasSampler(list(weights), list(weights.values()), random.Random(1))
+        counts = Counter(sampler.draw() for _ in range(DRAWS))
+        self.assertShares(counts, weights, DRAWS)
+        self.assertNotIn(40, counts)
+
+    def test_each_pick_is_proportional_among_the_rest(self):
+        # Two picks from weights 5/3/2: the pair {a, b} comes up with
+        # P(a) P(b | a gone) + P(b) P(a | b gone)
+        weights = {1: 5, 2: 3, 3: 2}
+        rng = random.Random(2)
+        sampler = main.AliasSampler(list(weights), list(weights.values()), rng)
+        pairs = Counter(frozenset(sampler.sample(2)) for _ in range(DRAWS))
+        total = sum(weights.values())
+        for a, b in ((1, 2), (1, 3), (2, 3)):
+            wa, wb = weights[a], weights[b]
+            expected = wa / total * wb / (total - wa) + wb / total * wa / (total - wb)
+            self.assertAlmostEqual(pairs[frozenset((a, b))] / DRAWS, expected, delta=0.01, msg=(a, b))
+
+    def test_winners_are_distinct(self):
+        rng = random.Random(3)
+        items = list(range(100))
+        for weights in ([1] * 100, [1000] + [1] * 99, [i + 1 for i in range(100)]):
+            sampler = main.AliasSampler(items, weights, rng)
+            for k in (1, 10, 99, 100):
+                picked = sampler.sample(k)
+                self.assertEqual(len(picked), k)
+                self.assertEqual(len(set(picked)), k)
+            self.assertEqual(sorted(sampler.sample(500)), items)
+
+    def test_excluded_entrants_are_never_picked(self):
+        rng = random.Random(4)
+        items = list(range(20))
+        # The heaviest entrants excluded, so the rebuild without them kicks in
+        sampler = main.AliasSampler(items, [100] * 5 + [1] * 15, rng)
+        for _ in range(200):
+            picked = sampler.sample(3, exclude=range(5))
+            self.assertEqual(len(set(picked)), 3)
+            self.assertTrue(all(p >= 5 for p in picked))
+
+    def test_every_entrant_excluded(self):
+        rng = random.Random(5)
+        self.assertEqual(main.AliasSampler([1, 2, 3], [1, 5, 1], rng).sample(2, exclude=[1, 2, 3]), [])
+        self.assertEqual(main.UniformSampler([1, 2, 3], rng).sample(2, exclude=[1, 2, 3]), [])
+        self.assertEqual(sorted(main.AliasSampler([1, 2, 3], [1, 5, 1], rng).sample(3, exclude=[2])), [1, 3])
+
+    def test_uniform_sampler(self):
+        rng = random.Random(6)
+        sampler = main.UniformSampler(list(range(4)), rng)
+        counts = Counter(sampler.draw() for _ in range(DRAWS))
+        self.assertShares(counts, {i: 1 for i in range(4)}, DRAWS)
+        picked = sampler.sample(3, exclude=[0])
+        self.assertEqual(sorted(picked), [1, 2, 3])
+
+
+class SampleSnapshotTests(unittest.TestCase):
+    def test_uniform_weighted_and_excluded(self):
+        eligible = array('Q', range(1, 51))
+        for weights in (None, array('H', [1] * 49 + [500])):
+            winners = main.sample_snapshot(eligible, weights, 5, random.Random(7))
+            self.assertEqual(len(set(winners)), 5)
+            self.assertTrue(set(winners) <= set(eligible))
+            rerolled = main.sample_snapshot(eligible, weights, 5, random.Random(8), exclude=winners)
+            self.assertFalse(set(rerolled) & set(winners))
+        self.assertIn(50, main.sample_snapshot(eligible, array('H', [1] * 49 + [60000]), 1, random.Random(9)))
+
+    def test_small_or_empty_snapshots(self):
+        rng = random.Random(10)
+        self.assertEqual(main.sample_snapshot(array('Q'), None, 3, rng), [])
+        self.assertEqual(main.sample_snapshot(array('Q'), array('H'), 3, rng), [])
+        self.assertEqual(sorted(main.sample_snapshot(array('Q', [7, 8]), None, 3, rng)), [7, 8])
+        self.assertEqual(main.sample_snapshot(array('Q', [7, 8]), array('H', [1, 2]), 3, rng, exclude=[7, 8]), [])
+
+    def test_draws_replay_from_the_record(self):
+        eligible = array('Q', range(1, 1001))
+        weights = array('H', (i % 7 + 1 for i in range(1000)))
+        first, second = {'seed': 'abc'}, {'seed': 'abc'}
+        for _ in range(3):
+            a = main.sample_snapshot(eligible, weights, 3, main.draw_rng('1', first))
+            b = main.sample_snapshot(eligible, weights, 3, main.draw_rng('1', second))
+            self.assertEqual(a, b)
+        self.assertEqual(first['draws'], 3)
+        other = main.sample_snapshot(eligible, weights, 3, main.draw_rng('1', {'seed': 'abd'}))
+        self.assertNotEqual(other, main.sample_snapshot(eligible, weights, 3, main.draw_rng('1', {'seed': 'abc'})))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+"""Giveaway setup: the channel picker and the drafts it starts.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import FakeChannel, FakeGuild, FakeInteraction, FakeUser, load_bot_module
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+
+class SetupSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.sessions = main.SetupSessions(60, 3)
+
+    def expire(self, user_id):
+        self.sessions.sessions[user_id][0] = time.monotonic() - 1
+
+    def test_least_recently_used_is_evicted(self):
+        for uid in (1, 2, 3):
+            self.sessions[uid] = {'prize': uid}
+        self.assertEqual(self.sessions[1], {'prize': 1})
+        self.sessions[4] = {'prize': 4}
+        self.assertEqual(list(self.sessions.sessions), [3, 1, 4])
+        self.assertNotIn(2, self.sessions)
+        self.assertEqual((self.sessions.evicted, self.sessions.expired), (1, 0))
+
+    def test_expired_drafts_are_gone(self):
+        self.sessions[1] = {'prize': 1}
+        self.sessions.await_image(1, 'followup', 99)
+        self.expire(1)
+        self.assertIsNone(self.sessions.get(1))
+        self.assertEqual(self.sessions.awaiting_image, {})
+        self.assertEqual((len(self.sessions), self.sessions.expired), (0, 1))
+        with self.assertRaises(KeyError):
+            self.sessions[1]
+        with self.assertRaises(KeyError):
+            del self.sessions[1]
+
+    def test_new_draft_prunes_expired_ones_under_the_limit(self):
+        self.sessions[1] = {}
+        self.sessions[2] = {}
+        self.expire(1)
+        self.sessions[3] = {}
+        self.assertEqual(list(self.sessions.sessions), [2, 3])
+        self.assertEqual((self.sessions.evicted, self.sessions.expired), (0, 1))
+
+    def test_touching_a_draft_extends_it(self):
+        self.sessions[1] = {}
+        before = self.sessions.sessions[1][0]
+        time.sleep(0.01)
+        self.sessions.get(1)
+        self.assertGreater(self.sessions.sessions[1][0], before)
+        self.assertEqual(self.sessions.pop(1), {})
+        self.assertIsNone(self.sessions.pop(1))
+
+
+class ChannelPickerTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.guild = FakeGuild(730000000000000000)
+        # Every 8th channel is closed to the bot
+        self.guild.text_channels = [FakeChannel(900 + i, self.guild) for i in range(60)]
+        self.guild.text_channels[1].name = 'Giveaways'
+        self.user = FakeUser(42, self.guild)
+
+    async def asyncTearDown(self):
+        main.guild_states.pop(self.guild.id, None)
+
+    async def test_index_is_cached_until_invalidated(self):
+        channels = main.postable_channels(self.guild)
+        self.assertEqual(len(channels), 53)
+        self.assertNotIn(904, [cid for cid, _, _ in channels])
+        self.assertEqual(channels[1], (901, 'Giveaways', 'giveaways'))
+        self.guild.text_channels.append(FakeChannel(1001, self.guild))
+        self.assertIs(main.postable_channels(self.guild), channels)
+        await main.on_guild_channel_create(self.guild.text_channels[-1])
+        self.assertEqual(len(main.postable_channels(self.guild)), 54)
+
+    async def test_pages_and_search(self):
+        view = main.ChannelSelectView(main.postable_channels(self.guild))
+        self.assertEqual(view.pages, 3)
+        self.assertEqual(len(view.select_channel.options), main.PICKER_PAGE_SIZE)
+        self.assertTrue(view.prev_page.disabled)
+        interaction = FakeInteraction(self.user, self.guild)
+        for _ in range(3):
+            await view.next_page.callback(interaction)
+        self.assertEqual(view.page, 2)
+        self.assertEqual(len(view.select_channel.options), 3)
+        self.assertTrue(view.next_page.disabled)
+        self.assertEqual(interaction.response.sent[-1][1], "Select a channel (53 channels, page 3/3):")
+
+        view.search(' #GIVE ')
+        self.assertEqual((view.page, [o.value for o in view.select_channel.options]), (0, ['901']))
+        self.assertIn("matching `give`", view.content())
+        view.search('nothing')
+        self.assertTrue(view.select_channel.disabled)
+        self.assertEqual(view.select_channel.options[0].label, "No matching channels")
+        self.assertEqual(view.content(), "Select a channel (0 channels matching `nothing`, page 1/1):")
+
+    async def test_picking_a_channel_starts_a_draft(self):
+        view = main.ChannelSelectView(main.postable_channels(self.guild))
+        interaction = FakeInteraction(self.user, self.guild)
+        view.select_channel._refresh_state(interaction, {'values': ['901']})
+        await view.select_channel.callback(interaction)
+        draft = main.state_for(self.guild.id).setups[42]
+        self.assertEqual(draft['channel'].id, 901)
+        kind, content, kwargs = interaction.response.sent[0]
+        self.assertEqual(kind, 'edit_message')
+        self.assertIn(draft['giveaway_id'], content)
+        self.assertIsInstance(kwargs['view'], main.GiveawaySetupView)
+
+        # Deleted since the picker opened
+        view.select_channel._refresh_state(interaction, {'values': ['1001']})
+        await view.select_channel.callback(interaction)
+        self.assertEqual(interaction.response.sent[-1][1], "That channel no longer exists.")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""Slow callbacks are timed through discord.py's public hooks.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import os
+import sys
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import load_bot_module
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+
+class SlowCallbackTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.threshold = main.slow_callbacks.threshold
+        main.slow_callbacks.threshold = 0
+        main.slow_callbacks.recent.clear()
+
+    def tearDown(self):
+        main.slow_callbacks.threshold = self.threshold
+
+    def recorded(self):
+        return [(kind, name) for _, kind, name, _ in main.slow_callbacks.recent]
+
+    async def test_events_are_timed(self):
+        with self.assertLogs(main.audit_logger, 'WARNING'):
+            await main.on_raw_message_delete(SimpleNamespace(message_id=1))
+        self.assertEqual(self.recorded(), [('event', 'on_raw_message_delete')])
+
+    async def test_view_callbacks_are_timed_once(self):
+        view = main.TimedView(timeout=None)
+        button = main.Button(label='x')
+        calls = []
+
+        async def clicked(interaction):
+            calls.append(interaction)
+        button.callback = clicked
+        view.add_item(button)
+        view.remove_item(button)
+        view.add_item(button)
+        with self.assertLogs(main.audit_logger, 'WARNING'):
+            await button.callback('interaction')
+        self.assertEqual(calls, ['interaction'])
+        self.assertEqual(len(self.recorded()), 1)
+        self.assertEqual(self.recorded()[0][0], 'view')
+        decorated = main.GiveawayMainView()
+        self.assertTrue(all(item.callback.slow_timed for item in decorated.children))
+
+    def test_modals_and_commands_are_wrapped(self):
+        self.assertTrue(main.PrizeModal.on_submit.slow_timed)
+        self.assertTrue(main.slash_set.callback.slow_timed)
+        self.assertTrue(main.running_autocomplete.slow_timed)
+
+
+if __name__ == '__main__':
+    unittest.main()
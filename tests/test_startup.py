@@ -0,0 +1,100 @@
+"""Nothing loads a guild's stats in one go before warm_stats gets to them.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import FakeChannel, FakeGuild, FakeMessage, FakeUser, FakeVoiceState, load_bot_module, make_giveaway
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+
+class StatsLoadingTests(unittest.TestCase):
+    def setUp(self):
+        self.loaded = main.state_for(780000000000000001)
+        self.cold = main.state_for(780000000000000002)
+        self.addCleanup(main.guild_states.pop, self.loaded.guild_id, None)
+        self.addCleanup(main.guild_states.pop, self.cold.guild_id, None)
+        slot = self.loaded.stats.slot(42)
+        self.loaded.stats.messages[slot] = 7
+
+    def test_user_stats_skip_guilds_still_loading(self):
+        body = json.loads(main.user_stats_body(42, [self.loaded, self.cold]))
+        self.assertFalse(self.cold.stats_loaded)
+        self.assertEqual(body['messages'], 7)
+        self.assertEqual(list(body['guilds']), [str(self.loaded.guild_id)])
+        self.assertEqual(body['loading'], [str(self.cold.guild_id)])
+        self.assertNotIn('loading', json.loads(main.user_stats_body(42, [self.loaded])))
+
+    def test_legacy_adoption_leaves_stats_to_warm_up(self):
+        legacy = main.state_for(main.LEGACY_GUILD)
+        self.addCleanup(main.guild_states.pop, main.LEGACY_GUILD, None)
+        main.adopt_legacy_state()
+        self.assertFalse(legacy.stats_loaded)
+
+    def test_legacy_stats_left_behind_are_audited(self):
+        legacy = main.state_for(main.LEGACY_GUILD)
+        self.addCleanup(main.guild_states.pop, main.LEGACY_GUILD, None)
+        legacy.stats.slot(42)
+        with self.assertLogs(main.audit_logger, 'WARNING') as logs:
+            main.adopt_legacy_stats()
+        self.assertEqual(logs.records[0].getMessage(), 'legacy_stats_left')
+        self.assertEqual(logs.records[0].fields, {'users': 1, 'guild_id': main.LEGACY_GUILD})
+
+
+class BufferedActivityTests(unittest.IsolatedAsyncioTestCase):
+    """Activity during warm-up waits for the stats instead of loading them."""
+    async def asyncSetUp(self):
+        self.guild = FakeGuild(780000000000000003)
+        self.text, self.voice = FakeChannel(320, self.guild), FakeChannel(321, self.guild)
+        self.state = main.state_for(self.guild.id)
+        self.mid = make_giveaway(main, 980000000000000010, self.text, {'min_messages': 1, 'min_vc_minutes': 1}, [])
+        main.refresh_activity_epochs(self.state)
+
+    async def asyncTearDown(self):
+        main.remove_giveaway(self.mid)
+        main.guild_states.pop(self.guild.id, None)
+
+    async def test_counts_apply_once_loaded(self):
+        user = FakeUser(42, self.guild)
+        await main.on_message(FakeMessage(user, self.text))
+        await main.on_message(FakeMessage(user, self.text))
+        self.state.vc.transition(42, FakeVoiceState(self.voice), main.time.time() - 120)
+        self.state.vc.transition(42, FakeVoiceState(None))
+        self.state.vc.restored = {'43': [main.time.time() - 600, True, 321, main.time.time() - 300]}
+        self.state.vc.restore()
+        self.assertFalse(self.state.stats_loaded)
+        await main.warm_stats()
+        since = self.state.giveaways[self.mid]['start_time']
+        messages, minutes = main.activity_since(self.state, 42, since)
+        self.assertEqual(messages, 2)
+        self.assertAlmostEqual(minutes, 2, delta=0.1)
+        self.assertAlmostEqual(main.activity_since(self.state, 43, since)[1], 5, delta=0.1)
+        self.assertEqual(self.state.stats.names[self.state.stats.slots[42]], 'user42')
+        self.assertEqual(self.state.pending_activity, {})
+
+    async def test_counts_before_a_giveaway_started_stay_out_of_it(self):
+        self.state.activity_epoch = self.state.oldest_epoch = 0.0
+        await main.on_message(FakeMessage(FakeUser(42, self.guild), self.text))
+        main.refresh_activity_epochs(self.state)
+        main.start_activity_epoch(self.state, main.time.time())
+        await main.on_message(FakeMessage(FakeUser(42, self.guild), self.text))
+        self.state.stats
+        self.assertEqual(main.activity_since(self.state, 42)[0], 2)
+        self.assertEqual(main.activity_since(self.state, 42, self.state.activity_epoch)[0], 1)
+
+
+class StartupAuditTests(unittest.IsolatedAsyncioTestCase):
+    async def test_reconcile_is_audited(self):
+        with self.assertLogs(main.audit_logger, 'INFO') as logs:
+            await main.reconcile_all_entrants()
+        self.assertEqual([r.getMessage() for r in logs.records], ['entrants_reconciled'])
+
+
+if __name__ == '__main__':
+    unittest.main()
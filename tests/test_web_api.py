@@ -0,0 +1,83 @@
+"""The keep-alive web server's JSON API.
+
+Run from the repository root with `python -m unittest discover tests`.
+"""
+import os
+import sys
+import tempfile
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.fakes import FakeChannel, FakeGuild, FakeReactionPayload, load_bot_module, make_giveaway
+
+main = load_bot_module(tempfile.mkdtemp(prefix='giveaway-tests-'))
+
+
+class WebApiTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        main.api_cache.entries.clear()
+        self.guild = FakeGuild(720000000000000000)
+        self.mid = make_giveaway(main, 920000000000654321, FakeChannel(340, self.guild), {'min_messages': 5}, [1, 2, 3])
+        self.state = main.state_for(self.guild.id)
+        slot = self.state.stats.slot(42)
+        self.state.stats.messages[slot] = 7
+        self.client = TestClient(TestServer(main.build_web_app()))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        main.remove_giveaway(self.mid)
+        main.guild_states.pop(self.guild.id, None)
+
+    async def get(self, path, status=200):
+        response = await self.client.get(path)
+        self.assertEqual(response.status, status, path)
+        return await response.json()
+
+    async def test_giveaways(self):
+        listed = await self.get('/api/giveaways')
+        summary = next(g for g in listed if g['message_id'] == self.mid)
+        self.assertEqual((summary['entrants'], summary['entrants_synced']), (3, True))
+        self.assertEqual(summary['requirements'], {'min_messages': 5})
+        self.assertEqual(summary['guild_id'], self.guild.id)
+        self.assertEqual(await self.get(f'/api/giveaways/{self.mid}'), summary)
+        self.assertEqual(await self.get('/api/giveaways/654321'), summary)
+        self.assertEqual(await self.get('/api/giveaways/nope', 404), {'error': 'giveaway not found'})
+
+    async def test_responses_are_cached_briefly(self):
+        await self.get('/api/giveaways')
+        main.track_entrant(FakeReactionPayload(int(self.mid), 4, '🎉', self.guild.id), True)
+        hits = main.api_cache.hits
+        listed = await self.get('/api/giveaways')
+        self.assertEqual(main.api_cache.hits, hits + 1)
+        self.assertEqual(next(g for g in listed if g['message_id'] == self.mid)['entrants'], 3)
+        main.api_cache.entries.clear()
+        listed = await self.get('/api/giveaways')
+        self.assertEqual(next(g for g in listed if g['message_id'] == self.mid)['entrants'], 4)
+
+    async def test_user_stats(self):
+        body = await self.get('/api/users/42/stats')
+        self.assertEqual(body['messages'], 7)
+        self.assertEqual(body['guilds'][str(self.guild.id)], {'messages': 7, 'vc_minutes': 0})
+        self.assertEqual(await self.get(f'/api/guilds/{self.guild.id}/users/42/stats'), body)
+        self.assertEqual((await self.get('/api/users/43/stats'))['guilds'], {})
+        self.assertEqual(await self.get('/api/users/abc/stats', 400), {'error': 'user id must be numeric'})
+        self.assertEqual(await self.get('/api/guilds/x/users/42/stats', 400), {'error': 'ids must be numeric'})
+        self.assertEqual(await self.get('/api/guilds/1/users/42/stats', 404), {'error': 'guild not found on this shard'})
+
+    async def test_health_and_keep_alive(self):
+        # No gateway connection in the tests, so the bot reports itself unhealthy
+        body = await self.get('/healthz', 503)
+        self.assertEqual(body['status'], 'unhealthy')
+        self.assertFalse(body['checks']['gateway_ready'])
+        response = await self.client.get('/ping')
+        self.assertEqual(await response.text(), 'pong')
+        response = await self.client.get('/metrics')
+        self.assertEqual(response.status, 200)
+        self.assertIn('giveaway_bot_', await response.text())
+
+
+if __name__ == '__main__':
+    unittest.main()